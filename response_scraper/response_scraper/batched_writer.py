@@ -0,0 +1,171 @@
+import time
+import queue
+import logging
+import threading
+
+from .metrics import counter, histogram
+from .response_archive import ResponseArchive
+
+logger = logging.getLogger(__name__)
+
+BATCH_SECONDS = histogram('writer_batch_seconds', 'Time for a background writer to write and commit one batch')
+ENTRIES = counter('writer_entries_total', 'Entries written by the background writers')
+
+# Marks the end of the queue for the writer thread
+STOP = object()
+
+
+class BatchedWriter:
+    # Keeps file and SQLite writes off the reactor thread. put() only
+    # appends to a bounded queue; a background thread takes entries until
+    # it has batch_size of them or flush_interval seconds have passed since
+    # the first, writes them in one go and commits. close() drains whatever
+    # is queued and waits for the thread. Subclasses open their files in
+    # open(), which runs on the writer thread, so a SQLite connection is
+    # only ever used by the thread that created it.
+
+    def __init__(self, name, batch_size=200, flush_interval=1.0, max_pending=10000):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, entry):
+        # Blocks only when max_pending entries are waiting, i.e. the disk
+        # cannot keep up; the crawl then slows down instead of filling memory
+        if self.error is not None:
+            raise RuntimeError(f"{self.name} stopped: {self.error!r}")
+        self.queue.put(entry)
+
+    def next_batch(self):
+        # (batch, stopping)
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is STOP:
+                return batch, True
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(entry)
+        return batch, False
+
+    def run(self):
+        stopping = False
+        try:
+            self.open()
+            while not stopping:
+                batch, stopping = self.next_batch()
+                if batch:
+                    start = time.perf_counter()
+                    self.write_batch(batch)
+                    BATCH_SECONDS.observe(time.perf_counter() - start, writer=self.name)
+                    ENTRIES.inc(len(batch), writer=self.name)
+            self.finish()
+        except Exception as e:
+            # put() reports the failure to the crawl from now on
+            logger.error(f"{self.name} failed: {e!r}")
+            self.error = e
+            # Keep draining until close(), so a put() blocked on a full queue returns
+            while not stopping:
+                stopping = self.queue.get() is STOP
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def open(self):
+        pass
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class LogWriter(BatchedWriter):
+    # Appends lines to a text file, one write and flush per batch
+
+    def __init__(self, path, batch_size=500, flush_interval=1.0, max_pending=10000):
+        self.path = path
+        self.file = None
+        super(LogWriter, self).__init__('log-writer', batch_size, flush_interval, max_pending)
+
+    def open(self):
+        self.file = open(self.path, 'a')
+
+    def write_batch(self, lines):
+        self.file.write(''.join(lines))
+        self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+class ArchiveWriter(BatchedWriter):
+    # Adds responses to a ResponseArchive of its own and commits once per
+    # batch. Until a batch is committed, readers of the archive do not see
+    # it; queued_hash() covers that gap for the pages still waiting.
+    # mark_processed_many() goes through the same queue, so the flag is
+    # never set before the page's own row is written.
+
+    def __init__(self, archive_dir='output/archive', batch_size=100, flush_interval=1.0, max_pending=1000):
+        self.archive_dir = archive_dir
+        self.archive = None
+        self.lock = threading.Lock()
+        self.queued = {}
+        super(ArchiveWriter, self).__init__('archive-writer', batch_size, flush_interval, max_pending)
+
+    def add(self, url, body, headers=None, status=200, encoding='utf-8', fetched_at=None):
+        # Same arguments as ResponseArchive.add; returns the body's content hash
+        if isinstance(body, str):
+            body = body.encode(encoding or 'utf-8')
+        content_hash = ResponseArchive.hash_body(body)
+        url_hash = ResponseArchive.hash_url(url)
+        with self.lock:
+            self.queued[url_hash] = content_hash
+        self.put({'url': url, 'body': body, 'headers': headers, 'status': status, 'encoding': encoding,
+                  'fetched_at': fetched_at if fetched_at is not None else time.time(), 'content_hash': content_hash})
+        return content_hash
+
+    def mark_processed_many(self, url_hashes):
+        self.put({'processed': list(url_hashes)})
+
+    def queued_hash(self, url_hash):
+        # Content hash of a queued but uncommitted response for url_hash, if any
+        with self.lock:
+            return self.queued.get(url_hash)
+
+    def open(self):
+        self.archive = ResponseArchive(self.archive_dir)
+
+    def write_batch(self, entries):
+        written = []
+        for entry in entries:
+            if 'processed' in entry:
+                self.archive.mark_processed_many(entry['processed'])
+            else:
+                written.append((self.archive.add(**entry), entry['content_hash']))
+        self.archive.commit()
+        with self.lock:
+            for url_hash, content_hash in written:
+                # A newer version of the page may have been queued meanwhile
+                if self.queued.get(url_hash) == content_hash:
+                    del self.queued[url_hash]
+
+    def finish(self):
+        self.archive.close()
@@ -0,0 +1,74 @@
+import hashlib
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+# One spelling per page, shared by the spider (requests, crawl state and
+# archive keys) and the link tables in scripts/. Two URLs that only differ
+# by fragment, tracking parameters, parameter order, host case, www.,
+# default port or a trailing slash canonicalize to the same string.
+
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+    'igshid', 'yclid', 'ref_src', 'cmpid'
+}
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url, base_url=None):
+    if base_url:
+        url = urljoin(base_url, url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https'):
+        # mailto:, javascript:, tel: and friends are left alone
+        return url
+
+    host = (parts.hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    netloc = f'[{host}]' if ':' in host else host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if not is_tracking_param(name)]
+    query.sort()
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+def url_key(url):
+    # Dedupe key: the canonical URL without its scheme, so the http and
+    # https spellings of a page count once
+    canonical = canonicalize_url(url)
+    return hashlib.md5(canonical.split('://', 1)[-1].encode()).digest()[:8]
+
+class Frontier:
+    # URLs already requested during this crawl, kept as 8-byte keys of the
+    # canonical form so the set stays small on large crawls
+    def __init__(self):
+        self.seen = set()
+        self.dropped = 0
+
+    def add(self, url):
+        # True if the URL was not seen before
+        key = url_key(url)
+        if key in self.seen:
+            self.dropped += 1
+            return False
+        self.seen.add(key)
+        return True
+
+    def __contains__(self, url):
+        return url_key(url) in self.seen
+
+    def __len__(self):
+        return len(self.seen)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+
+class CrawlStateStore:
+    # Persistent record of every URL the spider has fetched. Rows are keyed by
+    # the md5 of the URL (the same hash save_response uses for file names), so
+    # membership checks are a single primary-key lookup and opening the store
+    # does not depend on how long the crawl history is.
+
+    # Revisit interval bounds in seconds; the interval halves when a page
+    # changed since the last visit and doubles when it did not
+    DEFAULT_REVISIT_INTERVAL = 24 * 3600
+    MIN_REVISIT_INTERVAL = 3600
+    MAX_REVISIT_INTERVAL = 30 * 24 * 3600
+
+    def __init__(self, db_path='logs/crawl_state.db', batch_size=50, legacy_path=None):
+        database_dir = os.path.dirname(db_path)
+        # The old visited_urls.json was written next to the crawl state
+        if legacy_path is None:
+            legacy_path = os.path.join(database_dir, 'visited_urls.json')
+        if database_dir and not os.path.exists(database_dir):
+            os.makedirs(database_dir)
+
+        is_new = not os.path.exists(db_path)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = {}
+        self.pending_schedule = {}
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS visited_urls (
+            url_hash TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            depth INTEGER,
+            status INTEGER,
+            fetched_at REAL
+        ) WITHOUT ROWID
+        ''')
+        self.add_missing_columns({
+            'checks': 'INTEGER DEFAULT 0',
+            'changes': 'INTEGER DEFAULT 0',
+            'revisit_interval': 'REAL',
+            'next_visit_at': 'REAL'
+        })
+        self.conn.commit()
+
+        # One-off import of the set written by the old save_visited_urls
+        if is_new and legacy_path and os.path.exists(legacy_path):
+            self.import_legacy(legacy_path)
+
+    def add_missing_columns(self, columns):
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(visited_urls)').fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.conn.execute(f'ALTER TABLE visited_urls ADD COLUMN {name} {definition}')
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.md5(url.encode()).hexdigest()
+
+    def record(self, url, depth=None, status=None, fetched_at=None):
+        url_hash = self.hash_url(url)
+        if fetched_at is None:
+            fetched_at = time.time()
+        previous = self.pending.get(url_hash)
+        if previous:
+            if depth is None or (previous[2] is not None and previous[2] < depth):
+                depth = previous[2]
+            if status is None:
+                status = previous[3]
+        self.pending[url_hash] = (url_hash, url, depth, status, fetched_at)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def schedule(self, url, changed, checked_at=None):
+        # Record the outcome of a revisit; applied after the visit rows on flush
+        url_hash = self.hash_url(url)
+        self.pending_schedule[url_hash] = (1 if changed else 0, checked_at if checked_at is not None else time.time())
+        if url_hash not in self.pending:
+            self.record(url)
+        elif len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def is_due(self, url, now=None):
+        url_hash = self.hash_url(url)
+        if url_hash in self.pending_schedule:
+            return False
+        row = self.conn.execute('SELECT next_visit_at FROM visited_urls WHERE url_hash = ?', (url_hash,)).fetchone()
+        if row is None or row[0] is None:
+            return True
+        return row[0] <= (now if now is not None else time.time())
+
+    def flush(self):
+        if not self.pending and not self.pending_schedule:
+            return
+        self.conn.executemany('''
+        INSERT INTO visited_urls (url_hash, url, depth, status, fetched_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(url_hash) DO UPDATE SET
+            depth = COALESCE(MIN(visited_urls.depth, excluded.depth), excluded.depth, visited_urls.depth),
+            status = COALESCE(excluded.status, visited_urls.status),
+            fetched_at = excluded.fetched_at
+        ''', list(self.pending.values()))
+        interval = '''
+            CASE
+                WHEN revisit_interval IS NULL THEN :default
+                WHEN :changed THEN MAX(:min, revisit_interval / 2.0)
+                ELSE MIN(:max, revisit_interval * 2.0)
+            END
+        '''
+        self.conn.executemany(f'''
+        UPDATE visited_urls SET
+            checks = COALESCE(checks, 0) + 1,
+            changes = COALESCE(changes, 0) + :changed,
+            next_visit_at = :checked_at + {interval},
+            revisit_interval = {interval}
+        WHERE url_hash = :url_hash
+        ''', [{
+            'url_hash': url_hash,
+            'changed': changed,
+            'checked_at': checked_at,
+            'default': self.DEFAULT_REVISIT_INTERVAL,
+            'min': self.MIN_REVISIT_INTERVAL,
+            'max': self.MAX_REVISIT_INTERVAL
+        } for url_hash, (changed, checked_at) in self.pending_schedule.items()])
+        self.conn.commit()
+        self.pending.clear()
+        self.pending_schedule.clear()
+
+    def __contains__(self, url):
+        url_hash = self.hash_url(url)
+        if url_hash in self.pending:
+            return True
+        row = self.conn.execute('SELECT 1 FROM visited_urls WHERE url_hash = ?', (url_hash,)).fetchone()
+        return row is not None
+
+    def get(self, url):
+        url_hash = self.hash_url(url)
+        if url_hash in self.pending:
+            row = self.pending[url_hash]
+        else:
+            row = self.conn.execute('''
+            SELECT url_hash, url, depth, status, fetched_at FROM visited_urls WHERE url_hash = ?
+            ''', (url_hash,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'url_hash': row[0],
+            'url': row[1],
+            'depth': row[2],
+            'status': row[3],
+            'fetched_at': row[4]
+        }
+
+    def import_legacy(self, legacy_path):
+        with open(legacy_path, 'r') as file:
+            urls = json.load(file)
+        for url in urls:
+            self.record(url)
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
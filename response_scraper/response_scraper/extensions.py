@@ -0,0 +1,90 @@
+# Scrapy extensions for this project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import logging
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from .metrics import REGISTRY, StageProfiler, counter, histogram
+
+logger = logging.getLogger(__name__)
+
+FETCH_SECONDS = histogram('crawl_fetch_seconds', 'Download latency per domain')
+RESPONSE_BYTES = counter('crawl_response_bytes_total', 'Response body bytes downloaded per domain')
+RESPONSES = counter('crawl_responses_total', 'Downloaded responses per domain and status')
+
+
+class MetricsExtension:
+    # Records fetch latency, bytes and statuses per domain into the metrics
+    # registry, alongside what the spider, pipeline and BulkWriter record
+    # there, and exports all of it: to METRICS_TEXTFILE every
+    # METRICS_EXPORT_INTERVAL seconds and at close, and on
+    # http://127.0.0.1:METRICS_PORT/metrics if set. METRICS_PROFILE
+    # (cprofile or pyinstrument) profiles the reactor process for the whole
+    # crawl; parse workers are separate processes and not included.
+
+    def __init__(self, textfile, port, interval, profiler, profile_dir):
+        self.textfile = textfile
+        self.port = port
+        self.interval = interval
+        self.profiler = StageProfiler('crawl', profiler, profile_dir) if profiler else None
+        self.exporter = None
+        self.server = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        extension = cls(
+            textfile=settings.get('METRICS_TEXTFILE', 'output/metrics/crawl.prom'),
+            port=settings.getint('METRICS_PORT') or None,
+            interval=settings.getfloat('METRICS_EXPORT_INTERVAL', 15.0),
+            profiler=settings.get('METRICS_PROFILE'),
+            profile_dir=settings.get('METRICS_PROFILE_DIR', 'output/profiles'),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        # response_downloaded fires before the downloader middlewares, so it sees
+        # the 429s that retries swallow and never sees archive replays
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        return extension
+
+    def spider_opened(self, spider):
+        if self.profiler is not None:
+            self.profiler.start()
+        if self.port:
+            self.server = REGISTRY.serve(self.port)
+        if self.textfile:
+            self.exporter = task.LoopingCall(self.export)
+            self.exporter.start(self.interval, now=False)
+
+    def response_downloaded(self, response, request, spider):
+        domain = urlparse(response.url).netloc.replace("www.", "")
+        RESPONSES.inc(domain=domain, status=response.status)
+        RESPONSE_BYTES.inc(len(response.body), domain=domain)
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            FETCH_SECONDS.observe(latency, domain=domain)
+
+    def export(self):
+        try:
+            REGISTRY.write_textfile(self.textfile)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {self.textfile}: {e}")
+
+    def spider_closed(self, spider, reason):
+        if self.exporter is not None and self.exporter.running:
+            self.exporter.stop()
+        if self.textfile:
+            self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.profiler is not None:
+            self.profiler.stop()
@@ -7,6 +7,22 @@ import scrapy
 
 
 class ResponseScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # One fetched page, in the record shape ResponseArchive returns so the
+    # extractors in scripts/ take it unchanged. body is the raw bytes and
+    # encoding the one Scrapy already detected, so nothing is re-read from
+    # disk or re-sniffed before parsing.
+    url = scrapy.Field()
+    url_hash = scrapy.Field()
+    status = scrapy.Field()
+    headers = scrapy.Field()
+    encoding = scrapy.Field()
+    body = scrapy.Field()
+    depth = scrapy.Field()
+    fetched_at = scrapy.Field()
+    # sha256 of body, as the archive stores it; the archive row itself may
+    # still be queued in the spider's ArchiveWriter
+    content_hash = scrapy.Field()
+
+    def __repr__(self):
+        # Keep whole pages out of the "Scraped from" debug log
+        return repr({key: value for key, value in self.items() if key != 'body'})
@@ -0,0 +1,252 @@
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and histograms shared by the crawl (extensions.py) and the ingest
+# scripts, exported in the Prometheus text format: to a file for
+# node_exporter's textfile collector, or over HTTP at /metrics. Metrics live
+# in the process that records them; parse workers send their timings back
+# with their documents instead of keeping registries of their own.
+
+# Seconds; wide enough for page parses, batch inserts and slow fetches alike
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILERS = ('cprofile', 'pyinstrument')
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(label_key(labels), 0)
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield f'{self.name}{format_labels(key)} {value}'
+
+class Histogram:
+    # With sample_every=N, time() measures one call in N and skips the
+    # clock reads for the rest; observe() always records
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, sample_every=1):
+        self.name = name
+        self.help = help if sample_every <= 1 else f'{help} (1 in {sample_every} sampled)'
+        self.buckets = tuple(buckets)
+        self.sample_every = sample_every
+        self.calls = 0
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def sampled(self):
+        if self.sample_every <= 1:
+            return True
+        # Unlocked; a miscount under threads only shifts which call is sampled
+        self.calls += 1
+        return self.calls % self.sample_every == 0
+
+    @contextmanager
+    def time(self, **labels):
+        if not self.sampled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            series = [(key, dict(values, buckets=list(values['buckets']))) for key, values in self.series.items()]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values['buckets']):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(key, [("le", repr(float(bound)))])} {cumulative}'
+            yield f'{self.name}_bucket{format_labels(key, [("le", "+Inf")])} {values["count"]}'
+            yield f'{self.name}_sum{format_labels(key)} {values["sum"]}'
+            yield f'{self.name}_count{format_labels(key)} {values["count"]}'
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, cls, name, help, **options):
+        # The same name always returns the same metric, so modules can share one
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **options)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help=''):
+        return self.register(Counter, name, help)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS, sample_every=1):
+        return self.register(Histogram, name, help, buckets=buckets, sample_every=sample_every)
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # Written to a temporary file and renamed, so a collector never reads half a file
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        # /metrics on a daemon thread; call shutdown() on the returned server to stop it
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+@contextmanager
+def exporting(textfile=None, port=None, interval=15.0, registry=REGISTRY):
+    # For the batch scripts: serve the registry and rewrite the textfile
+    # every interval seconds while the block runs, then once more at the end
+    server = registry.serve(port) if port is not None else None
+    stop = threading.Event()
+    writer = None
+    if textfile:
+        def write_periodically():
+            while not stop.wait(interval):
+                registry.write_textfile(textfile)
+
+        writer = threading.Thread(target=write_periodically, name='metrics-textfile', daemon=True)
+        writer.start()
+    try:
+        yield registry
+    finally:
+        stop.set()
+        if writer is not None:
+            writer.join()
+            registry.write_textfile(textfile)
+            logging.info(f"Metrics written to {textfile}")
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+class StageProfiler:
+    # cProfile (<name>.prof, for pstats or snakeviz) or pyinstrument
+    # (<name>.html) around one stage. Without a profiler it does nothing.
+
+    def __init__(self, name, profiler=None, output_dir='output/profiles'):
+        if profiler and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {profiler} (expected one of {PROFILERS})")
+        self.name = name
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.active = None
+
+    def start(self):
+        if self.profiler == 'cprofile':
+            import cProfile
+            self.active = cProfile.Profile()
+            self.active.enable()
+        elif self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError("Profiling with pyinstrument requires pyinstrument: pip install pyinstrument")
+            self.active = Profiler()
+            self.active.start()
+
+    def stop(self):
+        if self.active is None:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.profiler == 'cprofile':
+            self.active.disable()
+            path = os.path.join(self.output_dir, f'{self.name}.prof')
+            self.active.dump_stats(path)
+        else:
+            self.active.stop()
+            path = os.path.join(self.output_dir, f'{self.name}.html')
+            with open(path, 'w') as file:
+                file.write(self.active.output_html())
+        self.active = None
+        logging.info(f"Profile of {self.name} written to {path}")
+        return path
+
+@contextmanager
+def profile_stage(name, profiler=None, output_dir='output/profiles'):
+    stage = StageProfiler(name, profiler, output_dir)
+    stage.start()
+    try:
+        yield stage
+    finally:
+        stage.stop()
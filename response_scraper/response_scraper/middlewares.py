@@ -3,11 +3,28 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import re
+import time
+from urllib.parse import urlparse
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured, StopDownload
+from scrapy.http import HtmlResponse, Response
+from scrapy.http.request import NO_CALLBACK
+from twisted.internet.error import TimeoutError, TCPTimedOutError
+
+from .canonical import canonicalize_url
+from .metrics import counter
+from .retry import RetryPolicy
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+# Sent when the spider opens, with throttle=PerDomainThrottleMiddleware, so
+# DomainThrottleQueue gets the throttle without looking through the
+# downloader's middleware list
+domain_throttle_opened = object()
+
 
 class ResponseScraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +118,421 @@ class ResponseScraperDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class DomainThrottle:
+    # Token bucket plus an adaptive concurrency limit for one domain. The rate
+    # and concurrency grow additively while the host answers quickly and are
+    # halved when it returns 429/503 or times out.
+
+    def __init__(self, rate, burst, concurrency, min_rate, max_rate, max_concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.latency = None
+        self.responses = 0
+        self.errors = 0
+        self.paused_until = 0
+
+    def pause_until(self, timestamp):
+        # Retry-After applies to the whole host, not only the retried request
+        self.paused_until = max(self.paused_until, timestamp)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self):
+        # Seconds until the domain may send its next request
+        self.refill()
+        paused = max(0, self.paused_until - time.time())
+        if self.tokens >= 1:
+            return paused
+        return max(paused, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        # Take a token, going into debt if none is left
+        self.refill()
+        self.tokens -= 1
+
+    def record_success(self, latency, target_latency):
+        self.responses += 1
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.latency <= target_latency:
+            self.rate = min(self.max_rate, self.rate + self.min_rate)
+            if self.responses % 10 == 0:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        elif self.latency > 2 * target_latency:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+
+    def record_failure(self):
+        self.errors += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.concurrency = max(1, self.concurrency // 2)
+        self.tokens = min(self.tokens, 0)
+
+
+class PerDomainThrottleMiddleware(ResponseScraperDownloaderMiddleware):
+    # Replaces the single DOWNLOAD_DELAY/AutoThrottle setting with a separate
+    # budget per domain. The waiting happens in the scheduler:
+    # DomainThrottleQueue (throttle_queue.py) only hands out a domain's
+    # requests while it has a token and room under its concurrency limit,
+    # so a request never sits in the downloader, holding one of the
+    # CONCURRENT_REQUESTS slots, until its domain is ready. This middleware
+    # takes the token, adapts rate and concurrency to the responses, and
+    # keeps the domain's downloader slot at the same concurrency.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_rate = settings.getfloat('DOMAIN_THROTTLE_START_RATE', 0.5)
+        self.min_rate = settings.getfloat('DOMAIN_THROTTLE_MIN_RATE', 0.05)
+        self.max_rate = settings.getfloat('DOMAIN_THROTTLE_MAX_RATE', 4.0)
+        self.burst = settings.getfloat('DOMAIN_THROTTLE_BURST', 2.0)
+        self.start_concurrency = settings.getint('DOMAIN_THROTTLE_START_CONCURRENCY', 1)
+        self.max_concurrency = settings.getint('DOMAIN_THROTTLE_MAX_CONCURRENCY', settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8))
+        self.target_latency = settings.getfloat('DOMAIN_THROTTLE_TARGET_LATENCY', 1.0)
+        self.domains = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DOMAIN_THROTTLE_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.announce, signal=signals.spider_opened)
+        return s
+
+    def announce(self, spider):
+        # The scheduler's queues exist by now and nothing has been popped yet
+        self.crawler.signals.send_catch_log(signal=domain_throttle_opened, throttle=self)
+
+    @staticmethod
+    def domain_for(request):
+        return urlparse(request.url).netloc.replace("www.", "")
+
+    def throttle_for(self, domain):
+        throttle = self.domains.get(domain)
+        if throttle is None:
+            throttle = DomainThrottle(self.start_rate, self.burst, self.start_concurrency,
+                                      self.min_rate, self.max_rate, self.max_concurrency)
+            self.domains[domain] = throttle
+            # The downloader reads DOWNLOAD_SLOTS when it creates a slot, so
+            # the domain's slot starts at the throttle's concurrency rather
+            # than CONCURRENT_REQUESTS_PER_DOMAIN
+            per_slot_settings = self.crawler.engine.downloader.per_slot_settings
+            per_slot_settings[domain] = dict(per_slot_settings.get(domain, {}), concurrency=throttle.concurrency, delay=0)
+        return throttle
+
+    def apply_to_slot(self, request, throttle):
+        # The token bucket does the pacing; the slot only enforces concurrency
+        key = request.meta.get('download_slot')
+        downloader = self.crawler.engine.downloader
+        if key in downloader.per_slot_settings:
+            downloader.per_slot_settings[key]['concurrency'] = throttle.concurrency
+        slot = downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = 0
+            slot.concurrency = throttle.concurrency
+
+    def record_stats(self, domain, throttle):
+        self.stats.set_value(f'domain_throttle/{domain}/rate', round(throttle.rate, 3))
+        self.stats.set_value(f'domain_throttle/{domain}/concurrency', throttle.concurrency)
+        if throttle.latency is not None:
+            self.stats.set_value(f'domain_throttle/{domain}/latency_ms', round(throttle.latency * 1000))
+        self.stats.set_value(f'domain_throttle/{domain}/responses', throttle.responses)
+        self.stats.set_value(f'domain_throttle/{domain}/errors', throttle.errors)
+
+    def process_request(self, request, spider):
+        domain = self.domain_for(request)
+        # Group www.example.gov and example.gov in one downloader slot
+        request.meta.setdefault('download_slot', domain)
+        # DomainThrottleQueue released the request because a token was free
+        self.throttle_for(domain).reserve()
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'archived' in response.flags or 'content_skipped' in response.flags:
+            # Served from the archive by ConditionalRecrawlMiddleware, or
+            # skipped by ContentFilterMiddleware; never hit the host
+            return response
+        domain = self.domain_for(request)
+        throttle = self.throttle_for(domain)
+        if response.status in (429, 503):
+            throttle.record_failure()
+        else:
+            throttle.record_success(request.meta.get('download_latency', 0), self.target_latency)
+        self.apply_to_slot(request, throttle)
+        self.record_stats(domain, throttle)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, (TimeoutError, TCPTimedOutError)):
+            domain = self.domain_for(request)
+            throttle = self.throttle_for(domain)
+            throttle.record_failure()
+            self.apply_to_slot(request, throttle)
+            self.record_stats(domain, throttle)
+        return None
+
+
+class ThrottleRetryMiddleware(ResponseScraperDownloaderMiddleware):
+    # Retries throttled responses, 429 and 503, for every request the
+    # spider makes. RetryPolicy sets the new request's not-before time
+    # from Retry-After, or from a jittered backoff when there is no
+    # Retry-After. DomainThrottleQueue holds back the request, and the rest
+    # of its domain, until that time. Neither status is in
+    # RETRY_HTTP_CODES, so RetryMiddleware does not retry them
+    # immediately. Once RetryPolicy gives up, the response goes on to
+    # HttpErrorMiddleware and the request's errback like any other error.
+
+    def __init__(self, crawler):
+        self.policy = RetryPolicy.from_crawler(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('THROTTLE_RETRY_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_response(self, request, response, spider):
+        if response.status not in (429, 503) or request.meta.get('dont_retry'):
+            return response
+        retry = self.policy.retry_request(request, response)
+        if retry is None:
+            spider.logger.error('Giving up on %s after %s throttled retries', response.url, request.meta.get('throttle_retry_times', 0))
+            # Whatever RETRY_HTTP_CODES says, RetryMiddleware must not try it again
+            request.meta['dont_retry'] = True
+            return response
+        spider.logger.info('%s throttled on %s, retrying after %.1fs', response.status, response.url,
+                           max(0, retry.meta['retry_not_before'] - time.time()))
+        return retry
+
+
+class ConditionalRecrawlMiddleware(ResponseScraperDownloaderMiddleware):
+    # Incremental re-crawls. A URL already in the spider's archive is only
+    # fetched once its revisit time in the crawl state has passed; before
+    # that the archived body is replayed without touching the network. When
+    # it is fetched, the ETag/Last-Modified saved with the archived response
+    # are sent back, and a 304 is turned into the archived body so the
+    # spider can follow its links without saving or re-processing it.
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONDITIONAL_RECRAWL_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    @staticmethod
+    def header_value(headers, name):
+        # Archived header names keep whatever case the server used
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value[0] if isinstance(value, list) else value
+        return None
+
+    def archived_response(self, request, spider, flag):
+        record = spider.archive.get_url(canonicalize_url(request.url))
+        if record is None:
+            return None
+        return HtmlResponse(url=request.url, body=record['body'], encoding=record['encoding'] or 'utf-8',
+                            request=request, flags=['archived', flag])
+
+    def process_request(self, request, spider):
+        if not getattr(spider, 'recrawl', False) or request.method != 'GET':
+            return None
+        url = canonicalize_url(request.url)
+        metadata = spider.archive.get_metadata(spider.archive.hash_url(url))
+        if metadata is None:
+            return None
+
+        if not spider.crawl_state.is_due(url):
+            self.stats.inc_value('recrawl/not_due')
+            self.stats.inc_value('recrawl/bytes_saved', metadata['size'] or 0)
+            return self.archived_response(request, spider, 'not_due')
+
+        etag = self.header_value(metadata['headers'], 'etag')
+        last_modified = self.header_value(metadata['headers'], 'last-modified')
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        if etag or last_modified:
+            self.stats.inc_value('recrawl/conditional_requests')
+            request.meta['handle_httpstatus_list'] = list(request.meta.get('handle_httpstatus_list', [])) + [304]
+            request.meta['recrawl_size'] = metadata['size'] or 0
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status != 304 or 'recrawl_size' not in request.meta:
+            return response
+        self.stats.inc_value('recrawl/not_modified')
+        self.stats.inc_value('recrawl/bytes_saved', request.meta['recrawl_size'])
+        return self.archived_response(request, spider, 'not_modified') or response
+
+
+REJECTED = counter('crawl_content_rejected_total', 'Responses cut off after their headers or skipped unfetched, by reason')
+BYTES_SAVED = counter('crawl_bytes_saved_total', 'Body bytes not downloaded thanks to the content filter, per domain')
+
+
+def url_pattern(url):
+    # Path with digit runs collapsed, so only URLs that differ in their
+    # numbers share a pattern: /files/2023/report-1.pdf -> /files/*/report-*.pdf,
+    # /video/12345 -> /video/*, /document/about stays as it is
+    path = urlparse(url).path or '/'
+    return re.sub(r'[0-9]+', '*', path)
+
+
+class ContentFilterMiddleware(ResponseScraperDownloaderMiddleware):
+    # is_valid_link only knows file extensions, so extensionless links to
+    # PDFs, videos and archives used to be downloaded in full and dropped by
+    # the spider. This middleware looks at Content-Type and Content-Length
+    # as soon as the headers arrive (headers_received) and stops the
+    # download of anything that is not HTML or is over
+    # CONTENT_FILTER_MAX_SIZE; bodies without a Content-Length are counted
+    # as they stream in (bytes_received). Waiting for the GET's headers
+    # saves the same bytes as a HEAD probe without the extra round trip.
+    #
+    # Outcomes are remembered per host and url_pattern(). Once a pattern has
+    # been rejected at least CONTENT_FILTER_LEARN_AFTER times, and rejections
+    # make up at least CONTENT_FILTER_LEARN_SHARE of its responses, its URLs
+    # are skipped without a request. Every CONTENT_FILTER_PROBE_EVERY-th
+    # skipped URL is still fetched, so a pattern that turns out to serve
+    # HTML is unlearned. Both changes are logged. Rejected and skipped
+    # requests reach the spider as empty, non-HTML responses flagged
+    # 'content_rejected' or 'content_skipped', which parse() already ignores.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.max_size = settings.getint('CONTENT_FILTER_MAX_SIZE', 5 * 1024 * 1024)
+        self.allowed_types = tuple(settings.getlist('CONTENT_FILTER_ALLOWED_TYPES', ['text/html', 'application/xhtml+xml']))
+        self.learn_after = settings.getint('CONTENT_FILTER_LEARN_AFTER', 3)
+        self.learn_share = settings.getfloat('CONTENT_FILTER_LEARN_SHARE', 0.9)
+        self.probe_every = settings.getint('CONTENT_FILTER_PROBE_EVERY', 10)
+        self.patterns = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONTENT_FILTER_ENABLED', True):
+            raise NotConfigured
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(s.bytes_received, signal=signals.bytes_received)
+        return s
+
+    @staticmethod
+    def applies_to(request):
+        # Internal downloads such as robots.txt have no callback and are never parsed
+        return request.callback is not NO_CALLBACK and not request.meta.get('skip_content_filter')
+
+    def pattern_for(self, request):
+        domain = PerDomainThrottleMiddleware.domain_for(request)
+        patterns = self.patterns.setdefault(domain, {})
+        key = url_pattern(request.url)
+        if key not in patterns:
+            patterns[key] = {'pattern': key, 'html': 0, 'rejected': 0, 'bytes_saved': 0, 'content_type': None, 'skipped': 0, 'learned': False}
+        return domain, patterns[key]
+
+    def update_learned(self, domain, pattern, spider):
+        rejected = pattern['rejected']
+        learned = rejected >= self.learn_after and rejected >= self.learn_share * (rejected + pattern['html'])
+        if learned != pattern['learned']:
+            pattern['learned'] = learned
+            if learned:
+                spider.logger.info('Content filter: skipping %s on %s after %s non-HTML and %s HTML responses',
+                                   pattern['pattern'], domain, rejected, pattern['html'])
+            else:
+                spider.logger.info('Content filter: fetching %s on %s again, %s of its responses were HTML',
+                                   pattern['pattern'], domain, pattern['html'])
+
+    def reject(self, request, reason, bytes_saved):
+        request.meta['content_rejected'] = reason
+        request.meta['content_bytes_saved'] = bytes_saved
+        raise StopDownload(fail=False)
+
+    def headers_received(self, headers, body_length, request, spider):
+        if not self.applies_to(request):
+            return
+        content_type = (headers.get(b'Content-Type') or b'').decode('latin-1').split(';', 1)[0].strip().lower()
+        request.meta['content_type'] = content_type
+        try:
+            length = int(headers.get(b'Content-Length') or -1)
+        except ValueError:
+            length = -1
+        request.meta['content_length'] = length
+        # No Content-Type: leave it to Scrapy's sniffing
+        if content_type and not content_type.startswith(self.allowed_types):
+            self.reject(request, 'type', max(length, 0))
+        if self.max_size and length > self.max_size:
+            self.reject(request, 'size', length)
+
+    def bytes_received(self, data, request, spider):
+        # Only streamed bodies of unknown length need counting
+        if request.meta.get('content_length', 0) != -1 or not self.applies_to(request) or not self.max_size:
+            return
+        received = request.meta.get('content_bytes_received', 0) + len(data)
+        request.meta['content_bytes_received'] = received
+        if received > self.max_size:
+            # What is left of the body is unknown; nothing is claimed as saved
+            self.reject(request, 'size', 0)
+
+    def process_request(self, request, spider):
+        # Left over from an earlier attempt when a retry copied the meta
+        for key in ('content_rejected', 'content_bytes_saved', 'content_type', 'content_length', 'content_bytes_received'):
+            request.meta.pop(key, None)
+        if not self.applies_to(request):
+            return None
+        domain, pattern = self.pattern_for(request)
+        if pattern['learned']:
+            pattern['skipped'] += 1
+            if self.probe_every and pattern['skipped'] % self.probe_every == 0:
+                self.stats.inc_value('content_filter/probes')
+                return None
+            estimate = pattern['bytes_saved'] // pattern['rejected']
+            self.stats.inc_value('content_filter/skipped')
+            self.stats.inc_value('content_filter/bytes_saved', estimate)
+            REJECTED.inc(reason='skipped')
+            BYTES_SAVED.inc(estimate, domain=domain)
+            return Response(url=request.url, status=200, request=request, flags=['content_skipped'],
+                            headers={'Content-Type': pattern['content_type'] or 'application/octet-stream'})
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'content_skipped' in response.flags or not self.applies_to(request) or not 200 <= response.status < 300:
+            return response
+        domain, pattern = self.pattern_for(request)
+        reason = request.meta.get('content_rejected')
+        if reason is None:
+            pattern['html'] += 1
+            self.update_learned(domain, pattern, spider)
+            return response
+
+        bytes_saved = request.meta.get('content_bytes_saved', 0)
+        pattern['rejected'] += 1
+        pattern['bytes_saved'] += bytes_saved
+        pattern['content_type'] = request.meta.get('content_type')
+        self.update_learned(domain, pattern, spider)
+        self.stats.inc_value(f'content_filter/rejected/{reason}')
+        self.stats.inc_value('content_filter/bytes_saved', bytes_saved)
+        REJECTED.inc(reason=reason)
+        BYTES_SAVED.inc(bytes_saved, domain=domain)
+        # A cut-off HTML page must not be archived as if it were whole
+        return Response(url=response.url, status=response.status, headers=response.headers, request=request,
+                        flags=response.flags + ['content_rejected'])
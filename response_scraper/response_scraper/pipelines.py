@@ -3,11 +3,171 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import logging
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, task
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from .metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+PARSE_SECONDS = histogram('parse_document_seconds', 'Time to extract one archived response, measured in the parse worker')
+DOCUMENTS = counter('ingest_documents_total', 'Archived responses ingested, by outcome')
+
 
 class ResponseScraperPipeline:
+    # Parses pages while the crawl runs instead of leaving them to
+    # process_html_files. Extraction runs in a process pool and the item's
+    # Deferred fires when its document is back, so the reactor keeps
+    # downloading meanwhile. Rows are buffered in a BulkWriter and committed
+    # every STREAM_PIPELINE_TRANSACTION_SIZE rows or FLUSH_INTERVAL seconds,
+    # whichever comes first; the ingestion ledger entry commits with the
+    # rows and the archive entry is then marked processed, so the batch
+    # scripts skip it. Pages are fingerprinted in the workers and
+    # near-duplicates of pages already stored (scripts/near_duplicates.py)
+    # are recorded but not parsed into the other tables, as in the batch
+    # scripts; STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE = None keeps them all.
+
+    def __init__(self, db_path, workers, transaction_size, flush_interval, parser, near_duplicate_distance=3):
+        # The extractors and writer live in scripts/, importable when the
+        # crawl is started from the repository root (run_spider.py). An
+        # enabled pipeline that cannot load them stops the crawl rather than
+        # leaving pages unparsed without a word.
+        try:
+            from scripts import html_extraction, lxml_extraction
+            from scripts.bulk_writer import BulkWriter
+            from scripts.ingest_ledger import IngestLedger, clear_page
+            from scripts.near_duplicates import NearDuplicateFilter, with_fingerprint
+            from scripts.process_html_files import store_document
+            from scripts.setup_sql_database import setup_databases
+        except ImportError as e:
+            raise ImportError(f"The streaming pipeline needs the scripts package ({e}): start the crawl from the repository root "
+                              f"with run_spider.py, or set STREAM_PIPELINE_ENABLED = False") from e
+        # Workers time their own extraction and return it as parse_seconds
+        extractor = {'lxml': lxml_extraction.extract_document, 'bs4': html_extraction.extract_document}[parser]
+        if near_duplicate_distance is not None:
+            extractor = partial(with_fingerprint, extractor)
+        self.extractor = partial(html_extraction.extract_timed, extractor)
+        self.parser = parser
+        self.near_duplicate_distance = near_duplicate_distance
+        self.near_duplicate_filter = NearDuplicateFilter
+        self.bulk_writer = BulkWriter
+        self.ingest_ledger = IngestLedger
+        self.clear_page = clear_page
+        self.store_document = store_document
+        self.setup_databases = setup_databases
+        self.db_path = db_path
+        self.workers = workers
+        self.transaction_size = transaction_size
+        self.flush_interval = flush_interval
+        self.executor = None
+        self.writer = None
+        self.ledger = None
+        self.duplicates = None
+        self.flusher = None
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # Fallbacks are settings.py's values, which run_spider.py does not load
+        settings = crawler.settings
+        if not settings.getbool('STREAM_PIPELINE_ENABLED', True):
+            raise NotConfigured
+        pipeline = cls(
+            db_path=settings.get('STREAM_PIPELINE_DB_PATH', 'web_scraping/database/web_scraping.db'),
+            workers=settings.getint('STREAM_PIPELINE_WORKERS', 2),
+            transaction_size=settings.getint('STREAM_PIPELINE_TRANSACTION_SIZE', 500),
+            flush_interval=settings.getfloat('STREAM_PIPELINE_FLUSH_INTERVAL', 5.0),
+            parser=settings.get('STREAM_PIPELINE_PARSER', 'lxml'),
+            near_duplicate_distance=cls.distance_setting(settings.get('STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE', 3)),
+        )
+        pipeline.stats = crawler.stats
+        return pipeline
+
+    @staticmethod
+    def distance_setting(value):
+        # None or an empty value (-s STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE=) disables the filter
+        return None if value in (None, '') else int(value)
+
+    def open_spider(self, spider):
+        self.setup_databases(self.db_path)
+        # Workers are spawned rather than forked from a process running the reactor's threads
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.writer = self.bulk_writer(self.db_path, transaction_size=self.transaction_size)
+        # Only commit() is used here; it marks pages processed through the
+        # spider's archive writer, which may not have written them yet
+        self.ledger = self.ingest_ledger(self.db_path, spider.archive_writer, worker_id=f'crawl-{os.getpid()}')
+        if self.near_duplicate_distance is not None:
+            self.duplicates = self.near_duplicate_filter(self.writer, self.near_duplicate_distance)
+        self.flusher = task.LoopingCall(self.writer.flush)
+        self.flusher.start(self.flush_interval, now=False)
+
+    def extract(self, record):
+        # Deferred that fires on the reactor thread with the worker's result
+        from twisted.internet import reactor
+        d = defer.Deferred()
+
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                reactor.callFromThread(d.errback, error)
+            else:
+                reactor.callFromThread(d.callback, future.result())
+
+        self.executor.submit(self.extractor, record).add_done_callback(done)
+        return d
+
+    @defer.inlineCallbacks
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        record = adapter.asdict()
+        try:
+            document = yield self.extract(record)
+        except Exception as e:
+            # Left unprocessed in the archive for the batch scripts to retry
+            logger.error(f"Extraction failed for {record['url']}: {e}")
+            self.stats.inc_value('stream_pipeline/failed')
+            DOCUMENTS.inc(outcome='failed')
+            return item
+        PARSE_SECONDS.observe(document['parse_seconds'], parser=self.parser)
+        self.store(record, document)
+
+        # The body is in the archive; do not carry it on to exporters
+        adapter['body'] = None
         return item
+
+    def store(self, record, document):
+        # Same bookkeeping as the batch scripts: a re-crawled page replaces its
+        # rows, and the ledger entry commits with them
+        self.clear_page(self.writer, record['url_hash'])
+        if self.duplicates is None or not self.duplicates.check(record['url_hash'], record['url'], document['simhash'], len(document['soup']['content'])):
+            self.store_document(self.writer, document)
+            self.stats.inc_value('stream_pipeline/documents')
+            DOCUMENTS.inc(outcome='stored')
+        else:
+            self.stats.inc_value('stream_pipeline/near_duplicates')
+            DOCUMENTS.inc(outcome='near_duplicate')
+        self.ledger.commit(self.writer, record['url_hash'], record['content_hash'])
+        self.writer.checkpoint()
+
+    def close_spider(self, spider):
+        if self.flusher is not None and self.flusher.running:
+            self.flusher.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.writer is not None:
+            self.writer.close()
+            for table, stats in self.writer.report().items():
+                self.stats.set_value(f'stream_pipeline/rows/{table}', stats['rows'])
+        if self.ledger is not None:
+            self.ledger.close()
+        if self.duplicates is not None:
+            self.stats.set_value('stream_pipeline/near_duplicate_bytes_saved', self.duplicates.report()['bytes_saved'])
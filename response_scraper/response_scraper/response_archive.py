@@ -0,0 +1,292 @@
+import os
+import re
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+from urllib.parse import urlparse
+
+
+class ResponseArchive:
+    # Packed store for fetched pages. Bodies are gzip members appended to
+    # numbered segment files (each segment is a valid multi-member .gz file),
+    # deduplicated by the sha256 of the raw body. A SQLite index maps the md5
+    # url_hash used elsewhere in the project to the response metadata and to
+    # the segment/offset of its body.
+
+    def __init__(self, archive_dir='output/archive', segment_size=256 * 1024 * 1024, commit_every=100):
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.segment_file = None
+        self.readers = {}
+
+        # Ingest workers and the spider may share the index
+        self.conn = sqlite3.connect(os.path.join(archive_dir, 'index.db'), timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS bodies (
+            content_hash TEXT PRIMARY KEY,
+            segment INTEGER,
+            offset INTEGER,
+            length INTEGER,
+            size INTEGER
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            url_hash TEXT PRIMARY KEY,
+            url TEXT,
+            domain TEXT,
+            status INTEGER,
+            headers TEXT,
+            encoding TEXT,
+            fetched_at REAL,
+            content_hash TEXT,
+            processed INTEGER DEFAULT 0
+        )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_domain ON responses (domain)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_processed ON responses (processed)')
+        self.conn.commit()
+
+        row = self.conn.execute('SELECT MAX(segment) FROM bodies').fetchone()
+        self.segment = row[0] if row[0] is not None else 0
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.md5(url.encode()).hexdigest()
+
+    @staticmethod
+    def hash_body(body):
+        return hashlib.sha256(body).hexdigest()
+
+    def segment_path(self, segment):
+        return os.path.join(self.archive_dir, f'segment-{segment:05d}.gz')
+
+    def open_segment(self):
+        path = self.segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            self.segment += 1
+            path = self.segment_path(self.segment)
+        self.segment_file = open(path, 'ab')
+
+    def write_body(self, body, content_hash=None):
+        # content_hash may be passed in when the caller already computed it
+        content_hash = content_hash or self.hash_body(body)
+        row = self.conn.execute('SELECT 1 FROM bodies WHERE content_hash = ?', (content_hash,)).fetchone()
+        if row:
+            return content_hash
+
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_size:
+            if self.segment_file is not None:
+                self.segment_file.close()
+            self.open_segment()
+
+        compressed = gzip.compress(body)
+        offset = self.segment_file.tell()
+        self.segment_file.write(compressed)
+        self.segment_file.flush()
+        self.conn.execute('''
+        INSERT INTO bodies (content_hash, segment, offset, length, size)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (content_hash, self.segment, offset, len(compressed), len(body)))
+        return content_hash
+
+    def add(self, url, body, headers=None, status=200, encoding='utf-8', fetched_at=None, content_hash=None):
+        if isinstance(body, str):
+            body = body.encode(encoding or 'utf-8')
+        url_hash = self.hash_url(url)
+        domain = urlparse(url).netloc.replace("www.", "")
+        content_hash = self.write_body(body, content_hash)
+
+        self.conn.execute('''
+        INSERT INTO responses (url_hash, url, domain, status, headers, encoding, fetched_at, content_hash, processed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT(url_hash) DO UPDATE SET
+            status = excluded.status,
+            headers = excluded.headers,
+            encoding = excluded.encoding,
+            fetched_at = excluded.fetched_at,
+            processed = CASE WHEN responses.content_hash = excluded.content_hash THEN responses.processed ELSE 0 END,
+            content_hash = excluded.content_hash
+        ''', (url_hash, url, domain, status, json.dumps(headers or {}), encoding,
+              fetched_at if fetched_at is not None else time.time(), content_hash))
+
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+        return url_hash
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def read_body(self, segment, offset, length):
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = open(self.segment_path(segment), 'rb')
+            self.readers[segment] = reader
+        reader.seek(offset)
+        return gzip.decompress(reader.read(length))
+
+    def build_record(self, row):
+        return {
+            'url_hash': row[0],
+            'url': row[1],
+            'domain': row[2],
+            'status': row[3],
+            'headers': json.loads(row[4]) if row[4] else {},
+            'encoding': row[5],
+            'fetched_at': row[6],
+            'content_hash': row[7],
+            'body': self.read_body(row[8], row[9], row[10])
+        }
+
+    def get(self, url_hash):
+        row = self.conn.execute('''
+        SELECT r.url_hash, r.url, r.domain, r.status, r.headers, r.encoding, r.fetched_at, r.content_hash,
+               b.segment, b.offset, b.length
+        FROM responses r JOIN bodies b ON b.content_hash = r.content_hash
+        WHERE r.url_hash = ?
+        ''', (url_hash,)).fetchone()
+        return self.build_record(row) if row else None
+
+    def get_url(self, url):
+        return self.get(self.hash_url(url))
+
+    def get_metadata(self, url_hash):
+        # Same fields as get() without reading the body from its segment
+        row = self.conn.execute('''
+        SELECT r.url_hash, r.url, r.domain, r.status, r.headers, r.encoding, r.fetched_at, r.content_hash, b.size
+        FROM responses r JOIN bodies b ON b.content_hash = r.content_hash
+        WHERE r.url_hash = ?
+        ''', (url_hash,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'url_hash': row[0],
+            'url': row[1],
+            'domain': row[2],
+            'status': row[3],
+            'headers': json.loads(row[4]) if row[4] else {},
+            'encoding': row[5],
+            'fetched_at': row[6],
+            'content_hash': row[7],
+            'size': row[8]
+        }
+
+    def __contains__(self, url_hash):
+        row = self.conn.execute('SELECT 1 FROM responses WHERE url_hash = ?', (url_hash,)).fetchone()
+        return row is not None
+
+    def iter_responses(self, domain=None, pending_only=False, page_size=500):
+        # Walk the index in insertion order, which follows segment order, so
+        # bodies are read sequentially. Pages are keyed on rowid so callers
+        # can mark records processed while iterating.
+        conditions = ['r.rowid > ?']
+        params = []
+        if domain:
+            conditions.append('r.domain = ?')
+            params.append(domain)
+        if pending_only:
+            conditions.append('r.processed = 0')
+
+        last_rowid = 0
+        while True:
+            rows = self.conn.execute(f'''
+            SELECT r.url_hash, r.url, r.domain, r.status, r.headers, r.encoding, r.fetched_at, r.content_hash,
+                   b.segment, b.offset, b.length, r.rowid
+            FROM responses r JOIN bodies b ON b.content_hash = r.content_hash
+            WHERE {' AND '.join(conditions)}
+            ORDER BY r.rowid
+            LIMIT ?
+            ''', [last_rowid] + params + [page_size]).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield self.build_record(row)
+            last_rowid = rows[-1][11]
+
+    def mark_processed(self, url_hash):
+        self.conn.execute('UPDATE responses SET processed = 1 WHERE url_hash = ?', (url_hash,))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def mark_processed_many(self, url_hashes):
+        self.conn.executemany('UPDATE responses SET processed = 1 WHERE url_hash = ?', [(url_hash,) for url_hash in url_hashes])
+        self.commit()
+
+    def import_legacy_directory(self, input_dir='output/responses', remove=False):
+        # Pull in files written by the old save_response, which prefixed the
+        # page with <h1>url</h1><h2>Headers</h2><pre>json</pre>
+        prelude = re.compile(r'^<h1>(.*?)</h1><h2>Headers</h2><pre>(.*?)</pre>', re.S)
+        imported = 0
+        for filename in os.listdir(input_dir):
+            if not filename.endswith('.html'):
+                continue
+            file_path = os.path.join(input_dir, filename)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            match = prelude.match(content)
+            if not match:
+                continue
+            self.add(match.group(1), content[match.end():], headers=json.loads(match.group(2)),
+                     fetched_at=os.path.getmtime(file_path))
+            imported += 1
+            if remove:
+                os.remove(file_path)
+        self.commit()
+        return imported
+
+    def import_archive(self, source_dir):
+        # Merge another archive into this one, e.g. a shard of a distributed
+        # crawl. Bodies are deduplicated as usual; a response already here
+        # is only replaced by a later fetch. The processed flag comes along.
+        source = ResponseArchive(source_dir)
+        processed = {row[0] for row in source.conn.execute('SELECT url_hash FROM responses WHERE processed = 1')}
+        imported = 0
+        for record in source.iter_responses():
+            existing = self.get_metadata(record['url_hash'])
+            if existing is not None and (existing['fetched_at'] or 0) >= (record['fetched_at'] or 0):
+                continue
+            self.add(record['url'], record['body'], headers=record['headers'], status=record['status'], encoding=record['encoding'],
+                     fetched_at=record['fetched_at'], content_hash=record['content_hash'])
+            if record['url_hash'] in processed:
+                self.mark_processed(record['url_hash'])
+            imported += 1
+        source.close()
+        self.commit()
+        return imported
+
+    def close(self):
+        self.commit()
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import legacy response files into the archive.')
+    parser.add_argument('--input-dir', type=str, default='output/responses', help='Directory of legacy .html responses.')
+    parser.add_argument('--archive-dir', type=str, default='output/archive', help='Archive directory.')
+    parser.add_argument('--remove', action='store_true', help='Delete legacy files once imported.')
+    args = parser.parse_args()
+
+    archive = ResponseArchive(args.archive_dir)
+    count = archive.import_legacy_directory(args.input_dir, remove=args.remove)
+    archive.close()
+    print(f"Imported {count} responses into {args.archive_dir}")
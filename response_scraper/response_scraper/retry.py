@@ -0,0 +1,79 @@
+import time
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+class RetryPolicy:
+    # Decides whether and when a throttled request (429 or 503) is tried
+    # again, for ThrottleRetryMiddleware. The delay is not slept here: it is
+    # stored on the new request as retry_not_before, and DomainThrottleQueue
+    # holds back that request and the rest of its domain until then.
+
+    def __init__(self, crawler=None, max_attempts=3, base_delay=2.0, max_delay=60.0):
+        # The crawler's stats collector is created after the spider, so it
+        # is looked up when needed rather than stored here
+        self.crawler = crawler
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler=crawler,
+            max_attempts=settings.getint('THROTTLE_RETRY_MAX_ATTEMPTS', 3),
+            base_delay=settings.getfloat('THROTTLE_RETRY_BASE_DELAY', 2.0),
+            max_delay=settings.getfloat('THROTTLE_RETRY_MAX_DELAY', 60.0),
+        )
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode('latin-1')
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def backoff(self, attempt):
+        # Full jitter: uniform between zero and the exponential ceiling
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def inc_stat(self, key, domain):
+        stats = getattr(self.crawler, 'stats', None)
+        if stats is not None:
+            stats.inc_value(key)
+            stats.inc_value(f'{key}/{domain}')
+
+    def retry_request(self, request, response):
+        domain = urlparse(request.url).netloc.replace("www.", "")
+        attempt = request.meta.get('throttle_retry_times', 0)
+        if attempt >= self.max_attempts:
+            self.inc_stat('throttle_retry/max_reached', domain)
+            return None
+
+        delay = self.parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = self.backoff(attempt)
+        elif delay > self.max_delay:
+            # Waiting this long would eat the crawl window; leave it for the next run
+            self.inc_stat('throttle_retry/retry_after_too_long', domain)
+            return None
+
+        self.inc_stat('throttle_retry/count', domain)
+        retry = request.replace(dont_filter=True)
+        retry.meta['throttle_retry_times'] = attempt + 1
+        retry.meta['retry_not_before'] = time.time() + delay
+        retry.priority = request.priority - 1
+        return retry
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from response_scraper.response_scraper.shared_frontier import SharedFrontier
+from response_scraper.response_scraper.spiders.sharded_spider import ShardedSpider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Sharded crawl: one ShardedSpider process per shard, all taking work from a
+# SharedFrontier. On one host:
+#
+#   python -m response_scraper.response_scraper.run_distributed https://a.gov,https://b.gov 2 --workers 4
+#
+# On several hosts, point --frontier and --output-dir at shared storage,
+# give every host the same --workers and its own --shard-ids, and run with
+# --merge-only once all of them have finished.
+
+def run_worker(start_urls, tree_depth, shard, shards, frontier='output/frontier.db', output_dir='output/shards', settings=None, allowed_domains=None):
+    work_dir = os.path.join(output_dir, str(shard))
+    project_settings = get_project_settings()
+    # Workers would overwrite each other's metrics file and fight over one port
+    project_settings.set('METRICS_TEXTFILE', os.path.join(work_dir, 'output', 'metrics', 'crawl.prom'), priority='cmdline')
+    if project_settings.getint('METRICS_PORT'):
+        project_settings.set('METRICS_PORT', project_settings.getint('METRICS_PORT') + shard, priority='cmdline')
+    project_settings.setdict(settings or {}, priority='cmdline')
+    process = CrawlerProcess(project_settings)
+    process.crawl(ShardedSpider, start_urls=start_urls, tree_depth=tree_depth, frontier=frontier, shard=shard, shards=shards,
+                  work_dir=work_dir, allowed_domains=allowed_domains)
+    process.start()
+
+def merge_shards(output_dir='output/shards', archive_dir='output/archive'):
+    # Responses imported from each shard's archive
+    archive = ResponseArchive(archive_dir)
+    merged = {}
+    if not os.path.exists(output_dir):
+        return merged
+    for name in sorted(os.listdir(output_dir), key=lambda name: int(name) if name.isdigit() else -1):
+        source = os.path.join(output_dir, name, 'output', 'archive')
+        if name.isdigit() and os.path.exists(source):
+            merged[int(name)] = archive.import_archive(source)
+    archive.close()
+    return merged
+
+def run_distributed(start_urls, tree_depth, workers=2, shard_ids=None, frontier='output/frontier.db', output_dir='output/shards', archive_dir='output/archive',
+                    resume=False, settings=None, allowed_domains=None):
+    # shard_ids limits this host to some of the workers' shards; the
+    # frontier is then shared with other hosts and never reset here
+    local = shard_ids is None
+    shard_ids = list(range(workers)) if local else shard_ids
+    if local and not resume:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(frontier + suffix):
+                os.remove(frontier + suffix)
+
+    # Parse workers of the stream pipeline are split between the local workers
+    settings = dict(settings or {})
+    settings.setdefault('STREAM_PIPELINE_WORKERS', max(1, (os.cpu_count() or 1) // len(shard_ids)))
+    command = [sys.executable, '-m', 'response_scraper.response_scraper.run_distributed', ','.join(start_urls), str(tree_depth),
+               '--workers', str(workers), '--frontier', frontier, '--output-dir', output_dir]
+    for key, value in settings.items():
+        command += ['--set', f'{key}={value}']
+    if allowed_domains:
+        command += ['--allowed-domains', allowed_domains if isinstance(allowed_domains, str) else ','.join(allowed_domains)]
+
+    # Workers run in this directory, so relative paths mean the same to them
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    start = time.perf_counter()
+    processes = {shard: subprocess.Popen(command + ['--worker', str(shard)], env=env) for shard in shard_ids}
+    failed = [shard for shard, process in processes.items() if process.wait() != 0]
+    seconds = time.perf_counter() - start
+
+    shared = SharedFrontier(frontier, workers)
+    counts = shared.counts()
+    shared.close()
+    print(f"Frontier after {seconds:.1f}s: {counts}")
+    if failed:
+        print(f"Workers for shards {failed} exited with an error")
+
+    merged = None
+    if local:
+        merged = merge_shards(output_dir, archive_dir)
+        print(f"Merged {sum(merged.values())} responses into {archive_dir}: {merged}")
+    return {'seconds': seconds, 'frontier': counts, 'failed': failed, 'merged': merged}
+
+def parse_setting(setting):
+    key, _, value = setting.partition('=')
+    return key, value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Crawl with several spider processes sharing one frontier, partitioned by domain.')
+    parser.add_argument('start_urls', nargs='?', help='Comma-separated start URLs.')
+    parser.add_argument('tree_depth', nargs='?', type=int, default=2, help='Maximum link depth.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Total number of workers (shards) across all hosts.')
+    parser.add_argument('--shard-ids', type=str, help='Comma-separated shards to run on this host (default: all of them).')
+    parser.add_argument('--frontier', type=str, default='output/frontier.db', help='Shared frontier database.')
+    parser.add_argument('--output-dir', type=str, default='output/shards', help='Directory of the per-shard archives, crawl state and logs.')
+    parser.add_argument('--archive-dir', type=str, default='output/archive', help='Archive the shards are merged into.')
+    parser.add_argument('--allowed-domains', type=str, help='Comma-separated domains to stay within (default: the spider\'s list).')
+    parser.add_argument('--resume', action='store_true', help='Continue the frontier of an earlier run instead of starting a new one.')
+    parser.add_argument('--merge-only', action='store_true', help='Only merge the shard archives in --output-dir into --archive-dir.')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Scrapy setting for every worker; repeatable.')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    settings = dict(parse_setting(setting) for setting in args.set)
+    if args.merge_only:
+        merged = merge_shards(args.output_dir, args.archive_dir)
+        print(f"Merged {sum(merged.values())} responses into {args.archive_dir}: {merged}")
+    elif not args.start_urls:
+        parser.error('start_urls is required unless --merge-only is given')
+    elif args.worker is not None:
+        run_worker(args.start_urls.split(','), args.tree_depth, args.worker, args.workers, args.frontier, args.output_dir, settings, args.allowed_domains)
+    else:
+        shard_ids = [int(shard) for shard in args.shard_ids.split(',')] if args.shard_ids else None
+        run_distributed(args.start_urls.split(','), args.tree_depth, args.workers, shard_ids, args.frontier, args.output_dir, args.archive_dir,
+                        args.resume, settings, args.allowed_domains)
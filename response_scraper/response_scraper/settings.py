@@ -20,22 +20,63 @@ NEWSPIDER_MODULE = "response_scraper.spiders"
 ROBOTSTXT_OBEY = True
 
 
-# Enable AutoThrottle extension
-
-AUTOTHROTTLE_ENABLED = True
+# Per-domain politeness (response_scraper.middlewares.PerDomainThrottleMiddleware)
+# replaces the global AutoThrottle delay: each domain gets its own token
+# bucket (requests/second) and a concurrency limit that adapts to latency
+# and 429/503 responses. Current values are exposed as domain_throttle/* stats.
+# Requests wait for their domain in the scheduler, which the spider sets up
+# with SCHEDULER_PRIORITY_QUEUE = response_scraper.throttle_queue.DomainThrottleQueue.
+DOMAIN_THROTTLE_ENABLED = True
+DOMAIN_THROTTLE_START_RATE = 0.5
+DOMAIN_THROTTLE_MIN_RATE = 0.05
+DOMAIN_THROTTLE_MAX_RATE = 4.0
+DOMAIN_THROTTLE_BURST = 2.0
+DOMAIN_THROTTLE_START_CONCURRENCY = 1
+DOMAIN_THROTTLE_MAX_CONCURRENCY = 8
+DOMAIN_THROTTLE_TARGET_LATENCY = 1.0
+
+# Enable AutoThrottle extension (only when DOMAIN_THROTTLE_ENABLED is False)
+
+AUTOTHROTTLE_ENABLED = not DOMAIN_THROTTLE_ENABLED
 AUTOTHROTTLE_START_DELAY = 5
 AUTOTHROTTLE_MAX_DELAY = 60
 AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
 AUTOTHROTTLE_DEBUG = False
 
-DOWNLOAD_DELAY = 2
+DOWNLOAD_DELAY = 0 if DOMAIN_THROTTLE_ENABLED else 2
 
-CONCURRENT_REQUESTS = 16
+CONCURRENT_REQUESTS = 32
 CONCURRENT_REQUESTS_PER_DOMAIN = 8
-CONCURRENT_REQUESTS_PER_IP = 8
+CONCURRENT_REQUESTS_PER_IP = 0
 
 CLOSESPIDER_TIMEOUT = 300  # 5 minutes
 
+# 429s and 503s skip RetryMiddleware's immediate retries: they are
+# re-enqueued after Retry-After or a jittered exponential backoff
+# (response_scraper.middlewares.ThrottleRetryMiddleware, response_scraper.retry.RetryPolicy)
+RETRY_HTTP_CODES = [500, 502, 504, 522, 524, 408]
+THROTTLE_RETRY_ENABLED = True
+THROTTLE_RETRY_MAX_ATTEMPTS = 3
+THROTTLE_RETRY_BASE_DELAY = 2.0
+THROTTLE_RETRY_MAX_DELAY = 60.0
+
+# With -a recrawl=1, archived pages are revalidated with If-None-Match /
+# If-Modified-Since once their revisit time has passed
+# (response_scraper.middlewares.ConditionalRecrawlMiddleware)
+CONDITIONAL_RECRAWL_ENABLED = True
+
+# Stop downloads that are not HTML or are too large once their headers (or,
+# without a Content-Length, their first MAX_SIZE bytes) arrive, and stop
+# requesting URL patterns that (almost) only returned such responses,
+# fetching one in PROBE_EVERY of them to notice if that changes
+# (response_scraper.middlewares.ContentFilterMiddleware)
+CONTENT_FILTER_ENABLED = True
+CONTENT_FILTER_MAX_SIZE = 5 * 1024 * 1024
+CONTENT_FILTER_ALLOWED_TYPES = ['text/html', 'application/xhtml+xml']
+CONTENT_FILTER_LEARN_AFTER = 3
+CONTENT_FILTER_LEARN_SHARE = 0.9
+CONTENT_FILTER_PROBE_EVERY = 10
+
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 #CONCURRENT_REQUESTS = 32
@@ -84,6 +125,31 @@ CLOSESPIDER_TIMEOUT = 300  # 5 minutes
 #    "response_scraper.pipelines.ResponseScraperPipeline": 300,
 #}
 
+# CustomSpider enables ResponseScraperPipeline, which parses pages into the
+# database during the crawl. It needs scripts/ importable, i.e. the crawl
+# started from the repository root with run_spider.py; anywhere else the
+# crawl stops at startup unless STREAM_PIPELINE_ENABLED is False. Keep the
+# values below in step with the pipeline's fallbacks in from_crawler.
+STREAM_PIPELINE_ENABLED = True
+STREAM_PIPELINE_DB_PATH = 'web_scraping/database/web_scraping.db'
+STREAM_PIPELINE_PARSER = 'lxml'
+STREAM_PIPELINE_WORKERS = 2
+STREAM_PIPELINE_TRANSACTION_SIZE = 500
+STREAM_PIPELINE_FLUSH_INTERVAL = 5.0
+# Maximum SimHash bit distance of a near-duplicate page; None stores every page
+STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE = 3
+
+# CustomSpider enables MetricsExtension (extensions.py): per-domain fetch
+# latency and bytes, parse and insert timings, exported in the Prometheus
+# text format. METRICS_PORT serves them on 127.0.0.1; METRICS_PROFILE
+# ('cprofile' or 'pyinstrument') profiles the crawl into METRICS_PROFILE_DIR
+METRICS_ENABLED = True
+METRICS_TEXTFILE = 'output/metrics/crawl.prom'
+METRICS_EXPORT_INTERVAL = 15.0
+#METRICS_PORT = 9410
+#METRICS_PROFILE = 'cprofile'
+#METRICS_PROFILE_DIR = 'output/profiles'
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
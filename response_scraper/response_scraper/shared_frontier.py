@@ -0,0 +1,185 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from .canonical import canonicalize_url
+
+
+class SharedFrontier:
+    # Frontier of a sharded crawl (run_distributed.py): every URL any worker
+    # has discovered, in one SQLite file that all workers open. A URL's
+    # shard is the hash of its domain modulo the shard count, so a domain
+    # belongs to exactly one worker and that worker's per-domain throttle
+    # sees all of its traffic. The url_hash primary key is the shared
+    # visited set: INSERT OR IGNORE drops URLs another worker already found.
+    #
+    # add() and finish() are buffered and written by flush() in one
+    # transaction, so a page's discovered links are never committed after
+    # the page itself is marked done. Claims are taken under BEGIN
+    # IMMEDIATE. Workers on several hosts need the file on storage with
+    # working SQLite locking.
+    #
+    # Workers register their shard and heartbeat with every claim. The
+    # crawl is finished when no URL is pending or claimed, leaving out the
+    # shards whose worker has closed or stopped heartbeating for
+    # stale_after seconds; a shard whose worker has not started yet still
+    # counts.
+    #
+    # A spider calls add() and finish() on the reactor thread and claims
+    # from a thread of its own, since a claim can wait up to timeout seconds
+    # for another worker's write lock. The buffers and the connection
+    # therefore each have a lock, and add() and finish() never wait for
+    # the database.
+
+    def __init__(self, db_path='output/frontier.db', shards=1, worker_id=None, timeout=60, stale_after=60):
+        database_dir = os.path.dirname(db_path)
+        if database_dir and not os.path.exists(database_dir):
+            os.makedirs(database_dir)
+        self.db_path = db_path
+        self.shards = shards
+        self.stale_after = stale_after
+        self.worker_id = worker_id or f'worker-{os.getpid()}'
+        self.added = {}
+        self.finished = []
+        self.buffer_lock = threading.Lock()
+        self.db_lock = threading.Lock()
+
+        # Autocommit; writes go through transaction()
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                domain TEXT,
+                shard INTEGER,
+                depth INTEGER,
+                state TEXT DEFAULT 'pending',
+                worker TEXT,
+                claimed_at REAL,
+                updated_at REAL
+            )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_claim ON frontier (shard, state, depth)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_state ON frontier (state)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS frontier_workers (shard INTEGER PRIMARY KEY, worker TEXT, state TEXT, heartbeat REAL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS frontier_meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute("INSERT OR IGNORE INTO frontier_meta (key, value) VALUES ('shards', ?)", (str(shards),))
+            stored = int(self.conn.execute("SELECT value FROM frontier_meta WHERE key = 'shards'").fetchone()[0])
+        if stored != shards:
+            self.conn.close()
+            raise ValueError(f"{db_path} was created for {stored} shards, not {shards}")
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE, so concurrent workers queue for the write lock
+        # instead of failing to upgrade a read lock
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def domain_for(url):
+        # Same grouping as PerDomainThrottleMiddleware.domain_for
+        return urlparse(url).netloc.replace("www.", "")
+
+    @staticmethod
+    def shard_for(domain, shards):
+        return int(hashlib.md5(domain.encode()).hexdigest()[:8], 16) % shards
+
+    def add(self, url, depth):
+        url = canonicalize_url(url)
+        url_hash = hashlib.md5(url.encode()).hexdigest()
+        domain = self.domain_for(url)
+        with self.buffer_lock:
+            if url_hash not in self.added:
+                self.added[url_hash] = (url_hash, url, domain, self.shard_for(domain, self.shards), depth)
+
+    def finish(self, url_hash, failed=False):
+        with self.buffer_lock:
+            self.finished.append(('failed' if failed else 'done', url_hash))
+
+    def flush(self):
+        with self.buffer_lock:
+            added, finished = self.added, self.finished
+            self.added, self.finished = {}, []
+        if not added and not finished:
+            return
+        now = time.time()
+        try:
+            with self.db_lock, self.transaction():
+                self.conn.executemany('''
+                INSERT OR IGNORE INTO frontier (url_hash, url, domain, shard, depth, state, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?)
+                ''', [row + (now,) for row in added.values()])
+                self.conn.executemany('UPDATE frontier SET state = ?, updated_at = ? WHERE url_hash = ?',
+                                      [(state, now, url_hash) for state, url_hash in finished])
+        except Exception:
+            # Kept for the next flush, ahead of whatever was buffered meanwhile
+            with self.buffer_lock:
+                added.update(self.added)
+                self.added, self.finished = added, finished + self.finished
+            raise
+
+    def register(self, shard):
+        # Only one worker runs a shard, so claims left on it at startup
+        # belong to a worker that stopped; they go back to pending. Returns
+        # how many there were.
+        with self.db_lock, self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO frontier_workers (shard, worker, state, heartbeat) VALUES (?, ?, 'running', ?)",
+                              (shard, self.worker_id, time.time()))
+            return self.conn.execute("UPDATE frontier SET state = 'pending', worker = NULL WHERE shard = ? AND state = 'claimed'", (shard,)).rowcount
+
+    def unregister(self, shard):
+        # Unfinished claims stay in the frontier as pending for a later run
+        self.flush()
+        with self.db_lock, self.transaction():
+            self.conn.execute("UPDATE frontier SET state = 'pending', worker = NULL WHERE shard = ? AND state = 'claimed'", (shard,))
+            self.conn.execute("UPDATE frontier_workers SET state = 'closed', heartbeat = ? WHERE shard = ?", (time.time(), shard))
+
+    def claim(self, shard, limit):
+        # Shallowest pending URLs of the shard first, as a breadth-first crawl would take them
+        self.flush()
+        now = time.time()
+        with self.db_lock, self.transaction():
+            self.conn.execute('UPDATE frontier_workers SET heartbeat = ? WHERE shard = ?', (now, shard))
+            if limit <= 0:
+                return []
+            rows = self.conn.execute('''
+            SELECT url_hash, url, depth FROM frontier
+            WHERE shard = ? AND state = 'pending'
+            ORDER BY depth, rowid
+            LIMIT ?
+            ''', (shard, limit)).fetchall()
+            self.conn.executemany("UPDATE frontier SET state = 'claimed', worker = ?, claimed_at = ?, updated_at = ? WHERE url_hash = ?",
+                                  [(self.worker_id, now, now, row[0]) for row in rows])
+        return [{'url_hash': row[0], 'url': row[1], 'depth': row[2]} for row in rows]
+
+    def unfinished(self):
+        # URLs a live or not yet started worker still has to fetch
+        with self.db_lock:
+            return self.conn.execute('''
+            SELECT COUNT(*) FROM frontier
+            WHERE state IN ('pending', 'claimed')
+            AND shard NOT IN (SELECT shard FROM frontier_workers WHERE state = 'closed' OR heartbeat < ?)
+            ''', (time.time() - self.stale_after,)).fetchone()[0]
+
+    def counts(self):
+        with self.db_lock:
+            return dict(self.conn.execute('SELECT state, COUNT(*) FROM frontier GROUP BY state').fetchall())
+
+    def close(self):
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
@@ -1,13 +1,26 @@
 import scrapy
 from scrapy.http import HtmlResponse
 import os
-import json
+import random
 from datetime import datetime
-import hashlib
 from urllib.parse import urlparse, urljoin
 from scrapy.spidermiddlewares.httperror import HttpError
 from twisted.internet.error import DNSLookupError, TimeoutError, TCPTimedOutError
-import time
+from ..crawl_state import CrawlStateStore
+from ..response_archive import ResponseArchive
+from ..batched_writer import ArchiveWriter, LogWriter
+from ..canonical import canonicalize_url, Frontier
+from ..items import ResponseScraperItem
+from ..metrics import counter, histogram
+
+# Every extracted link passes through here, so its timer only samples
+LINK_SECONDS = histogram('crawl_link_seconds', 'Time to check and enqueue one extracted link',
+                         buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005), sample_every=64)
+LINKS = counter('crawl_links_total', 'Extracted links by outcome')
+
+# Dotted path of this Scrapy project, which depends on whether the crawl was
+# started with `scrapy crawl` or with run_spider.py from the repository root
+PROJECT = __name__.rsplit('.spiders', 1)[0]
 
 class CustomSpider(scrapy.Spider):
     name = "custom_spider"
@@ -16,39 +29,75 @@ class CustomSpider(scrapy.Spider):
         'CLOSESPIDER_TIMEOUT': 300,  # 5 minutes
         'DOWNLOADER_MIDDLEWARES': {
             'scrapy.downloadermiddlewares.offsite.OffsiteMiddleware': None,
-        }
+            # After RetryMiddleware (550) in response order so it sees 429s first
+            f'{PROJECT}.middlewares.PerDomainThrottleMiddleware': 560,
+            # Between the two: 429/503 are retried after Retry-After once the throttle has recorded them
+            f'{PROJECT}.middlewares.ThrottleRetryMiddleware': 555,
+            # Before the throttle so archived replays do not spend a token
+            f'{PROJECT}.middlewares.ConditionalRecrawlMiddleware': 540,
+            # Before the throttle so skipped URLs do not spend a token either
+            f'{PROJECT}.middlewares.ContentFilterMiddleware': 545,
+        },
+        'ITEM_PIPELINES': {
+            f'{PROJECT}.pipelines.ResponseScraperPipeline': 300,
+        },
+        'EXTENSIONS': {
+            f'{PROJECT}.extensions.MetricsExtension': 500,
+        },
+        # Requests wait for their domain's throttle here rather than in the downloader
+        'SCHEDULER_PRIORITY_QUEUE': f'{PROJECT}.throttle_queue.DomainThrottleQueue',
+        # Scrapy's defaults without 429 and 503, which only ThrottleRetryMiddleware
+        # retries; here too because settings.py is not loaded from the repository root
+        'RETRY_HTTP_CODES': [500, 502, 504, 522, 524, 408],
     }
 
-    def __init__(self, start_urls=None, tree_depth=2, *args, **kwargs):
+    def __init__(self, start_urls=None, tree_depth=2, recrawl=False, link_log_sample=0, allowed_domains=None, work_dir=None, *args, **kwargs):
         super(CustomSpider, self).__init__(*args, **kwargs)
+        # -a work_dir=... moves logs/ and output/archive under that directory
+        self.work_dir = work_dir
         self.start_urls = start_urls if start_urls else ['https://example.com']
-        self.allowed_domains = ['dhs.gov', 'uscis.gov', 'whitehouse.gov', 'myaccount.uscis.gov', 'travel.state.gov', 'cdc.gov', 'oig.dhs.gov', 'usa.gov']
+        # -a recrawl=1 revalidates archived pages that are due instead of replaying them
+        self.recrawl = recrawl not in (False, None, '', '0', 'false', 'False')
+        # -a allowed_domains=a.gov,b.gov replaces the default list (host:port for local test sites)
+        if isinstance(allowed_domains, str):
+            allowed_domains = allowed_domains.split(',')
+        self.allowed_domains = allowed_domains or ['dhs.gov', 'uscis.gov', 'whitehouse.gov', 'myaccount.uscis.gov', 'travel.state.gov', 'cdc.gov', 'oig.dhs.gov', 'usa.gov']
         self.tree_depth = tree_depth
-        self.visited_urls = self.load_visited_urls()
+        # Fraction of followed/skipped links written to the log (-a link_log_sample=0.01)
+        self.link_log_sample = float(link_log_sample)
+        self.frontier = Frontier()
+        self.crawl_state = CrawlStateStore(self.work_path('logs/crawl_state.db'), legacy_path=self.work_path('logs/visited_urls.json'))
+        # Reads (replays, revisit checks) use self.archive; new responses are
+        # written in batches by archive_writer's thread, off the reactor
+        self.archive = ResponseArchive(self.work_path('output/archive'))
+        self.archive_writer = ArchiveWriter(self.work_path('output/archive'))
         self.setup_logging()
-        self.log(f"Loaded visited URLs: {self.visited_urls}")
+        self.log(f"Opened crawl state: {self.crawl_state.db_path}")
+
+    def work_path(self, path):
+        return os.path.join(self.work_dir, path) if self.work_dir else path
 
     def setup_logging(self):
-        if not os.path.exists('logs'):
-            os.makedirs('logs')
-        self.log_file = open('logs/scrapy_log.txt', 'a')
+        if not os.path.exists(self.work_path('logs')):
+            os.makedirs(self.work_path('logs'))
+        self.log_writer = LogWriter(self.work_path('logs/scrapy_log.txt'))
         self.log(f"Spider started at {datetime.now()}\n")
 
     def log(self, message):
-        self.log_file.write(message + '\n')
-        self.log_file.flush()
+        # Queued; the writer thread appends and flushes in batches
+        self.log_writer.put(message + '\n')
+
+    def log_link(self, message):
+        if self.link_log_sample and random.random() < self.link_log_sample:
+            self.log(message)
 
     def errback_httpbin(self, failure):
         self.logger.error(repr(failure))
         if failure.check(HttpError):
+            # Throttled responses only get here once ThrottleRetryMiddleware has given up on them
             response = failure.value.response
-            if response.status == 429:
-                self.logger.error('429 Too Many Requests on %s', response.url)
-                # Retry logic: put the URL back at the end of the queue
-                time.sleep(5)  # Optional: add a delay before retrying
-                yield scrapy.Request(url=response.url, callback=self.parse, errback=self.errback_httpbin, dont_filter=True)
-            else:
-                self.logger.error('HTTPError on %s', response.url)
+            self.logger.error('HTTPError on %s', response.url)
+            self.crawl_state.record(response.url, depth=failure.request.meta.get('depth'), status=response.status)
         elif failure.check(DNSLookupError):
             request = failure.request
             self.logger.error('DNSLookupError on %s', request.url)
@@ -56,47 +105,67 @@ class CustomSpider(scrapy.Spider):
             request = failure.request
             self.logger.error('TimeoutError on %s', request.url)
 
-    def load_visited_urls(self):
-        visited = set()
-        if os.path.exists('logs/scrapy_log.txt'):
-            with open('logs/scrapy_log.txt', 'r') as file:
-                for line in file:
-                    if "Scraped URL:" in line:
-                        url_start = line.find("Scraped URL:") + len("Scraped URL:")
-                        url_end = line.find(" - ", url_start)
-                        if url_end == -1:  # Handle case where there's no timestamp
-                            url_end = len(line)
-                        url = line[url_start:url_end].strip()
-                        visited.add(url)
-        return visited
-
     def parse(self, response):
         if not isinstance(response, HtmlResponse):
             return
 
-        url = response.url
-        self.visited_urls.add(url)
-        self.log(f"Scraped URL: {url} - {datetime.now()}")
-
-        # Save the response
-        self.save_response(response, url)
+        # Stored under the canonical URL so every spelling of a page shares one record
+        url = canonicalize_url(response.url)
+        depth = response.meta.get('depth', 0)
+        if 'archived' in response.flags:
+            # Replayed from the archive; only its links are needed
+            self.crawl_state.record(url, depth=depth)
+            if 'not_modified' in response.flags:
+                self.crawl_state.schedule(url, changed=False)
+            self.log(f"Unchanged URL: {url} - {datetime.now()}")
+        else:
+            self.crawl_state.record(url, depth=depth, status=response.status)
+            self.log(f"Scraped URL: {url} - {datetime.now()}")
+
+            # Save the response
+            content_hash, changed = self.save_response(response, url)
+            self.crawl_state.schedule(url, changed=changed)
+            if changed:
+                # Parsed into the database by ResponseScraperPipeline while the crawl goes on
+                yield ResponseScraperItem(
+                    url=url,
+                    url_hash=self.archive.hash_url(url),
+                    status=response.status,
+                    headers=self.archive_headers(response),
+                    encoding=response.encoding,
+                    body=response.body,
+                    depth=depth,
+                    fetched_at=datetime.now().timestamp(),
+                    content_hash=content_hash
+                )
 
         # Follow links and control depth
-        depth = response.meta.get('depth', 0)
-        self.log(f"Current depth: {depth}, Tree depth: {self.tree_depth}")
         if depth < self.tree_depth:
             for link in response.css('a::attr(href)').getall():
-                absolute_link = urljoin(response.url, link)
-                if self.is_valid_link(absolute_link):
-                    self.log(f"Following link: {absolute_link}")
-                    yield response.follow(absolute_link, self.parse, meta={'depth': depth + 1})
+                with LINK_SECONDS.time():
+                    absolute_link = urljoin(response.url, link).split('#', 1)[0]
+                    valid = self.is_valid_link(absolute_link)
+                    # Drop links already requested in this crawl before a Request is built
+                    new = valid and self.frontier.add(absolute_link)
+                if not valid:
+                    LINKS.inc(outcome='invalid')
+                    self.log_link(f"Invalid link (skipping): {absolute_link}")
+                elif new:
+                    LINKS.inc(outcome='followed')
+                    self.log_link(f"Following link: {absolute_link}")
+                    request = self.follow(response, absolute_link, depth + 1)
+                    if request is not None:
+                        yield request
                 else:
-                    self.log(f"Invalid link (skipping): {absolute_link}")
+                    LINKS.inc(outcome='duplicate')
+
+    def follow(self, response, url, depth):
+        # Request for a new link, or None when it is queued elsewhere (ShardedSpider)
+        return response.follow(url, self.parse, errback=self.errback_httpbin, meta={'depth': depth})
 
     def is_valid_link(self, link):
         parsed_link = urlparse(link)
         domain = parsed_link.netloc.replace("www.", "")
-        self.log(f"Checking link: {link}, Domain: {domain}")
 
         invalid_extensions = (
             'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx',
@@ -108,56 +177,45 @@ class CustomSpider(scrapy.Spider):
             return False
 
         # Allow links with empty domain (relative links) and links within allowed domains
-        valid_link = domain == "" or domain in self.allowed_domains
-        self.log(f"Link valid: {valid_link}")
-        return valid_link
-
-    def save_response(self, response, url):
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc.replace("www.", "")
-        if not os.path.exists('output/responses'):
-            os.makedirs('output/responses')
+        return domain == "" or domain in self.allowed_domains
 
+    def archive_headers(self, response):
         # Convert headers to a JSON-serializable dictionary
-        headers = {k.decode('utf-8'): [v.decode('utf-8') for v in value] if isinstance(value, list) else value.decode('utf-8') for k, value in response.headers.items()}
-
-        # Add the URL and Headers to the response body
-        response_body = f"<h1>{url}</h1>"
-        response_body += "<h2>Headers</h2>"
-        response_body += "<pre>"
-        response_body += json.dumps(headers, indent=4)
-        response_body += "</pre>"
-        response_body += response.text
-        response = response.replace(body=response_body)
-
-        # Save the HTML content
-        html_filepath = f'output/responses/{domain}-{url_hash}.html'
-        with open(html_filepath, 'wb') as f:
-            f.write(response.body)
+        return {k.decode('utf-8'): [v.decode('utf-8') for v in value] if isinstance(value, list) else value.decode('utf-8') for k, value in response.headers.items()}
+
+    def save_response(self, response, url):
+        # (content hash, whether the page changed since it was last archived)
+        # for the revisit schedule; the write itself happens on the archive
+        # writer's thread
+        url_hash = self.archive.hash_url(url)
+        previous = self.archive_writer.queued_hash(url_hash)
+        if previous is None:
+            metadata = self.archive.get_metadata(url_hash)
+            previous = metadata['content_hash'] if metadata else None
+        content_hash = self.archive_writer.add(url, response.body, headers=self.archive_headers(response), status=response.status, encoding=response.encoding)
+        return content_hash, previous != content_hash
 
     def closed(self, reason):
         self.log(f"Spider closed at {datetime.now()} due to: {reason}")
-        self.log_file.close()
-        self.save_visited_urls()
-
-    def save_visited_urls(self):
-        with open('logs/visited_urls.json', 'w') as file:
-            json.dump(list(self.visited_urls), file)
+        self.log(f"Frontier: {len(self.frontier)} URLs requested, {self.frontier.dropped} duplicate links dropped")
+        # Both drain their queues before returning
+        self.archive_writer.close()
+        self.log_writer.close()
+        self.crawl_state.close()
+        self.archive.close()
 
     def start_requests(self):
         for url in self.start_urls:
-            url_hash = hashlib.md5(url.encode()).hexdigest()
-            parsed_url = urlparse(url)
-            domain = parsed_url.netloc.replace("www.", "")
-            filepath = f'output/responses/{domain}-{url_hash}.html'
-
-            if os.path.exists(filepath):
-                self.log(f"Loading URL from file: {url}")
-                with open(filepath, 'rb') as f:
-                    content = f.read()
-                    fake_response = HtmlResponse(url=url, body=content, encoding='utf-8')
-                    yield self.parse(fake_response)
+            self.frontier.add(url)
+            record = None if self.recrawl else self.archive.get_url(canonicalize_url(url))
+
+            if record:
+                self.log(f"Loading URL from archive: {url}")
+                # Flagged like ConditionalRecrawlMiddleware's replays, so parse() only follows its links
+                request = scrapy.Request(url=url, callback=self.parse, dont_filter=True, meta={'depth': 0})
+                fake_response = HtmlResponse(url=url, body=record['body'], encoding=record['encoding'] or 'utf-8',
+                                             request=request, flags=['archived'])
+                yield from self.parse(fake_response)
             else:
                 self.log(f"Scraping URL from web: {url}")
                 yield scrapy.Request(url=url, callback=self.parse, errback=self.errback_httpbin, dont_filter=True, meta={'depth': 0})
@@ -0,0 +1,125 @@
+import os
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task, threads
+from .custom_spider import CustomSpider
+from ..shared_frontier import SharedFrontier
+
+
+class ShardedSpider(CustomSpider):
+    # One worker of a sharded crawl (run_distributed.py). Discovered links go
+    # to the SharedFrontier instead of this process's scheduler, and the
+    # worker only requests URLs of its own shard, claimed claim_size at a
+    # time. Each domain therefore has a single worker, and the per-domain
+    # throttle keeps its politeness limits however many workers there are.
+    # Archive, crawl state and log go under work_dir, one per shard, and are
+    # merged by the launcher. A worker stays open while any live worker has
+    # unfinished URLs, since it may still find links that belong to this
+    # worker's shard.
+    #
+    # Claims wait for the frontier's write lock, up to its timeout, so polls
+    # run in a thread and spider_idle goes by the unfinished count of the
+    # last poll, at most poll_interval seconds old.
+    name = "sharded_spider"
+
+    def __init__(self, frontier='output/frontier.db', shard=0, shards=1, claim_size=64, poll_interval=1.0, work_dir=None, *args, **kwargs):
+        self.shard = int(shard)
+        self.shards = int(shards)
+        super(ShardedSpider, self).__init__(*args, work_dir=work_dir or f'output/shards/{self.shard}', **kwargs)
+        self.shared = SharedFrontier(frontier, self.shards, worker_id=f'shard-{self.shard}-{os.getpid()}')
+        self.claim_size = int(claim_size)
+        self.poll_interval = float(poll_interval)
+        self.in_flight = 0
+        self.unfinished = None
+        self.polling = None
+        self.closing = False
+        self.poller = None
+        recovered = self.shared.register(self.shard)
+        self.log(f"Shard {self.shard} of {self.shards} on {frontier}, {recovered} interrupted claims re-queued")
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(ShardedSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def start_requests(self):
+        # Every worker adds the seeds; the frontier keeps one copy of each
+        for url in self.start_urls:
+            self.shared.add(url, 0)
+        # The first poll claims the start requests
+        self.poller = task.LoopingCall(self.poll)
+        self.poller.start(self.poll_interval)
+        return []
+
+    def claim(self, limit):
+        # Runs in a thread; claiming also writes the buffered links
+        return self.shared.claim(self.shard, limit), self.shared.unfinished()
+
+    def poll(self):
+        # Top up to claim_size requests in flight
+        if self.polling is not None or self.closing:
+            return
+        self.polling = threads.deferToThread(self.claim, self.claim_size - self.in_flight)
+        self.polling.addCallbacks(self.claimed, self.poll_failed)
+        self.polling.addBoth(self.poll_done)
+
+    def claimed(self, result):
+        rows, self.unfinished = result
+        if self.closing:
+            # Re-queued by unregister()
+            return
+        for row in rows:
+            self.in_flight += 1
+            self.crawler.engine.crawl(scrapy.Request(url=row['url'], callback=self.parse, errback=self.errback_httpbin, dont_filter=True,
+                                                     meta={'depth': row['depth'], 'frontier_hash': row['url_hash']}))
+
+    def poll_failed(self, failure):
+        self.logger.error(f"Polling the frontier failed: {failure.getErrorMessage()}")
+
+    def poll_done(self, _):
+        self.polling = None
+
+    def spider_idle(self, spider):
+        if self.in_flight or self.polling is not None or self.unfinished is None or self.unfinished:
+            self.poll()
+            raise DontCloseSpider
+
+    def follow(self, response, url, depth):
+        self.shared.add(url, depth)
+        return None
+
+    def finished(self, request, failed=False):
+        url_hash = request.meta.get('frontier_hash')
+        if url_hash is not None:
+            self.shared.finish(url_hash, failed)
+            self.in_flight -= 1
+
+    def parse(self, response):
+        # Finished however parsing ends, so the URL is not left claimed
+        failed = True
+        try:
+            yield from super(ShardedSpider, self).parse(response)
+            failed = False
+        finally:
+            self.finished(response.request, failed)
+
+    def errback_httpbin(self, failure):
+        # Throttled requests being retried do not get here and stay claimed
+        super(ShardedSpider, self).errback_httpbin(failure)
+        self.finished(failure.request, failed=True)
+
+    def closed(self, reason):
+        self.closing = True
+        if self.poller is not None and self.poller.running:
+            self.poller.stop()
+        if self.polling is not None:
+            # Let the claim in progress commit, so unregister() re-queues it
+            return self.polling.addCallback(lambda _: self.close_shard(reason))
+        return self.close_shard(reason)
+
+    def close_shard(self, reason):
+        self.shared.unregister(self.shard)
+        self.shared.close()
+        super(ShardedSpider, self).closed(reason)
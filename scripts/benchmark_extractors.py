@@ -0,0 +1,69 @@
+import time
+from itertools import islice
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from scripts import html_extraction, lxml_extraction
+
+EXTRACTORS = {
+    'bs4': html_extraction.extract_document,
+    'lxml': lxml_extraction.extract_document
+}
+
+def record_counts(document):
+    return {
+        'images': len(document['images']),
+        'forms': len(document['forms']),
+        'form_fields': sum(len(form['fields']) for form in document['forms']),
+        'links': len(document['links']),
+        'tables': len(document['tables'])
+    }
+
+def benchmark_extractors(archive_dir='output/archive', limit=500, repeat=3):
+    # Load the corpus up front so only parsing is timed
+    archive = ResponseArchive(archive_dir)
+    records = list(islice(archive.iter_responses(), limit))
+    archive.close()
+    if not records:
+        print(f"No responses found in {archive_dir}")
+        return {}
+
+    total_bytes = sum(len(record['body']) for record in records)
+    results = {}
+    for name, extractor in EXTRACTORS.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            documents = [extractor(record) for record in records]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        totals = {}
+        for document in documents:
+            for table, count in record_counts(document).items():
+                totals[table] = totals.get(table, 0) + count
+        results[name] = {'seconds': best, 'documents': documents, 'totals': totals}
+
+    print(f"Corpus: {len(records)} responses, {total_bytes / 1024 / 1024:.1f} MiB")
+    for name, result in results.items():
+        docs_per_sec = len(records) / result['seconds'] if result['seconds'] else float('inf')
+        mib_per_sec = total_bytes / 1024 / 1024 / result['seconds'] if result['seconds'] else float('inf')
+        print(f"{name:>5}: {result['seconds']:.3f}s  {docs_per_sec:.1f} docs/s  {mib_per_sec:.2f} MiB/s  rows {result['totals']}")
+
+    # Per-document differences in row counts between the two backends
+    mismatches = 0
+    for bs4_document, lxml_document in zip(results['bs4']['documents'], results['lxml']['documents']):
+        if record_counts(bs4_document) != record_counts(lxml_document):
+            mismatches += 1
+    print(f"Documents with differing row counts: {mismatches}/{len(records)}")
+    if results['lxml']['seconds']:
+        print(f"Speedup (bs4 / lxml): {results['bs4']['seconds'] / results['lxml']['seconds']:.2f}x")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the BeautifulSoup and lxml extractors on archived responses.')
+    parser.add_argument('--archive-dir', type=str, default='output/archive', help='Archive directory to read the corpus from.')
+    parser.add_argument('--limit', type=int, default=500, help='Number of responses to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per extractor; the best time is reported.')
+    args = parser.parse_args()
+
+    benchmark_extractors(args.archive_dir, args.limit, args.repeat)
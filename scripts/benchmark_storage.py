@@ -0,0 +1,91 @@
+import os
+import time
+import tempfile
+from itertools import islice
+from collections import Counter
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from scripts import lxml_extraction, queries
+from scripts.bulk_writer import BulkWriter
+from scripts.process_html_files import store_document
+from scripts.setup_sql_database import setup_databases
+from scripts.storage import STORAGES, open_storage
+
+# Extracted once, then written into a fresh database per backend and
+# queried with the lookups from scripts/queries.py plus one aggregate
+
+def links_per_page(conn):
+    return conn.execute('SELECT url, COUNT(*) FROM links GROUP BY url ORDER BY 2 DESC LIMIT 10').fetchall()
+
+def database_size(path):
+    # Main file plus SQLite's WAL, if any
+    return sum(os.path.getsize(p) for p in (path, path + '-wal', path + '.wal') if os.path.exists(p))
+
+def benchmark_backend(name, documents, work_dir, transaction_size=5000, repeat=20):
+    path = os.path.join(work_dir, f'benchmark.{name}')
+    for leftover in (path, path + '-wal', path + '-shm', path + '.wal'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    db_url = f'{name}:///{path}'
+    setup_databases(db_url)
+
+    writer = BulkWriter(db_url, transaction_size=transaction_size)
+    start = time.perf_counter()
+    for document in documents:
+        store_document(writer, document)
+        writer.checkpoint()
+    writer.close()
+    seconds = time.perf_counter() - start
+    rows = sum(stats['rows'] for stats in writer.report().values())
+
+    # Lookups for the page with the most links and the most common form field
+    url = max(documents, key=lambda document: len(document['links']))['url']
+    fields = Counter(field['name'] for document in documents for form in document['forms'] for field in form['fields'] if field['name'])
+    field = fields.most_common(1)[0][0] if fields else 'q'
+    conn = open_storage(db_url).connect()
+    checks = [
+        ('assets for url', queries.get_assets_for_url, (conn, url)),
+        ('forms with field', queries.get_forms_with_field, (conn, field)),
+        ('pages linking to', queries.get_pages_linking_to, (conn, url)),
+        ('links per page', links_per_page, (conn,)),
+    ]
+    latency = {check: queries.measure(func, *args, repeat=repeat) for check, func, args in checks}
+    conn.close()
+    return {'seconds': seconds, 'rows': rows, 'rows_per_sec': rows / seconds if seconds else 0.0, 'latency': latency, 'bytes': database_size(path)}
+
+def benchmark_storage(archive_dir='output/archive', limit=500, backends=None, work_dir=None, transaction_size=5000, repeat=20):
+    archive = ResponseArchive(archive_dir)
+    records = list(islice(archive.iter_responses(), limit))
+    archive.close()
+    if not records:
+        print(f"No responses found in {archive_dir}")
+        return {}
+    documents = [lxml_extraction.extract_document(record) for record in records]
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='benchmark_storage_')
+    results = {}
+    for name in backends or list(STORAGES):
+        try:
+            results[name] = benchmark_backend(name, documents, work_dir, transaction_size, repeat)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+
+    print(f"Corpus: {len(documents)} documents, databases in {work_dir}")
+    for name, result in results.items():
+        print(f"{name:>7}: {result['rows']} rows in {result['seconds']:.3f}s  {result['rows_per_sec']:.0f} rows/s  {result['bytes'] / 1024 / 1024:.1f} MiB")
+        for check, timing in result['latency'].items():
+            print(f"{'':>9}{check:>18}: median {timing['median_ms']:.3f} ms, max {timing['max_ms']:.3f} ms")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare ingest throughput and query latency of the storage backends.')
+    parser.add_argument('--archive-dir', type=str, default='output/archive', help='Archive directory to read the corpus from.')
+    parser.add_argument('--limit', type=int, default=500, help='Number of responses to load.')
+    parser.add_argument('--backends', type=str, help=f'Comma-separated backends (default: {",".join(STORAGES)}).')
+    parser.add_argument('--work-dir', type=str, help='Directory for the benchmark databases (default: a new temporary directory).')
+    parser.add_argument('--transaction-size', type=int, default=5000, help='Rows written per transaction.')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query.')
+    args = parser.parse_args()
+
+    benchmark_storage(args.archive_dir, args.limit, args.backends.split(',') if args.backends else None, args.work_dir, args.transaction_size, args.repeat)
@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+from urllib.parse import urlsplit
+
+# Reproducible benchmark of the crawl -> parse -> store -> ingest path.
+#
+#   crawl   CustomSpider against MockSite (scripts/synthetic_site.py):
+#           pages/s, fetch latency, 429s and throttle retries
+#   parse   extract_document over a generated corpus: files/s, per-file latency
+#   store   store_document through BulkWriter: rows/s, per-document latency
+#   ingest  process_html_files end to end: files/s, rows/s
+#
+# Each stage runs in its own process so its peak RSS can be read from
+# wait4(). Results can be saved as a baseline and later runs compared
+# against it; rates should not drop and latencies and RSS should not grow
+# by more than the threshold.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['crawl', 'parse', 'store', 'ingest']
+CORPUS_HOSTS = 'https://site{}.example.gov'
+
+DEFAULT_CONFIG = {
+    'domains': 3,
+    'pages_per_domain': 100,
+    'seed': 0,
+    'latency': 0.05,
+    'jitter': 0.02,
+    'rate_429': 0.02,
+    'retry_after': 1,
+    'tree_depth': 3,
+    'crawl_settings': {},
+    'parser': 'lxml',
+    'workers': 1,
+    'transaction_size': 5000,
+}
+
+def percentiles(samples):
+    # p50 and p99 in milliseconds
+    if not samples:
+        return None, None
+    if len(samples) == 1:
+        return samples[0] * 1000, samples[0] * 1000
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49] * 1000, cuts[98] * 1000
+
+def load_corpus(work_dir):
+    from response_scraper.response_scraper.response_archive import ResponseArchive
+
+    archive = ResponseArchive(os.path.join(work_dir, 'corpus'))
+    records = list(archive.iter_responses())
+    archive.close()
+    return records
+
+def fresh_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return path
+
+def project_settings():
+    # The project's settings.py, which get_project_settings() only finds on
+    # its own from the directory holding scrapy.cfg; its SPIDER_MODULES are
+    # relative to that directory too
+    from scrapy.utils.project import get_project_settings
+
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'response_scraper.response_scraper.settings')
+    settings = get_project_settings()
+    settings.set('SPIDER_MODULES', ['response_scraper.response_scraper.spiders'], priority='cmdline')
+    return settings
+
+def stage_crawl(config, work_dir):
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+
+    # The spider keeps its archive, crawl state and log under the working directory
+    crawl_dir = fresh_path(os.path.join(work_dir, 'crawl'))
+    os.makedirs(crawl_dir)
+    os.chdir(crawl_dir)
+
+    # Production settings with only the benchmark's own changes on top
+    settings = project_settings()
+    settings.setdict({
+        'LOG_LEVEL': 'WARNING',
+        'TELNETCONSOLE_ENABLED': False,
+        # Parsing is measured by the other stages
+        'STREAM_PIPELINE_ENABLED': False,
+    }, priority='cmdline')
+    settings.setdict(config['crawl_settings'], priority='cmdline')
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(CustomSpider)
+
+    latencies = []
+    def response_received(response, request, spider):
+        if 'download_latency' in request.meta:
+            latencies.append(request.meta['download_latency'])
+    crawler.signals.connect(response_received, signal=signals.response_received)
+
+    hosts = config['hosts']
+    start = time.perf_counter()
+    process.crawl(crawler, start_urls=[f'{host}/' for host in hosts], tree_depth=config['tree_depth'],
+                  allowed_domains=','.join(urlsplit(host).netloc for host in hosts))
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    pages = stats.get('downloader/response_status_count/200', 0)
+    p50, p99 = percentiles(latencies)
+    return {
+        'pages': pages,
+        'responses_429': stats.get('downloader/response_status_count/429', 0),
+        'retries': stats.get('retry/count', 0),
+        'throttle_retries': stats.get('throttle_retry/count', 0),
+        'finish_reason': stats.get('finish_reason'),
+        'seconds': elapsed,
+        'pages_per_sec': pages / elapsed,
+        'mib_per_sec': stats.get('downloader/response_bytes', 0) / elapsed / 1024 / 1024,
+        'fetch_p50_ms': p50,
+        'fetch_p99_ms': p99,
+    }
+
+def stage_parse(config, work_dir):
+    from scripts.process_html_files import EXTRACTORS
+
+    records = load_corpus(work_dir)
+    extractor = EXTRACTORS[config['parser']]
+    timings = []
+    start = time.perf_counter()
+    for record in records:
+        began = time.perf_counter()
+        extractor(record)
+        timings.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = percentiles(timings)
+    return {
+        'files': len(records),
+        'seconds': elapsed,
+        'files_per_sec': len(records) / elapsed,
+        'mib_per_sec': sum(len(record['body']) for record in records) / elapsed / 1024 / 1024,
+        'p50_ms': p50,
+        'p99_ms': p99,
+    }
+
+def stage_store(config, work_dir):
+    from scripts.bulk_writer import BulkWriter
+    from scripts.process_html_files import EXTRACTORS, store_document
+    from scripts.setup_sql_database import setup_databases
+
+    extractor = EXTRACTORS[config['parser']]
+    documents = [extractor(record) for record in load_corpus(work_dir)]
+    db_path = fresh_path(os.path.join(work_dir, 'store.db'))
+    setup_databases(db_path)
+
+    writer = BulkWriter(db_path, transaction_size=config['transaction_size'])
+    timings = []
+    start = time.perf_counter()
+    for document in documents:
+        began = time.perf_counter()
+        store_document(writer, document)
+        writer.checkpoint()
+        timings.append(time.perf_counter() - began)
+    writer.close()
+    elapsed = time.perf_counter() - start
+
+    rows = sum(stats['rows'] for stats in writer.report().values())
+    p50, p99 = percentiles(timings)
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed,
+        'p50_ms': p50,
+        'p99_ms': p99,
+    }
+
+def stage_ingest(config, work_dir):
+    from scripts.process_html_files import process_html_files
+    from scripts.setup_sql_database import setup_databases
+
+    # Ingestion marks responses processed, so it gets its own copy of the corpus
+    archive_dir = fresh_path(os.path.join(work_dir, 'ingest_archive'))
+    shutil.copytree(os.path.join(work_dir, 'corpus'), archive_dir)
+    db_path = fresh_path(os.path.join(work_dir, 'ingest.db'))
+    setup_databases(db_path)
+
+    start = time.perf_counter()
+    summary = process_html_files(archive_dir, db_path, workers=config['workers'], parser=config['parser'], transaction_size=config['transaction_size'])
+    elapsed = time.perf_counter() - start
+
+    rows = sum(stats['rows'] for stats in summary['tables'].values())
+    return {
+        'files': summary['pages'],
+        'failed': summary['failed'],
+        'rows': rows,
+        'seconds': elapsed,
+        'files_per_sec': summary['pages'] / elapsed,
+        'rows_per_sec': rows / elapsed,
+    }
+
+STAGE_FUNCTIONS = {
+    'crawl': stage_crawl,
+    'parse': stage_parse,
+    'store': stage_store,
+    'ingest': stage_ingest,
+}
+
+def run_stage(stage, work_dir):
+    # Child process entry point; the result goes to <work_dir>/<stage>.json
+    with open(os.path.join(work_dir, 'config.json')) as file:
+        config = json.load(file)
+    result = STAGE_FUNCTIONS[stage](config, work_dir)
+    with open(os.path.join(work_dir, f'{stage}.json'), 'w') as file:
+        json.dump(result, file)
+
+def spawn_stage(stage, config, work_dir):
+    with open(os.path.join(work_dir, 'config.json'), 'w') as file:
+        json.dump(config, file)
+    log_path = os.path.join(work_dir, f'{stage}.log')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'scripts.benchmark_suite', '--stage', stage, '--work-dir', work_dir],
+                                   stdout=log, stderr=subprocess.STDOUT, cwd=REPO_ROOT, env=env)
+        # wait4 rather than wait() to get this child's own resource usage
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Stage {stage} failed with exit code {process.returncode}; see {log_path}")
+
+    with open(os.path.join(work_dir, f'{stage}.json')) as file:
+        result = json.load(file)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    result['peak_rss_mb'] = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return result
+
+def is_metric(name):
+    return name.endswith(('_per_sec', '_ms')) or name == 'peak_rss_mb'
+
+def lower_is_better(name):
+    return name.endswith('_ms') or name == 'peak_rss_mb'
+
+def compare(results, baseline, threshold=0.1):
+    # Metrics that got worse by more than threshold (a fraction), as (stage, metric, baseline, current, change)
+    if {k: v for k, v in baseline['config'].items() if k != 'hosts'} != {k: v for k, v in results['config'].items() if k != 'hosts'}:
+        print("Warning: the baseline was taken with a different configuration")
+    regressions = []
+    print(f"{'metric':<26}{'baseline':>12}{'current':>12}{'change':>9}")
+    for stage, metrics in results['stages'].items():
+        previous = baseline['stages'].get(stage, {})
+        for name, value in metrics.items():
+            if not is_metric(name) or previous.get(name) in (None, 0) or value is None:
+                continue
+            change = (value - previous[name]) / previous[name]
+            worse = change > threshold if lower_is_better(name) else change < -threshold
+            print(f"{stage + '.' + name:<26}{previous[name]:>12.2f}{value:>12.2f}{change:>+9.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append((stage, name, previous[name], value, change))
+        for name in ('pages', 'files', 'rows'):
+            if name in metrics and name in previous and metrics[name] != previous[name]:
+                print(f"Warning: {stage} handled {metrics[name]} {name}, the baseline {previous[name]}")
+    return regressions
+
+def print_results(results):
+    for stage, metrics in results['stages'].items():
+        print(f"{stage}:")
+        for name, value in metrics.items():
+            print(f"  {name:<18} {value:.2f}" if isinstance(value, float) else f"  {name:<18} {value}")
+
+def run_benchmark(config=None, stages=None, work_dir=None, baseline_path=None, save_baseline=False, threshold=0.1):
+    from response_scraper.response_scraper.response_archive import ResponseArchive
+    from scripts.synthetic_site import MockSite, write_corpus
+
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    stages = stages or STAGES
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='benchmark_suite_'))
+    os.makedirs(work_dir, exist_ok=True)
+    results = {'config': config, 'stages': {}, 'started_at': time.time()}
+
+    if any(stage != 'crawl' for stage in stages):
+        archive = ResponseArchive(fresh_path(os.path.join(work_dir, 'corpus')))
+        hosts = [CORPUS_HOSTS.format(domain) for domain in range(config['domains'])]
+        pages = write_corpus(archive, hosts, config['pages_per_domain'], config['seed'])
+        archive.close()
+        print(f"Corpus: {pages} pages in {work_dir}/corpus")
+
+    for stage in stages:
+        print(f"Running {stage}...")
+        if stage == 'crawl':
+            with MockSite(config['domains'], config['pages_per_domain'], config['latency'], config['jitter'],
+                          config['rate_429'], config['retry_after'], config['seed']) as site:
+                result = spawn_stage(stage, dict(config, hosts=site.hosts), work_dir)
+                result['served_429'] = site.stats['statuses'].get(429, 0)
+        else:
+            result = spawn_stage(stage, config, work_dir)
+        results['stages'][stage] = result
+
+    print_results(results)
+    with open(os.path.join(work_dir, 'results.json'), 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {work_dir}/results.json")
+
+    regressions = []
+    if baseline_path and os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as file:
+            regressions = compare(results, json.load(file), threshold)
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0%}")
+    if baseline_path and save_baseline:
+        if os.path.dirname(baseline_path):
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+    return results, regressions
+
+def parse_setting(text):
+    name, _, value = text.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark crawling, parsing and storing against a local synthetic site.')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES), help='Comma-separated stages to run.')
+    parser.add_argument('--domains', type=int, default=DEFAULT_CONFIG['domains'], help='Domains in the synthetic site and corpus.')
+    parser.add_argument('--pages', type=int, default=DEFAULT_CONFIG['pages_per_domain'], help='Pages per domain.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_CONFIG['seed'], help='Seed for pages, latency and 429s.')
+    parser.add_argument('--latency', type=float, default=DEFAULT_CONFIG['latency'], help='Seconds the mock site adds to every response.')
+    parser.add_argument('--jitter', type=float, default=DEFAULT_CONFIG['jitter'], help='Up to this many extra seconds per response.')
+    parser.add_argument('--rate-429', type=float, default=DEFAULT_CONFIG['rate_429'], help='Share of requests answered with 429.')
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_CONFIG['retry_after'], help='Retry-After seconds sent with a 429.')
+    parser.add_argument('--depth', type=int, default=DEFAULT_CONFIG['tree_depth'], help='Crawl depth.')
+    parser.add_argument('--crawl-setting', action='append', default=[], metavar='NAME=VALUE',
+                        help='Scrapy setting for the crawl, e.g. DOMAIN_THROTTLE_MAX_RATE=50 (repeatable).')
+    parser.add_argument('--parser', choices=['lxml', 'bs4'], default=DEFAULT_CONFIG['parser'], help='Extraction backend.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_CONFIG['workers'], help='Parser processes for the ingest stage.')
+    parser.add_argument('--transaction-size', type=int, default=DEFAULT_CONFIG['transaction_size'], help='Rows written per transaction.')
+    parser.add_argument('--work-dir', type=str, help='Directory for the corpus, databases and logs (default: a new temporary directory).')
+    parser.add_argument('--baseline', type=str, default='output/benchmarks/baseline.json', help='Baseline results to compare against.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline instead of comparing.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change counted as a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if any metric regressed.')
+    parser.add_argument('--stage', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args.stage, args.work_dir)
+        sys.exit(0)
+
+    config = {
+        'domains': args.domains,
+        'pages_per_domain': args.pages,
+        'seed': args.seed,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'rate_429': args.rate_429,
+        'retry_after': args.retry_after,
+        'tree_depth': args.depth,
+        'crawl_settings': dict(parse_setting(setting) for setting in args.crawl_setting),
+        'parser': args.parser,
+        'workers': args.workers,
+        'transaction_size': args.transaction_size,
+    }
+    _, regressions = run_benchmark(config, args.stages.split(','), args.work_dir, args.baseline, args.save_baseline, args.threshold)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
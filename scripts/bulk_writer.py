@@ -0,0 +1,139 @@
+import time
+import logging
+from response_scraper.response_scraper.metrics import counter, histogram
+from scripts.storage import open_storage
+
+INSERT_SECONDS = histogram('db_insert_seconds', 'Time to load one buffered batch into a table')
+ROWS_WRITTEN = counter('db_rows_written_total', 'Rows written by BulkWriter')
+COMMIT_SECONDS = histogram('db_commit_seconds', 'Time to write and commit one BulkWriter transaction')
+
+class BulkWriter:
+    # Buffers rows per table and writes them with executemany, committing
+    # once every transaction_size rows instead of once per row. Callers that
+    # need an id before the row is written (forms -> form_fields) take one
+    # from next_id, which reserves ids in blocks through the id_blocks table
+    # so several writers on one database never hand out the same id.
+
+    def __init__(self, db_path='web_scraping/database/web_scraping.db', transaction_size=5000, conn=None, id_block_size=1000):
+        # db_path may also be a storage URL (scripts/storage.py)
+        self.storage = open_storage(db_path)
+        self.owns_connection = conn is None
+        self.conn = conn if conn is not None else self.storage.connect(timeout=60)
+        self.transaction_size = transaction_size
+        self.buffers = {}
+        self.deletes = {}
+        self.buffered = 0
+        self.callbacks = []
+        self.id_block_size = id_block_size
+        self.id_blocks = {}
+        self.stats = {}
+
+    def reserve_ids(self, table):
+        # Ids never go below MAX(id) + 1, so rows inserted without next_id are safe too
+        with self.storage.transaction(self.conn):
+            self.conn.execute(self.storage.schema('CREATE TABLE IF NOT EXISTS id_blocks (table_name TEXT PRIMARY KEY, next_id INTEGER)'))
+        with self.storage.transaction(self.conn, immediate=True):
+            row = self.conn.execute('SELECT next_id FROM id_blocks WHERE table_name = ?', (table,)).fetchone()
+            start = max(row[0] if row else 1, (self.conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0) + 1)
+            self.conn.execute('INSERT OR REPLACE INTO id_blocks (table_name, next_id) VALUES (?, ?)', (table, start + self.id_block_size))
+        return [start, start + self.id_block_size]
+
+    def next_id(self, table):
+        block = self.id_blocks.get(table)
+        if block is None or block[0] >= block[1]:
+            block = self.reserve_ids(table)
+            self.id_blocks[table] = block
+        block[0] += 1
+        return block[0] - 1
+
+    def add(self, table, row, or_ignore=False, or_replace=False):
+        conflict = 'OR IGNORE ' if or_ignore else 'OR REPLACE ' if or_replace else ''
+        key = (table, tuple(row), conflict)
+        if key not in self.buffers:
+            self.buffers[key] = []
+        self.buffers[key].append(tuple(row.values()))
+        self.buffered += 1
+
+    def delete(self, table, where, params):
+        # Buffered like add(); all deletes run before the inserts of the same flush
+        key = (table, where)
+        if key not in self.deletes:
+            self.deletes[key] = []
+        self.deletes[key].append(tuple(params))
+        self.buffered += 1
+
+    def savepoint(self):
+        # Buffer sizes to roll back to if the document being added fails
+        return ({key: len(rows) for key, rows in self.buffers.items()},
+                {key: len(params) for key, params in self.deletes.items()},
+                self.buffered, len(self.callbacks))
+
+    def rollback_to(self, savepoint):
+        # Drop everything buffered since savepoint(); ids taken from next_id are not reused
+        rows, deletes, buffered, callbacks = savepoint
+        for key in list(self.buffers):
+            del self.buffers[key][rows.get(key, 0):]
+        for key in list(self.deletes):
+            del self.deletes[key][deletes.get(key, 0):]
+        self.buffered = buffered
+        del self.callbacks[callbacks:]
+
+    def checkpoint(self):
+        # Called between units of work (one document) so a transaction never
+        # holds half of a document's rows
+        if self.buffered >= self.transaction_size:
+            self.flush()
+
+    def on_commit(self, callback):
+        # Run callback once the rows added so far are committed
+        self.callbacks.append(callback)
+
+    def record_stats(self, table, rows, seconds):
+        if table not in self.stats:
+            self.stats[table] = {'rows': 0, 'seconds': 0.0}
+        self.stats[table]['rows'] += rows
+        self.stats[table]['seconds'] += seconds
+        INSERT_SECONDS.observe(seconds, table=table)
+        ROWS_WRITTEN.inc(rows, table=table)
+
+    def flush(self):
+        if not self.buffered and not self.callbacks:
+            return
+        flush_start = time.perf_counter()
+        with self.storage.transaction(self.conn):
+            for (table, where), params in self.deletes.items():
+                self.conn.executemany(f'DELETE FROM {table} WHERE {where}', params)
+            for (table, columns, conflict), rows in self.buffers.items():
+                if not rows:
+                    continue
+                start = time.perf_counter()
+                self.storage.load(self.conn, table, columns, rows, conflict)
+                self.record_stats(table, len(rows), time.perf_counter() - start)
+        COMMIT_SECONDS.observe(time.perf_counter() - flush_start)
+        self.buffers = {}
+        self.deletes = {}
+        self.buffered = 0
+
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def execute(self, sql, params=()):
+        # Row-at-a-time statement that must see everything buffered so far
+        if self.buffered:
+            self.flush()
+        return self.conn.execute(sql, params)
+
+    def report(self):
+        report = {}
+        for table, stats in self.stats.items():
+            rows_per_sec = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+            report[table] = {'rows': stats['rows'], 'seconds': stats['seconds'], 'rows_per_sec': rows_per_sec}
+            logging.info(f"{table}: {stats['rows']} rows in {stats['seconds']:.3f}s ({rows_per_sec:.0f} rows/s)")
+        return report
+
+    def close(self):
+        self.flush()
+        self.conn.commit()
+        if self.owns_connection:
+            self.conn.close()
@@ -0,0 +1,178 @@
+import os
+import queue
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from response_scraper.response_scraper.metrics import counter, histogram
+
+EMBED_BATCH_SECONDS = histogram('embedding_batch_seconds', 'Model time per embedding batch')
+EMBED_TEXTS = counter('embedding_texts_total', 'Texts embedded, by whether the vector came from the cache or the model')
+
+class EmbeddingCache:
+    # Vectors keyed by sha256(model + text), stored as raw float32 bytes
+
+    def __init__(self, db_path='web_scraping/database/embedding_cache.db'):
+        database_dir = os.path.dirname(db_path)
+        if database_dir and not os.path.exists(database_dir):
+            os.makedirs(database_dir)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+            text_hash TEXT PRIMARY KEY,
+            dimensions INTEGER,
+            vector BLOB
+        )
+        ''')
+        self.conn.commit()
+
+    def get_many(self, text_hashes, chunk_size=500):
+        found = {}
+        for i in range(0, len(text_hashes), chunk_size):
+            chunk = text_hashes[i:i + chunk_size]
+            rows = self.conn.execute(f'''
+            SELECT text_hash, vector FROM embeddings WHERE text_hash IN ({', '.join('?' * len(chunk))})
+            ''', chunk).fetchall()
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, vectors):
+        with self.conn:
+            self.conn.executemany('''
+            INSERT OR IGNORE INTO embeddings (text_hash, dimensions, vector) VALUES (?, ?, ?)
+            ''', [(text_hash, len(vector), np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in vectors.items()])
+
+    def close(self):
+        self.conn.close()
+
+class EmbeddingService:
+    # Encodes texts in large batches and never encodes the same text twice:
+    # repeated texts within a call are collapsed, and earlier results come
+    # from the cache.
+
+    def __init__(self, model_name='all-MiniLM-L6-v2', batch_size=256, cache_path='web_scraping/database/embedding_cache.db', encoder=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self.encoder = encoder
+        self.cache = None
+        self.stats = {'texts': 0, 'cache_hits': 0, 'encoded': 0}
+
+    def open(self):
+        # Deferred so the model and cache connection are created on the
+        # thread that uses them
+        if self.encoder is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(self.model_name, device='cpu')
+            self.encoder = lambda texts: model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        if self.cache is None:
+            self.cache = EmbeddingCache(self.cache_path)
+
+    def text_hash(self, text):
+        return hashlib.sha256(f'{self.model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+    def embed_many(self, texts):
+        self.open()
+        hashes = [self.text_hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self.cache.get_many(list(unique))
+
+        missing = [text_hash for text_hash in unique if text_hash not in vectors]
+        if missing:
+            with EMBED_BATCH_SECONDS.time():
+                encoded = self.encoder([unique[text_hash] for text_hash in missing])
+            new_vectors = {text_hash: np.asarray(vector, dtype=np.float32) for text_hash, vector in zip(missing, encoded)}
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        self.stats['texts'] += len(texts)
+        self.stats['cache_hits'] += len(texts) - len(missing)
+        self.stats['encoded'] += len(missing)
+        EMBED_TEXTS.inc(len(texts) - len(missing), source='cache')
+        EMBED_TEXTS.inc(len(missing), source='model')
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+class EmbeddingPipeline:
+    # Runs an EmbeddingService on a background thread. Callers submit items
+    # with the texts they need embedded and keep parsing; the thread gathers
+    # texts from many items into one model call and hands each item back with
+    # its vectors through completed().
+
+    def __init__(self, service, max_pending=64, linger=0.5):
+        self.service = service
+        self.batch_size = service.batch_size
+        self.linger = linger
+        self.inbox = queue.Queue(maxsize=max_pending)
+        self.outbox = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='embedding-pipeline', daemon=True)
+        self.thread.start()
+
+    def put(self, entry):
+        # Bounded put that gives up if the worker thread has died
+        while True:
+            if self.error:
+                raise self.error
+            try:
+                self.inbox.put(entry, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def submit(self, item, texts):
+        self.put((item, texts))
+
+    def run(self):
+        finished = False
+        try:
+            while not finished:
+                batch = [self.inbox.get()]
+                if batch[0] is None:
+                    break
+                text_count = len(batch[0][1])
+                # Keep collecting until the batch is full or producers go quiet
+                while text_count < self.batch_size:
+                    try:
+                        entry = self.inbox.get(timeout=self.linger)
+                    except queue.Empty:
+                        break
+                    if entry is None:
+                        finished = True
+                        break
+                    batch.append(entry)
+                    text_count += len(entry[1])
+
+                vectors = self.service.embed_many([text for _, texts in batch for text in texts])
+                position = 0
+                for item, texts in batch:
+                    self.outbox.put((item, vectors[position:position + len(texts)]))
+                    position += len(texts)
+        except Exception as e:
+            logging.error(f"Embedding pipeline failed: {e}")
+            self.error = e
+        finally:
+            self.service.close()
+
+    def completed(self):
+        # Drain whatever has been embedded so far without blocking
+        while True:
+            try:
+                yield self.outbox.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return list(self.completed())
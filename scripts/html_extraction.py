@@ -0,0 +1,125 @@
+import json
+import time
+import hashlib
+from urllib.parse import urljoin
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+
+def extract_document(record):
+    # Turn one archived response into plain rows for every table written by
+    # process_html_files. Only builtins are returned so the result can be
+    # pickled back from a worker process.
+    original_url = record['url']
+    content = record['body'].decode(record['encoding'] or 'utf-8', errors='replace')
+    soup = BeautifulSoup(content, 'html.parser')
+
+    # Compute URL hash
+    url_hash = hashlib.md5(original_url.encode()).hexdigest()
+
+    # Links resolve against <base href> if present, else the fetched URL
+    base = soup.find('base', href=True)
+    base_url = urljoin(original_url, base['href'].strip()) if base and base['href'].strip() else original_url
+
+    # Extract headers
+    headers = [header.get_text() for header in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
+
+    document = {
+        'record_hash': record['url_hash'],
+        'url': original_url,
+        'soup': {
+            'url': original_url,
+            'headers': json.dumps(headers),
+            'content': str(soup),
+            'embedding': '',
+            'url_hash': url_hash
+        },
+        'images': [],
+        'forms': [],
+        'links': [],
+        'tables': []
+    }
+
+    for img in soup.find_all('img'):
+        document['images'].append({
+            'url': original_url,
+            'src': img.get('src'),
+            'url_hash': url_hash
+        })
+
+    for form in soup.find_all('form'):
+        fields = []
+        for field in form.find_all(['input', 'select', 'textarea']):
+            fields.append({
+                'name': field.get('name'),
+                'type': field.get('type'),
+                'value': field.get('value')
+            })
+        document['forms'].append({
+            'form': {
+                'url': original_url,
+                'action': form.get('action'),
+                'method': form.get('method'),
+                'embedding': '',
+                'url_hash': url_hash
+            },
+            'fields': fields
+        })
+
+    for link in soup.find_all('a', href=True):
+        linked_to = urljoin(base_url, link['href'])
+        document['links'].append({
+            'id': hashlib.md5(linked_to.encode()).hexdigest(),
+            'url': original_url,
+            'names': link.get_text(),
+            'linked_to': linked_to,
+            'linked_from': original_url,
+            'url_hash': url_hash
+        })
+
+    for table in soup.find_all('table'):
+        document['tables'].append({
+            'url': original_url,
+            'table_html': str(table),
+            'url_hash': url_hash
+        })
+
+    return document
+
+def extract_timed(extractor, record):
+    # Runs in the parse worker; the time taken travels back with the
+    # document as parse_seconds for the caller's metrics
+    start = time.perf_counter()
+    document = extractor(record)
+    document['parse_seconds'] = time.perf_counter() - start
+    return document
+
+def extract_or_error(extractor, record):
+    # For use with functools.partial: a page that fails to parse comes back
+    # as an error entry instead of stopping the whole run
+    try:
+        return extract_timed(extractor, record)
+    except Exception as e:
+        return {'record_hash': record['url_hash'], 'url': record['url'], 'error': repr(e)}
+
+def iter_extracted(records, extractor=extract_document, workers=1, queue_size=None):
+    # Yield extracted documents in the same order as records. With more than
+    # one worker, parsing runs in a process pool while at most queue_size
+    # documents are in flight, so a slow writer holds back the readers
+    # instead of letting results pile up in memory.
+    if workers <= 1:
+        for record in records:
+            yield extractor(record)
+        return
+
+    if not queue_size:
+        queue_size = workers * 4
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for record in records:
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+            pending.append(executor.submit(extractor, record))
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,181 @@
+import os
+import time
+import socket
+import logging
+from scripts.storage import open_storage
+
+# Ingestion state for every archived response, kept in web_scraping.db next
+# to the rows it describes:
+#
+#   pending -> claimed -> parsed -> committed
+#                     \-> failed
+#
+# Claims are taken under BEGIN IMMEDIATE, so several ingest processes can
+# share one archive without taking the same response. The committed state
+# goes through the caller's BulkWriter and lands in the same transaction as
+# the page's rows, so a crash either keeps both or neither. Claims that are
+# not committed within lease_seconds (a worker that died) are handed out
+# again, and clear_page() removes whatever an earlier attempt wrote, so
+# re-running ingestion never duplicates rows.
+
+# Tables holding one page's rows, keyed by url_hash; form_fields goes first
+# because it is found through forms. links and link_urls are shared by
+# every page linking to a URL, so they only lose the URLs no other page's
+# edges point at, and are cleared before link_edges.
+PAGE_TABLES = [
+    ('form_fields', 'form_id IN (SELECT id FROM forms WHERE url_hash = ?)'),
+    ('forms', 'url_hash = ?'),
+    ('images', 'url_hash = ?'),
+    ('tables', 'url_hash = ?'),
+    ('soups', 'url_hash = ?'),
+    ('links', "url_hash = ? AND id NOT IN (SELECT to_url_id FROM link_edges WHERE COALESCE(url_hash, '') <> ?)"),
+    ('link_urls', '''id IN (SELECT to_url_id FROM link_edges WHERE url_hash = ?)
+        AND id NOT IN (SELECT to_url_id FROM link_edges WHERE COALESCE(url_hash, '') <> ?)
+        AND id NOT IN (SELECT from_url_id FROM link_edges WHERE COALESCE(url_hash, '') <> ?)'''),
+    ('link_edges', 'url_hash = ?'),
+]
+
+def clear_page(writer, url_hash, tables=None):
+    # tables limits the clear to the ones a partial extraction rewrites
+    for table, where in PAGE_TABLES:
+        if tables is None or table in tables:
+            writer.delete(table, where, (url_hash,) * where.count('?'))
+
+class IngestLedger:
+    def __init__(self, db_path, archive, worker_id=None, lease_seconds=600):
+        self.archive = archive
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_seconds = lease_seconds
+        self.claimed = {}
+        self.parsed = []
+        self.committed = []
+
+        # Autocommit; every change goes through an immediate transaction
+        self.storage = open_storage(db_path)
+        self.conn = self.storage.connect(timeout=60, autocommit=True)
+
+    def transaction(self, statements):
+        # Row counts of the statements
+        with self.storage.transaction(self.conn, immediate=True):
+            return [self.storage.rowcount(self.conn.execute(sql, params)) for sql, params in statements]
+
+    def sync(self):
+        # Queue archived responses not yet ingested, and re-queue ones whose
+        # content changed since they were committed. Returns how many are pending.
+        self.archive.commit()
+        now = time.time()
+        rows = self.archive.conn.execute('SELECT url_hash, content_hash FROM responses WHERE processed = 0').fetchall()
+        if rows:
+            with self.storage.transaction(self.conn, immediate=True):
+                self.conn.executemany('''
+                INSERT INTO ingest_ledger (url_hash, content_hash, state, attempts, updated_at)
+                VALUES (?, ?, 'pending', 0, ?)
+                ON CONFLICT(url_hash) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                state = 'pending',
+                attempts = 0,
+                error = NULL,
+                updated_at = excluded.updated_at
+                WHERE COALESCE(ingest_ledger.content_hash, '') <> COALESCE(excluded.content_hash, '')
+                ''', [(url_hash, content_hash, now) for url_hash, content_hash in rows])
+        return self.conn.execute("SELECT COUNT(*) FROM ingest_ledger WHERE state = 'pending'").fetchone()[0]
+
+    def claim(self, limit=100):
+        self.flush_parsed()
+        now = time.time()
+        with self.storage.transaction(self.conn, immediate=True):
+            rows = self.conn.execute('''
+            SELECT url_hash, attempts FROM ingest_ledger
+            WHERE state = 'pending' OR (state IN ('claimed', 'parsed') AND claimed_at < ?)
+            ORDER BY rowid LIMIT ?
+            ''', (now - self.lease_seconds, limit)).fetchall()
+            if not rows:
+                return []
+            self.conn.executemany('''
+            UPDATE ingest_ledger SET state = 'claimed', worker = ?, claimed_at = ?, attempts = attempts + 1, updated_at = ?
+            WHERE url_hash = ?
+            ''', [(self.worker_id, now, now, url_hash) for url_hash, _ in rows])
+        for url_hash, attempts in rows:
+            self.claimed[url_hash] = {'attempts': attempts + 1, 'claimed_at': now}
+        return [url_hash for url_hash, _ in rows]
+
+    def iter_claimed(self, claim_size=100):
+        # Archive records for this worker, claiming claim_size at a time
+        while True:
+            url_hashes = self.claim(claim_size)
+            if not url_hashes:
+                return
+            for url_hash in url_hashes:
+                record = self.archive.get(url_hash)
+                if record is None:
+                    self.fail(url_hash, 'missing from archive')
+                    continue
+                # The body may have changed since sync; commit the version actually parsed
+                self.claimed[url_hash]['content_hash'] = record['content_hash']
+                yield record
+
+    def mark_parsed(self, url_hash):
+        # Written with the next claim; only informational, as the lease decides re-claims
+        self.parsed.append(url_hash)
+
+    def flush_parsed(self):
+        if not self.parsed:
+            return
+        self.transaction([('''
+        UPDATE ingest_ledger SET state = 'parsed', updated_at = ?
+        WHERE url_hash = ? AND state = 'claimed' AND worker = ?
+        ''', (time.time(), url_hash, self.worker_id)) for url_hash in self.parsed])
+        self.parsed = []
+
+    def commit(self, writer, url_hash, content_hash=None):
+        # Buffered with the page's rows and committed in the same transaction
+        claim = self.claimed.pop(url_hash, {})
+        writer.add('ingest_ledger', {
+            'url_hash': url_hash,
+            'content_hash': content_hash or claim.get('content_hash'),
+            'state': 'committed',
+            'worker': self.worker_id,
+            'claimed_at': claim.get('claimed_at'),
+            'attempts': claim.get('attempts', 1),
+            'error': None,
+            'updated_at': time.time()
+        }, or_replace=True)
+
+        # One archive update per writer commit rather than one per page
+        if not self.committed:
+            writer.on_commit(self.mark_committed)
+        self.committed.append(url_hash)
+
+    def mark_committed(self):
+        # Mirror committed pages into the archive's processed flag so sync skips them
+        self.archive.mark_processed_many(self.committed)
+        self.committed = []
+
+    def fail(self, url_hash, error):
+        self.claimed.pop(url_hash, None)
+        self.transaction([('''
+        UPDATE ingest_ledger SET state = 'failed', error = ?, updated_at = ? WHERE url_hash = ?
+        ''', (str(error), time.time(), url_hash))])
+        logging.error(f"Ingestion failed for {url_hash}: {error}")
+
+    def retry_failed(self):
+        count, = self.transaction([("UPDATE ingest_ledger SET state = 'pending', error = NULL WHERE state = 'failed'", ())])
+        return count
+
+    def release(self):
+        # Hand back claims this worker did not get to, e.g. when stopped early
+        self.parsed = []
+        count, = self.transaction([('''
+        UPDATE ingest_ledger SET state = 'pending', worker = NULL, claimed_at = NULL
+        WHERE worker = ? AND state IN ('claimed', 'parsed')
+        ''', (self.worker_id,))])
+        self.claimed = {}
+        return count
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM ingest_ledger GROUP BY state').fetchall())
+
+    def close(self):
+        # Call after the writer is closed so committed pages are not released
+        self.release()
+        self.conn.close()
@@ -0,0 +1,326 @@
+import io
+import json
+import hashlib
+from urllib.parse import urljoin
+from lxml import etree
+
+HEADER_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+FIELD_TAGS = {'input', 'select', 'textarea'}
+
+def walk_document(body, encoding=None):
+    # One streaming pass over the document. Every element the extractors
+    # need is bucketed as the parser emits it, and form fields and select
+    # options are attached to the form/select that is open at that point,
+    # so nothing is searched for a second time.
+    found = {
+        'root': None,
+        'headers': [],
+        'images': [],
+        'forms': [],
+        'links': [],
+        'tables': [],
+        'meta': [],
+        'bases': []
+    }
+    if not body or not body.strip():
+        return found
+
+    open_forms = []
+    open_selects = []
+    context = etree.iterparse(io.BytesIO(body), events=('start', 'end'), html=True, recover=True, encoding=encoding)
+    for event, element in context:
+        tag = element.tag
+        if not isinstance(tag, str):
+            continue
+
+        if event == 'end':
+            if tag == 'form' and open_forms:
+                open_forms.pop()
+            elif tag == 'select' and open_selects:
+                open_selects.pop()
+            continue
+
+        if tag in HEADER_TAGS:
+            found['headers'].append(element)
+        elif tag == 'a':
+            found['links'].append(element)
+        elif tag == 'img':
+            found['images'].append(element)
+        elif tag == 'table':
+            found['tables'].append(element)
+        elif tag == 'meta':
+            found['meta'].append(element)
+        elif tag == 'base':
+            found['bases'].append(element)
+        elif tag == 'form':
+            form = {'element': element, 'fields': []}
+            found['forms'].append(form)
+            open_forms.append(form)
+        elif tag == 'option' and open_selects:
+            open_selects[-1]['options'].append(element.get('value'))
+
+        if tag in FIELD_TAGS and open_forms:
+            field = {'element': element, 'options': []}
+            open_forms[-1]['fields'].append(field)
+            if tag == 'select':
+                open_selects.append(field)
+
+    found['root'] = context.root
+    return found
+
+def element_text(element):
+    # XPath string value matches BeautifulSoup's get_text() and skips comments
+    return element.xpath('string()')
+
+def stripped_text(element):
+    # Equivalent of get_text(strip=True): each text node stripped, then joined
+    return ''.join(text.strip() for text in element.xpath('.//text()'))
+
+def element_html(element):
+    return etree.tostring(element, method='html', encoding='unicode', with_tail=False)
+
+def resolve_base_url(found, page_url):
+    # Links resolve against <base href> when the page has one (itself
+    # relative to the page URL), otherwise against the URL it was fetched from
+    for base in found['bases']:
+        href = base.get('href')
+        if href and href.strip():
+            return urljoin(page_url or '', href.strip())
+    return page_url
+
+def extract_document(record):
+    # Same record shape as html_extraction.extract_document
+    original_url = record['url']
+    found = walk_document(record['body'], record['encoding'])
+    base_url = resolve_base_url(found, original_url)
+    url_hash = hashlib.md5(original_url.encode()).hexdigest()
+    headers = [element_text(header) for header in found['headers']]
+
+    document = {
+        'record_hash': record['url_hash'],
+        'url': original_url,
+        'soup': {
+            'url': original_url,
+            'headers': json.dumps(headers),
+            'content': element_html(found['root']) if found['root'] is not None else '',
+            'embedding': '',
+            'url_hash': url_hash
+        },
+        'images': [],
+        'forms': [],
+        'links': [],
+        'tables': []
+    }
+
+    for img in found['images']:
+        document['images'].append({
+            'url': original_url,
+            'src': img.get('src'),
+            'url_hash': url_hash
+        })
+
+    for form in found['forms']:
+        document['forms'].append({
+            'form': {
+                'url': original_url,
+                'action': form['element'].get('action'),
+                'method': form['element'].get('method'),
+                'embedding': '',
+                'url_hash': url_hash
+            },
+            'fields': [{
+                'name': field['element'].get('name'),
+                'type': field['element'].get('type'),
+                'value': field['element'].get('value')
+            } for field in form['fields']]
+        })
+
+    for link in found['links']:
+        href = link.get('href')
+        if href is None:
+            continue
+        linked_to = urljoin(base_url, href)
+        document['links'].append({
+            'id': hashlib.md5(linked_to.encode()).hexdigest(),
+            'url': original_url,
+            'names': element_text(link),
+            'linked_to': linked_to,
+            'linked_from': original_url,
+            'url_hash': url_hash
+        })
+
+    for table in found['tables']:
+        document['tables'].append({
+            'url': original_url,
+            'table_html': element_html(table),
+            'url_hash': url_hash
+        })
+
+    return document
+
+class PageScanner:
+    # lxml parser target for jobs that need neither the serialized page nor
+    # tables. The parser tokenizes the page and calls start/end/data as it
+    # goes; only the requested parts are kept and no element tree is built.
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.bases = []
+        self.images = []
+        self.links = []
+        self.forms = []
+        self.open_links = []
+        self.open_forms = []
+
+    def start(self, tag, attrib):
+        if tag == 'base':
+            self.bases.append(attrib.get('href'))
+        elif tag == 'a' and 'links' in self.parts:
+            self.open_links.append({'href': attrib.get('href'), 'text': []})
+        elif tag == 'img' and 'images' in self.parts:
+            self.images.append(attrib.get('src'))
+        elif tag == 'form' and 'forms' in self.parts:
+            form = {'action': attrib.get('action'), 'method': attrib.get('method'), 'fields': []}
+            self.forms.append(form)
+            self.open_forms.append(form)
+        if tag in FIELD_TAGS and self.open_forms:
+            self.open_forms[-1]['fields'].append({
+                'name': attrib.get('name'),
+                'type': attrib.get('type'),
+                'value': attrib.get('value')
+            })
+
+    def end(self, tag):
+        if tag == 'a' and self.open_links:
+            link = self.open_links.pop()
+            self.links.append(link)
+            # Text of a nested link also counts for the one around it, as with string()
+            if self.open_links:
+                self.open_links[-1]['text'].extend(link['text'])
+        elif tag == 'form' and self.open_forms:
+            self.open_forms.pop()
+
+    def data(self, text):
+        if self.open_links:
+            self.open_links[-1]['text'].append(text)
+
+    def close(self):
+        return self
+
+def scan_document(record, parts):
+    # extract_document restricted to parts (any of 'links', 'forms',
+    # 'images'), read with PageScanner. soup and tables stay empty.
+    original_url = record['url']
+    url_hash = hashlib.md5(original_url.encode()).hexdigest()
+    document = {
+        'record_hash': record['url_hash'],
+        'url': original_url,
+        'soup': None,
+        'images': [],
+        'forms': [],
+        'links': [],
+        'tables': []
+    }
+    body = record['body']
+    if not body or not body.strip():
+        return document
+
+    scanner = PageScanner(parts)
+    parser = etree.HTMLParser(target=scanner, encoding=record['encoding'], recover=True)
+    parser.feed(body)
+    parser.close()
+
+    base_url = original_url
+    for href in scanner.bases:
+        if href and href.strip():
+            base_url = urljoin(original_url, href.strip())
+            break
+
+    for src in scanner.images:
+        document['images'].append({'url': original_url, 'src': src, 'url_hash': url_hash})
+
+    for form in scanner.forms:
+        document['forms'].append({
+            'form': {
+                'url': original_url,
+                'action': form['action'],
+                'method': form['method'],
+                'embedding': '',
+                'url_hash': url_hash
+            },
+            'fields': form['fields']
+        })
+
+    for link in scanner.links:
+        if link['href'] is None:
+            continue
+        linked_to = urljoin(base_url, link['href'])
+        document['links'].append({
+            'id': hashlib.md5(linked_to.encode()).hexdigest(),
+            'url': original_url,
+            'names': ''.join(link['text']),
+            'linked_to': linked_to,
+            'linked_from': original_url,
+            'url_hash': url_hash
+        })
+
+    return document
+
+def extract_page(body, page_url=None, encoding=None):
+    # Same shapes as parse_and_store.ParseObject, plus the resolved base URL
+    # and serialized page so callers do not need a BeautifulSoup tree at all.
+    # page_url is the URL the response was fetched from (the archive record's
+    # url); og:url is only a last resort for bodies that come without one.
+    found = walk_document(body, encoding)
+
+    base_url = resolve_base_url(found, page_url)
+    if base_url is None:
+        base_url = 'unknown'
+        for meta in found['meta']:
+            if meta.get('property') == 'og:url' and meta.get('content') is not None:
+                base_url = meta.get('content')
+                break
+
+    images = [urljoin(base_url, img.get('src')) for img in found['images'] if img.get('src')]
+
+    forms = []
+    for form in found['forms']:
+        form_data = {
+            'action': form['element'].get('action'),
+            'method': form['element'].get('method'),
+            'fields': []
+        }
+        # ParseObject lists inputs before selects and ignores textareas
+        for field in form['fields']:
+            if field['element'].tag == 'input':
+                form_data['fields'].append({
+                    'name': field['element'].get('name'),
+                    'type': field['element'].get('type'),
+                    'value': field['element'].get('value')
+                })
+        for field in form['fields']:
+            if field['element'].tag == 'select':
+                form_data['fields'].append({
+                    'name': field['element'].get('name'),
+                    'type': 'select',
+                    'options': field['options']
+                })
+        forms.append(form_data)
+
+    links = []
+    for link in found['links']:
+        href = link.get('href')
+        if href:
+            links.append({
+                'text': stripped_text(link),
+                'url': urljoin(base_url, href)
+            })
+
+    return {
+        'page_url': page_url or base_url,
+        'base_url': base_url,
+        'images': images,
+        'forms': forms,
+        'links': links,
+        'content': element_html(found['root']) if found['root'] is not None else ''
+    }
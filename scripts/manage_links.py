@@ -1,29 +1,75 @@
-import sqlite3
 import json
 import logging
+from scripts.storage import open_storage
+from response_scraper.response_scraper.canonical import canonicalize_url
 
 class LinkDatabase:
     def __init__(self, db_path='scripts/links_database.db'):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        self.storage = open_storage(db_path)
+        self.conn = self.storage.connect()
         self.cursor = self.conn.cursor()
+        self.setup_tables()
+
+    def setup_tables(self):
+        self.cursor.execute(self.storage.schema("CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, url TEXT UNIQUE, found_on TEXT, links_to TEXT)"))
+        self.cursor.execute(self.storage.schema("CREATE TABLE IF NOT EXISTS url_names (id INTEGER PRIMARY KEY, url_id INTEGER, name TEXT)"))
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'url_edges'")
+        has_edges = self.cursor.fetchone() is not None
+        # One edge per (page, linked page, anchor); relationships used to be JSON lists on urls
+        self.cursor.execute(self.storage.schema('''
+            CREATE TABLE IF NOT EXISTS url_edges (
+                from_url_id INTEGER NOT NULL,
+                to_url_id INTEGER NOT NULL,
+                anchor_text TEXT NOT NULL DEFAULT '',
+                UNIQUE (from_url_id, to_url_id, anchor_text)
+            )
+        '''))
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_url_edges_to ON url_edges (to_url_id)")
+        self.conn.commit()
+        if not has_edges:
+            self.migrate_json_relationships()
+
+    def migrate_json_relationships(self):
+        self.cursor.execute("SELECT url, found_on, links_to FROM urls WHERE found_on IS NOT NULL OR links_to IS NOT NULL")
+        for url, found_on, links_to in self.cursor.fetchall():
+            self.add_edges(url, json.loads(found_on) if found_on else None, json.loads(links_to) if links_to else None)
+        self.cursor.execute("UPDATE urls SET found_on = NULL, links_to = NULL")
+        self.conn.commit()
+        logging.info("Migrated JSON relationships to url_edges")
+
+    def ensure_url_ids(self, urls):
+        self.cursor.executemany("INSERT INTO urls (url) VALUES (?) ON CONFLICT (url) DO NOTHING", [(u,) for u in urls])
+        ids = {}
+        for u in urls:
+            self.cursor.execute("SELECT id FROM urls WHERE url = ?", (u,))
+            ids[u] = self.cursor.fetchone()[0]
+        return ids
+
+    def add_edges(self, url, found_on=None, links_to=None, anchor_text=''):
+        # Stored under canonical URLs, the same spelling the spider uses
+        url = canonicalize_url(url)
+        found_on = [canonicalize_url(f) for f in found_on or []]
+        links_to = [canonicalize_url(l) for l in links_to or []]
+        ids = self.ensure_url_ids([url] + found_on + links_to)
+        edges = [(ids[f], ids[url], anchor_text) for f in found_on]
+        edges += [(ids[url], ids[l], anchor_text) for l in links_to]
+        self.cursor.executemany('''
+            INSERT INTO url_edges (from_url_id, to_url_id, anchor_text) VALUES (?, ?, ?)
+            ON CONFLICT (from_url_id, to_url_id, anchor_text) DO NOTHING
+        ''', edges)
+        return ids[url]
 
     def close(self):
         self.conn.close()
 
     def add_url(self, url, found_on=None, links_to=None):
         try:
-            self.cursor.execute("INSERT OR IGNORE INTO urls (url, found_on, links_to) VALUES (?, ?, ?)", (url, json.dumps(found_on), json.dumps(links_to)))
+            url_id = self.add_edges(url, found_on, links_to)
             self.conn.commit()
-            self.cursor.execute("SELECT id FROM urls WHERE url = ?", (url,))
-            url_id = self.cursor.fetchone()
-            if url_id:
-                logging.info(f"Added URL: {url} with ID: {url_id[0]}")
-                return url_id[0]
-            else:
-                logging.error(f"Failed to retrieve ID for URL: {url}")
-                return None
-        except sqlite3.Error as e:
+            logging.info(f"Added URL: {url} with ID: {url_id}")
+            return url_id
+        except self.storage.Error as e:
             logging.error(f"Error adding URL: {url} - {e}")
             return None
 
@@ -32,7 +78,7 @@ class LinkDatabase:
             self.cursor.execute("INSERT INTO url_names (url_id, name) VALUES (?, ?)", (url_id, name))
             self.conn.commit()
             logging.info(f"Added name: {name} for URL ID: {url_id}")
-        except sqlite3.Error as e:
+        except self.storage.Error as e:
             logging.error(f"Error adding name: {name} for URL ID: {url_id} - {e}")
 
     def update_relationships(self, url, found_on=None, links_to=None):
@@ -41,27 +87,17 @@ class LinkDatabase:
             url_id = self.add_url(url, found_on, links_to)
         else:
             try:
-                self.cursor.execute("SELECT found_on, links_to FROM urls WHERE id = ?", (url_id,))
-                row = self.cursor.fetchone()
-                current_found_on = json.loads(row[0]) if row[0] else []
-                current_links_to = json.loads(row[1]) if row[1] else []
-
-                if found_on:
-                    current_found_on.extend([f for f in found_on if f not in current_found_on])
-                if links_to:
-                    current_links_to.extend([l for l in links_to if l not in current_links_to])
-
-                self.cursor.execute("UPDATE urls SET found_on = ?, links_to = ? WHERE id = ?", (json.dumps(current_found_on), json.dumps(current_links_to), url_id))
+                self.add_edges(url, found_on, links_to)
                 self.conn.commit()
                 logging.info(f"Updated URL: {url} with ID: {url_id}")
-            except sqlite3.Error as e:
+            except self.storage.Error as e:
                 logging.error(f"Error updating relationships for URL: {url} with ID: {url_id} - {e}")
 
         return url_id
 
     def get_url_id(self, url):
         try:
-            self.cursor.execute("SELECT id FROM urls WHERE url = ?", (url,))
+            self.cursor.execute("SELECT id FROM urls WHERE url = ?", (canonicalize_url(url),))
             result = self.cursor.fetchone()
             if result:
                 logging.info(f"Retrieved URL ID: {result[0]} for URL: {url}")
@@ -69,7 +105,7 @@ class LinkDatabase:
             else:
                 logging.info(f"No URL ID found for URL: {url}")
                 return None
-        except sqlite3.Error as e:
+        except self.storage.Error as e:
             logging.error(f"Error retrieving URL ID for URL: {url} - {e}")
             return None
 
@@ -79,23 +115,29 @@ class LinkDatabase:
             names = [row[0] for row in self.cursor.fetchall()]
             logging.info(f"Retrieved names: {names} for URL ID: {url_id}")
             return names
-        except sqlite3.Error as e:
+        except self.storage.Error as e:
             logging.error(f"Error retrieving names for URL ID: {url_id} - {e}")
             return []
 
     def get_relationships(self, url_id):
         try:
-            self.cursor.execute("SELECT found_on, links_to FROM urls WHERE id = ?", (url_id,))
-            row = self.cursor.fetchone()
-            if row:
-                found_on = json.loads(row[0]) if row[0] else []
-                links_to = json.loads(row[1]) if row[1] else []
+            # Edges come back in insertion order, as the JSON lists did
+            self.cursor.execute('''
+                SELECT u.url FROM url_edges e JOIN urls u ON u.id = e.from_url_id
+                WHERE e.to_url_id = ? GROUP BY e.from_url_id, u.url ORDER BY MIN(e.rowid)
+            ''', (url_id,))
+            found_on = [row[0] for row in self.cursor.fetchall()]
+            self.cursor.execute('''
+                SELECT u.url FROM url_edges e JOIN urls u ON u.id = e.to_url_id
+                WHERE e.from_url_id = ? GROUP BY e.to_url_id, u.url ORDER BY MIN(e.rowid)
+            ''', (url_id,))
+            links_to = [row[0] for row in self.cursor.fetchall()]
+            if found_on or links_to:
                 logging.info(f"Retrieved relationships for URL ID: {url_id} - Found On: {found_on}, Links To: {links_to}")
-                return found_on, links_to
             else:
                 logging.info(f"No relationships found for URL ID: {url_id}")
-                return [], []
-        except sqlite3.Error as e:
+            return found_on, links_to
+        except self.storage.Error as e:
             logging.error(f"Error retrieving relationships for URL ID: {url_id} - {e}")
             return [], []
 
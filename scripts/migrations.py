@@ -0,0 +1,83 @@
+import logging
+from scripts.storage import open_storage, SQLiteStorage
+
+# Each entry moves the schema from version - 1 to version. The applied
+# version is kept in PRAGMA user_version (a schema_version table on DuckDB),
+# so running migrate() again is a no-op and new steps only ever get
+# appended here.
+MIGRATIONS = [
+    (1, 'Indexes for per-URL lookups', [
+        'CREATE INDEX IF NOT EXISTS idx_soups_url_hash ON soups (url_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_images_url_hash ON images (url_hash, src)',
+        'CREATE INDEX IF NOT EXISTS idx_forms_url ON forms (url)',
+        'CREATE INDEX IF NOT EXISTS idx_forms_url_hash ON forms (url_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_form_fields_form_id ON form_fields (form_id)',
+        'CREATE INDEX IF NOT EXISTS idx_form_fields_name ON form_fields (name, form_id)',
+        'CREATE INDEX IF NOT EXISTS idx_links_url ON links (url)',
+        'CREATE INDEX IF NOT EXISTS idx_links_url_hash ON links (url_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_links_linked_to ON links (linked_to)',
+        'CREATE INDEX IF NOT EXISTS idx_tables_url ON tables (url)',
+        'CREATE INDEX IF NOT EXISTS idx_tables_url_hash ON tables (url_hash)',
+    ]),
+    (2, 'One row per (url, src) in images', [
+        # Drop duplicates left by inserts that had no constraint to ignore
+        'DELETE FROM images WHERE id NOT IN (SELECT MIN(id) FROM images GROUP BY url, src)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_images_url_src ON images (url, src)',
+    ]),
+    (3, 'SimHash fingerprints for near-duplicate pages', [
+        '''CREATE TABLE IF NOT EXISTS page_fingerprints (
+            url_hash TEXT PRIMARY KEY,
+            url TEXT,
+            simhash INTEGER,
+            duplicate_of TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_page_fingerprints_duplicate_of ON page_fingerprints (duplicate_of)',
+    ]),
+    (4, 'Ingestion ledger (scripts/ingest_ledger.py)', [
+        '''CREATE TABLE IF NOT EXISTS ingest_ledger (
+            url_hash TEXT PRIMARY KEY,
+            content_hash TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            claimed_at REAL,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            updated_at REAL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_ingest_ledger_state ON ingest_ledger (state, claimed_at)',
+    ]),
+    (5, 'Page that wrote each link edge, for clear_page', [
+        'ALTER TABLE link_edges ADD COLUMN url_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_link_edges_url_hash ON link_edges (url_hash)',
+    ]),
+]
+
+def get_version(conn, storage=None):
+    return (storage or SQLiteStorage(None)).get_version(conn)
+
+def migrate(conn, storage=None):
+    # storage is the connection's backend (scripts/storage.py), SQLite if not given
+    storage = storage or SQLiteStorage(None)
+    version = get_version(conn, storage)
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        with storage.transaction(conn):
+            for statement in statements:
+                conn.execute(storage.schema(statement))
+            storage.set_version(conn, target)
+        logging.info(f"Migrated database to version {target}: {description}")
+        version = target
+    return version
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='Database path or storage URL.')
+    args = parser.parse_args()
+
+    storage = open_storage(args.db_path)
+    conn = storage.connect()
+    print(f"Schema version: {migrate(conn, storage)}")
+    conn.close()
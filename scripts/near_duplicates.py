@@ -0,0 +1,151 @@
+import re
+import html as html_entities
+import hashlib
+import logging
+
+# SimHash fingerprints of page text and a banded LSH index over them. Pages
+# whose fingerprints are within max_distance bits of a page already stored
+# are recorded in page_fingerprints with duplicate_of pointing at that page
+# and are not parsed into the other tables or embedded again. Pages without
+# any text have no fingerprint and are never treated as duplicates.
+
+FINGERPRINT_BITS = 64
+MARKUP = re.compile(r'<script.*?</script>|<style.*?</style>|<!--.*?-->|<[^>]+>', re.S | re.I)
+WORDS = re.compile(r'\w+')
+
+def page_text(html):
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    # Entities decoded so &nbsp; and the like do not count as words
+    return html_entities.unescape(MARKUP.sub(' ', html))
+
+def shingles(text, size=4):
+    words = WORDS.findall(text.lower())
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+def simhash(text, size=4):
+    return simhash_shingles(shingles(text, size))
+
+def simhash_shingles(text_shingles):
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in text_shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(FINGERPRINT_BITS) if weights[bit] > 0)
+
+def page_fingerprint(html, size=4):
+    # None for a page without text (script-only, image-only, redirect stubs):
+    # all of those would share fingerprint 0 and look like copies of each other
+    text_shingles = shingles(page_text(html), size)
+    return simhash_shingles(text_shingles) if text_shingles else None
+
+def with_fingerprint(extractor, record):
+    # For use with functools.partial in the parse workers, so the process
+    # writing the results only does the index lookup
+    document = extractor(record)
+    document['simhash'] = page_fingerprint(record['body'])
+    return document
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def to_signed(fingerprint):
+    # SQLite integers are signed 64-bit
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+class NearDuplicateIndex:
+    # Splits each fingerprint into max_distance + 1 bands. Two fingerprints
+    # that differ in at most max_distance bits agree exactly on at least one
+    # band, so only pages sharing a band bucket are compared.
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-FINGERPRINT_BITS // self.bands)
+        self.buckets = {}
+        self.fingerprints = {}
+
+    def band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, fingerprint >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def add(self, key, fingerprint):
+        self.remove(key)
+        self.fingerprints[key] = fingerprint
+        for band_key in self.band_keys(fingerprint):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for band_key in self.band_keys(fingerprint):
+            self.buckets[band_key].discard(key)
+
+    def find(self, fingerprint, exclude=None):
+        # Closest indexed key within max_distance, or None
+        best = None
+        best_distance = self.max_distance + 1
+        seen = set()
+        for band_key in self.band_keys(fingerprint):
+            for key in self.buckets.get(band_key, ()):
+                if key == exclude or key in seen:
+                    continue
+                seen.add(key)
+                distance = hamming(fingerprint, self.fingerprints[key])
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return best
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+class NearDuplicateFilter:
+    # Wraps the index with the page_fingerprints table (scripts/migrations.py)
+    # and counts what skipping the duplicates saved.
+
+    def __init__(self, writer, max_distance=3):
+        self.writer = writer
+        self.index = NearDuplicateIndex(max_distance)
+        self.urls = {}
+        self.stats = {'pages': 0, 'duplicates': 0, 'bytes_saved': 0, 'embedding_calls_saved': 0}
+        rows = writer.execute('SELECT url_hash, url, simhash FROM page_fingerprints WHERE duplicate_of IS NULL AND simhash IS NOT NULL').fetchall()
+        for url_hash, url, value in rows:
+            self.index.add(url_hash, from_signed(value))
+            self.urls[url_hash] = url
+
+    def check(self, url_hash, url, fingerprint, size=0, embedding_calls=0):
+        # fingerprint is page_fingerprint() of the page and size its length in
+        # bytes. Returns the URL this page duplicates, or None if it should be stored.
+        match = None if fingerprint is None else self.index.find(fingerprint, exclude=url_hash)
+        self.stats['pages'] += 1
+        self.writer.add('page_fingerprints', {
+            'url_hash': url_hash,
+            'url': url,
+            'simhash': None if fingerprint is None else to_signed(fingerprint),
+            'duplicate_of': match
+        }, or_replace=True)
+        if fingerprint is None:
+            self.index.remove(url_hash)
+            return None
+        if match is None:
+            self.index.add(url_hash, fingerprint)
+            self.urls[url_hash] = url
+            return None
+
+        self.index.remove(url_hash)
+        self.stats['duplicates'] += 1
+        self.stats['bytes_saved'] += size
+        self.stats['embedding_calls_saved'] += embedding_calls
+        logging.info(f"Near-duplicate: {url} of {self.urls[match]}")
+        return self.urls[match]
+
+    def report(self):
+        logging.info(f"Near-duplicates: {self.stats}")
+        return dict(self.stats)
@@ -2,12 +2,24 @@
 
 import os
 import json
-import sqlite3
 import logging
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import hashlib
+from urllib.parse import urljoin
 from general_utilities.embedder import TextEmbedder
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from response_scraper.response_scraper.canonical import canonicalize_url
+from response_scraper.response_scraper.metrics import PROFILERS, counter, histogram, exporting, profile_stage
+from scripts.lxml_extraction import extract_page
+from scripts.bulk_writer import BulkWriter
+from scripts.embedding_service import EmbeddingService, EmbeddingPipeline
+from scripts.vector_index import encode_embedding
+from scripts.near_duplicates import NearDuplicateFilter, page_fingerprint
+from scripts.migrations import migrate
+from scripts.ingest_ledger import IngestLedger, clear_page
+from scripts.queries import hash_url
+
+# Shared with process_html_files through the metrics registry
+PARSE_SECONDS = histogram('parse_document_seconds', 'Time to extract one archived response, measured in the parse worker')
+DOCUMENTS = counter('ingest_documents_total', 'Archived responses ingested, by outcome')
 
 # Ensure the logs directory exists
 if not os.path.exists('logs'):
@@ -71,128 +83,204 @@ class ParseObject:
             forms.append(form_data)
         return forms
 
-def hash_url(url):
-    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+def embedding_texts(data):
+    # Texts in the order split_embeddings expects: forms, soup, links
+    texts = [json.dumps(form) for form in data['forms']]
+    texts.append(data['soup'])
+    texts.extend(f"{link['url']} {link['text']}" for link in data['links'])
+    return texts
+
+def split_embeddings(data, vectors):
+    form_count = len(data['forms'])
+    return {
+        'forms': vectors[:form_count],
+        'soup': vectors[form_count],
+        'links': vectors[form_count + 1:]
+    }
 
-def store_data(data, db_path='web_scraping/database/web_scraping.db'):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def store_data(data, db_path='web_scraping/database/web_scraping.db', writer=None, embeddings=None):
+    if embeddings is None:
+        # Embed everything before writing so a failed model call leaves no partial rows
+        embeddings = {
+            'forms': [TextEmbedder.embed_form(json.dumps(form)) for form in data['forms']],
+            'soup': TextEmbedder.embed_soup(data['soup']),
+            'links': [TextEmbedder.embed_link(link['url'], [link['text']]) for link in data['links']]
+        }
+    form_embeddings = embeddings['forms']
+    soup_embedding = embeddings['soup']
+    link_embeddings = embeddings['links']
 
-    # Embed and store images
+    own_writer = writer is None
+    if own_writer:
+        writer = BulkWriter(db_path)
+
+    # Store images
     for image in data['images']:
-        cursor.execute('''
-            INSERT INTO images (url, src)
-            VALUES (?, ?)
-        ''', (data['website_url'], image))
-
-    # Embed and store forms
-    for form in data['forms']:
-        form_text = json.dumps(form)
-        form_embedding = TextEmbedder.embed_form(form_text)
-        cursor.execute('''
-            INSERT INTO forms (url, action, method, embedding)
-            VALUES (?, ?, ?, ?)
-        ''', (data['website_url'], form['action'], form['method'], json.dumps(form_embedding.tolist())))
-        form_id = cursor.lastrowid
+        writer.add('images', {'url': data['website_url'], 'src': image, 'url_hash': data.get('url_hash')}, or_ignore=True)
+
+    # Store forms
+    for form, form_embedding in zip(data['forms'], form_embeddings):
+        form_id = writer.next_id('forms')
+        writer.add('forms', {
+            'id': form_id,
+            'url': data['website_url'],
+            'action': form['action'],
+            'method': form['method'],
+            'embedding': encode_embedding(form_embedding),
+            'url_hash': data.get('url_hash')
+        })
 
         for field in form['fields']:
-            cursor.execute('''
-                INSERT INTO form_fields (form_id, name, type, value)
-                VALUES (?, ?, ?, ?)
-            ''', (form_id, field['name'], field['type'], field['value']))
-
-    # Embed and store soup
-    soup_embedding = TextEmbedder.embed_soup(data['soup'])
-    cursor.execute('''
-        INSERT OR IGNORE INTO soups (url, content, embedding)
-        VALUES (?, ?, ?)
-    ''', (data['website_url'], data['soup'], json.dumps(soup_embedding.tolist())))
-
-    # Embed and store links
-    for link in data['links']:
-        link_hash = hash_url(link['url'])
-        link_embedding = TextEmbedder.embed_link(link['url'], [link['text']])
-        cursor.execute('''
-            INSERT OR IGNORE INTO links (id, url, names, linked_to, linked_from, embedding)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (link_hash, link['url'], json.dumps([link['text']]), json.dumps([]), json.dumps([data['website_url']]), json.dumps(link_embedding.tolist())))
-
-        # Update existing links
-        cursor.execute('SELECT * FROM links WHERE id = ?', (link_hash,))
-        row = cursor.fetchone()
-        if row:
-            existing_names = json.loads(row[2])
-            if link['text'] not in existing_names:
-                existing_names.append(link['text'])
-            existing_linked_from = json.loads(row[4])
-            if data['website_url'] not in existing_linked_from:
-                existing_linked_from.append(data['website_url'])
-            cursor.execute('''
-                UPDATE links
-                SET names = ?, linked_from = ?
-                WHERE id = ?
-            ''', (json.dumps(existing_names), json.dumps(existing_linked_from), link_hash))
-
-    conn.commit()
-    conn.close()
-
-def parse_html_file(file_path, output_dir):
+            writer.add('form_fields', {
+                'form_id': form_id,
+                'name': field['name'],
+                'type': field['type'],
+                'value': field.get('value')
+            })
+
+    # Store soup
+    writer.add('soups', {
+        'url': data['website_url'],
+        'content': data['soup'],
+        'embedding': encode_embedding(soup_embedding),
+        'url_hash': data.get('url_hash')
+    }, or_ignore=True)
+
+    # Store links; names and referrers live in link_edges rather than JSON lists.
+    # Every URL goes in under its canonical spelling so variants share one id.
+    page_url = canonicalize_url(data['website_url'])
+    page_id = hash_url(page_url)
+    writer.add('link_urls', {'id': page_id, 'url': page_url}, or_ignore=True)
+    for link, link_embedding in zip(data['links'], link_embeddings):
+        link_url = canonicalize_url(link['url'])
+        link_hash = hash_url(link_url)
+        writer.add('links', {
+            'id': link_hash,
+            'url': link_url,
+            'names': json.dumps([link['text']]),
+            'linked_to': json.dumps([]),
+            'linked_from': json.dumps([page_url]),
+            'embedding': encode_embedding(link_embedding),
+            'url_hash': data.get('url_hash')
+        }, or_ignore=True)
+        writer.add('link_urls', {'id': link_hash, 'url': link_url}, or_ignore=True)
+        writer.add('link_edges', {'from_url_id': page_id, 'to_url_id': link_hash, 'anchor_text': link['text'], 'url_hash': data.get('url_hash')}, or_ignore=True)
+
+    if own_writer:
+        writer.close()
+    else:
+        writer.checkpoint()
+
+def parse_response(record):
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-
-        soup = BeautifulSoup(html_content, 'html.parser')
-        base_url = soup.find('meta', attrs={'property': 'og:url'})['content'] if soup.find('meta', attrs={'property': 'og:url'}) else 'unknown'
-
-        parser = ParseObject()
-        images = parser.get_html_images(soup, base_url)
-        forms = parser.get_html_forms(soup)
-        links = parser.get_html_links(soup, base_url)
-
-        data = {
-            'website_url': base_url,
-            'images': images,
-            'forms': forms,
-            'links': links,
-            'soup': soup.prettify()
+        # Single lxml pass instead of one find_all walk per element type
+        # The archive record carries the fetched URL; <base href> is applied inside
+        page = extract_page(record['body'], page_url=record['url'], encoding=record['encoding'] or 'utf-8')
+
+        return {
+            'url_hash': record['url_hash'],
+            'website_url': page['page_url'],
+            'images': page['images'],
+            'forms': page['forms'],
+            'links': page['links'],
+            'soup': page['content']
         }
+    except Exception as e:
+        logging.error(f'Error parsing {record["url"]}: {e}')
+        return None
 
-        store_data(data)
+def store_embedded(completed, ledger, writer):
+    for (record, data), vectors in completed:
+        savepoint = writer.savepoint()
+        try:
+            # Replaces rows from an earlier attempt at this page in the same transaction
+            clear_page(writer, record['url_hash'])
+            store_data(data, writer=writer, embeddings=split_embeddings(data, vectors))
+            ledger.commit(writer, record['url_hash'], record['content_hash'])
+            DOCUMENTS.inc(outcome='stored')
 
-        logging.info(f'Successfully parsed and saved: {file_path}')
+            logging.info(f'Successfully parsed and stored: {record["url"]}')
+        except Exception as e:
+            # None of the page's rows are written; the ledger says failed
+            writer.rollback_to(savepoint)
+            logging.error(f'Error storing {record["url"]}: {e}')
+            ledger.fail(record['url_hash'], e)
+            DOCUMENTS.inc(outcome='failed')
 
-        # Delete the original file after successful parsing and saving
-        os.remove(file_path)
-        logging.info(f'Successfully deleted: {file_path}')
-    except Exception as e:
-        logging.error(f'Error parsing {file_path}: {e}')
+def parse_html_files(archive_dir='output/archive', url=None, db_path='web_scraping/database/web_scraping.db', transaction_size=5000, embedding_batch_size=256, near_duplicate_distance=3,
+                     claim_size=100, worker_id=None, retry_failed=False):
+    archive = ResponseArchive(archive_dir)
+    writer = BulkWriter(db_path, transaction_size=transaction_size)
+    service = EmbeddingService(batch_size=embedding_batch_size)
+    pipeline = EmbeddingPipeline(service)
+    migrate(writer.conn, writer.storage)
+    ledger = IngestLedger(db_path, archive, worker_id=worker_id)
+    # None keeps every page, however similar
+    duplicates = NearDuplicateFilter(writer, near_duplicate_distance) if near_duplicate_distance is not None else None
 
-def parse_html_files(input_dir='output/responses', output_dir='web_scraping/staging', file_name=None):
-    # Ensure the staging directory exists
-    os.makedirs(output_dir, exist_ok=True)
+    if url:
+        # Parse a single response
+        record = archive.get_url(url)
+        records = [record] if record else []
+        if not record:
+            logging.error(f"Response for {url} does not exist in {archive_dir}.")
+    else:
+        # Parse responses not yet processed, claimed through the ledger so
+        # several of these processes can share the archive
+        if retry_failed:
+            ledger.retry_failed()
+        ledger.sync()
+        records = ledger.iter_claimed(claim_size)
 
-    if file_name:
-        # Parse a single file
-        file_path = os.path.join(input_dir, file_name)
-        if os.path.exists(file_path):
-            parse_html_file(file_path, output_dir)
+    # Parsing keeps going while the embedding thread works through earlier pages
+    for record in records:
+        with PARSE_SECONDS.time(parser='lxml'):
+            data = parse_response(record)
+        if not data:
+            ledger.fail(record['url_hash'], 'parse failed')
+            DOCUMENTS.inc(outcome='failed')
         else:
-            logging.error(f"File {file_path} does not exist.")
-    else:
-        # Parse all files
-        for filename in os.listdir(input_dir):
-            if filename.endswith('.html'):
-                file_path = os.path.join(input_dir, filename)
-                parse_html_file(file_path, output_dir)
+            ledger.mark_parsed(record['url_hash'])
+            texts = embedding_texts(data)
+            if duplicates is not None and duplicates.check(record['url_hash'], record['url'], page_fingerprint(record['body']), len(record['body']), len(texts)):
+                DOCUMENTS.inc(outcome='near_duplicate')
+                clear_page(writer, record['url_hash'])
+                ledger.commit(writer, record['url_hash'], record['content_hash'])
+                writer.checkpoint()
+            else:
+                pipeline.submit((record, data), texts)
+        store_embedded(pipeline.completed(), ledger, writer)
+    store_embedded(pipeline.close(), ledger, writer)
+
+    writer.close()
+    writer.report()
+    ledger.close()
+    logging.info(f"Embedding stats: {service.stats}")
+    if duplicates is not None:
+        stats = duplicates.report()
+        print(f"Near-duplicates skipped: {stats['duplicates']} of {stats['pages']} pages, "
+              f"{stats['bytes_saved']} bytes and {stats['embedding_calls_saved']} embedding calls saved")
+    archive.close()
 
 if __name__ == "__main__":
     import argparse
 
-    parser = argparse.ArgumentParser(description='Parse HTML files.')
-    parser.add_argument('--file', type=str, help='Specific HTML file to parse.')
+    parser = argparse.ArgumentParser(description='Parse archived HTML responses.')
+    parser.add_argument('--url', type=str, help='Specific URL to parse.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='Database path or storage URL (sqlite:///..., duckdb:///...).')
+    parser.add_argument('--near-duplicate-distance', type=int, default=3, help='Maximum SimHash bit distance for a page to count as a near-duplicate.')
+    parser.add_argument('--keep-near-duplicates', action='store_true', help='Parse and embed near-duplicate pages as well.')
+    parser.add_argument('--claim-size', type=int, default=100, help='Responses claimed from the ingestion ledger at a time.')
+    parser.add_argument('--worker-id', type=str, help='Name recorded on claims (default host-pid).')
+    parser.add_argument('--retry-failed', action='store_true', help='Queue responses that failed before for another attempt.')
+    parser.add_argument('--metrics-file', type=str, help='Write Prometheus metrics to this file during and after the run.')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this local port while running.')
+    parser.add_argument('--profiler', choices=PROFILERS, help='Profile the run into output/profiles.')
     args = parser.parse_args()
 
-    if args.file:
-        parse_html_files(file_name=args.file)
-    else:
-        parse_html_files()
+    distance = None if args.keep_near_duplicates else args.near_duplicate_distance
+    with exporting(args.metrics_file, args.metrics_port), profile_stage('parse_and_store', args.profiler):
+        if args.url:
+            parse_html_files(url=args.url, db_path=args.db_path, near_duplicate_distance=distance)
+        else:
+            parse_html_files(db_path=args.db_path, near_duplicate_distance=distance, claim_size=args.claim_size, worker_id=args.worker_id, retry_failed=args.retry_failed)
@@ -1,133 +1,178 @@
 import os
-import sqlite3
-from bs4 import BeautifulSoup
-import hashlib
-import json
+import logging
 import subprocess
-
-def setup_databases():
+from functools import partial
+from itertools import islice
+from response_scraper.response_scraper.metrics import PROFILERS, counter, histogram, exporting, profile_stage
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from scripts import html_extraction, lxml_extraction
+from scripts.bulk_writer import BulkWriter
+from scripts.html_extraction import iter_extracted, extract_or_error
+from scripts.ingest_ledger import IngestLedger, clear_page
+from scripts.near_duplicates import NearDuplicateFilter, with_fingerprint
+
+PARSE_SECONDS = histogram('parse_document_seconds', 'Time to extract one archived response, measured in the parse worker')
+DOCUMENTS = counter('ingest_documents_total', 'Archived responses ingested, by outcome')
+
+EXTRACTORS = {
+    'lxml': lxml_extraction.extract_document,
+    'bs4': html_extraction.extract_document
+}
+
+# Parts each extraction profile reads, and the per-page tables it rewrites.
+# full is the ingestion pass and goes through the ledger; the others refresh
+# their tables from every archived response, leave the ledger alone, and
+# read pages with lxml_extraction.PageScanner instead of building a DOM.
+PROFILES = {
+    'full': None,
+    'links-only': {'parts': {'links'}, 'tables': []},
+    'forms-only': {'parts': {'forms'}, 'tables': ['form_fields', 'forms']},
+}
+
+def setup_databases(db_path='web_scraping/database/web_scraping.db'):
     # Run the setup_sql_database.py script
-    subprocess.run(['python', 'scripts/setup_sql_database.py'], check=True)
-
-def process_html_files(input_dir='output/responses', db_path='web_scraping/database/web_scraping.db',batch_size=None):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    if not batch_size:
-        batch_size = len([f for f in os.listdir(input_dir) if f.endswith('.html')])
-    files = [f for f in os.listdir(input_dir) if f.endswith('.html')]
-    batch_files = files[:batch_size]
-
-    for filename in batch_files:
-        file_path = os.path.join(input_dir, filename)
-        print(f"Processing file: {file_path}")  # Logging
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-            soup = BeautifulSoup(content, 'html.parser')
-
-            # Extract the original URL from the file content (assuming it's stored in a <h1> tag)
-            original_url_tag = soup.find('h1')
-            if original_url_tag:
-                original_url = original_url_tag.get_text(strip=True)
-            else:
-                # If not found, construct it based on the filename
-                url_hash = filename.split('.')[0]
-                domain, _ = filename.split('-', 1)
-                original_url = f'https://{domain}.com/{url_hash}'
-
-            # Compute URL hash
-            url_hash = hashlib.md5(original_url.encode()).hexdigest()
-
-            # Extract headers
-            headers = [header.get_text() for header in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
-
-            # Save soup content with headers
-            soup_data = {
-                'url': original_url,
-                'headers': json.dumps(headers),
-                'content': str(soup),
-                'embedding': '',
-                'url_hash': url_hash
-            }
-            print(f"Inserting into soups table: {soup_data}")  # Logging
-            cursor.execute('''
-            INSERT OR IGNORE INTO soups (url, headers, content, embedding, url_hash)
-            VALUES (:url, :headers, :content, :embedding, :url_hash)
-            ''', soup_data)
-
-            # Save images
-            for img in soup.find_all('img'):
-                img_data = {
-                    'url': original_url,
-                    'src': img.get('src'),
-                    'url_hash': url_hash
-                }
-                cursor.execute('''
-                INSERT OR IGNORE INTO images (url, src, url_hash)
-                VALUES (:url, :src, :url_hash)
-                ''', img_data)
-
-            # Save forms and form fields
-            for form in soup.find_all('form'):
-                form_data = {
-                    'url': original_url,
-                    'action': form.get('action'),
-                    'method': form.get('method'),
-                    'embedding': '',
-                    'url_hash': url_hash
-                }
-                cursor.execute('''
-                INSERT INTO forms (url, action, method, embedding, url_hash)
-                VALUES (:url, :action, :method, :embedding, :url_hash)
-                ''', form_data)
-                form_id = cursor.lastrowid
-
-                for field in form.find_all(['input', 'select', 'textarea']):
-                    field_data = {
-                        'form_id': form_id,
-                        'name': field.get('name'),
-                        'type': field.get('type'),
-                        'value': field.get('value')
-                    }
-                    cursor.execute('''
-                    INSERT INTO form_fields (form_id, name, type, value)
-                    VALUES (:form_id, :name, :type, :value)
-                    ''', field_data)
-
-            # Save links
-            for link in soup.find_all('a', href=True):
-                link_data = {
-                    'id': hashlib.md5(link['href'].encode()).hexdigest(),
-                    'url': original_url,
-                    'names': link.get_text(),
-                    'linked_to': link['href'],
-                    'linked_from': original_url,
-                    'url_hash': url_hash
-                }
-                cursor.execute('''
-                INSERT OR IGNORE INTO links (id, url, names, linked_to, linked_from, embedding, url_hash)
-                VALUES (:id, :url, :names, :linked_to, :linked_from, '', :url_hash)
-                ''', link_data)
-
-            # Save tables
-            for table in soup.find_all('table'):
-                table_data = {
-                    'url': original_url,
-                    'table_html': str(table),
-                    'url_hash': url_hash
-                }
-                cursor.execute('''
-                INSERT INTO tables (url, table_html, url_hash)
-                VALUES (:url, :table_html, :url_hash)
-                ''', table_data)
-
-        conn.commit()  # Ensure the insertion is saved after processing each file
-
-        # Delete the file after processing
-        os.remove(file_path)
-        print(f"Deleted file: {file_path}")  # Logging
-
-    conn.close()
+    subprocess.run(['python', '-m', 'scripts.setup_sql_database', '--db-path', db_path], check=True)
+
+def store_document(writer, document):
+    # Save soup content with headers (not read by partial profiles)
+    if document['soup'] is not None:
+        writer.add('soups', document['soup'], or_ignore=True)
+
+    # Save images
+    for img_data in document['images']:
+        writer.add('images', img_data, or_ignore=True)
+
+    # Save forms and form fields
+    for form in document['forms']:
+        form_id = writer.next_id('forms')
+        writer.add('forms', dict(form['form'], id=form_id))
+
+        for field_data in form['fields']:
+            writer.add('form_fields', dict(field_data, form_id=form_id))
+
+    # Save links
+    for link_data in document['links']:
+        writer.add('links', dict(link_data, embedding=''), or_ignore=True)
+
+    # Save tables
+    for table_data in document['tables']:
+        writer.add('tables', table_data)
+
+def process_html_files(archive_dir='output/archive', db_path='web_scraping/database/web_scraping.db', batch_size=None, workers=1, queue_size=None, parser='lxml', transaction_size=5000, near_duplicate_distance=3,
+                       claim_size=100, worker_id=None, retry_failed=False, profile='full'):
+    if PROFILES[profile] is not None:
+        return refresh_profile(archive_dir, db_path, profile, batch_size=batch_size, workers=workers, queue_size=queue_size, transaction_size=transaction_size)
+
+    writer = BulkWriter(db_path, transaction_size=transaction_size)
+    archive = ResponseArchive(archive_dir)
+    duplicates = NearDuplicateFilter(writer, near_duplicate_distance) if near_duplicate_distance is not None else None
+
+    # Several of these processes can run against one archive; each claims
+    # its own responses from the ledger
+    ledger = IngestLedger(db_path, archive, worker_id=worker_id)
+    if retry_failed:
+        ledger.retry_failed()
+    ledger.sync()
+
+    # Parsing fans out to the worker pool; this process writes its own claims
+    records = islice(ledger.iter_claimed(claim_size), batch_size)
+    extractor = EXTRACTORS[parser]
+    if duplicates is not None:
+        # Fingerprinted in the parse workers; only the index lookup happens here
+        extractor = partial(with_fingerprint, extractor)
+    extractor = partial(extract_or_error, extractor)
+    pages = failed = 0
+    for document in iter_extracted(records, extractor=extractor, workers=workers, queue_size=queue_size):
+        if 'error' in document:
+            ledger.fail(document['record_hash'], document['error'])
+            DOCUMENTS.inc(outcome='failed')
+            failed += 1
+            continue
+        ledger.mark_parsed(document['record_hash'])
+        PARSE_SECONDS.observe(document['parse_seconds'], parser=parser)
+        logging.debug(f"Processing response: {document['url']}")
+
+        # Rows left by an earlier attempt at this page go in the same transaction
+        clear_page(writer, document['record_hash'])
+        if duplicates is None or not duplicates.check(document['record_hash'], document['url'], document['simhash'], len(document['soup']['content'])):
+            store_document(writer, document)
+            DOCUMENTS.inc(outcome='stored')
+        else:
+            DOCUMENTS.inc(outcome='near_duplicate')
+        # Committed with the rows; the archive entry is marked processed after that
+        ledger.commit(writer, document['record_hash'])
+        writer.checkpoint()
+        pages += 1
+
+    writer.close()
+    ledger.release()
+    print(f"Ingestion ledger: {ledger.counts()}")
+    ledger.close()
+    tables = writer.report()
+    for table, stats in tables.items():
+        print(f"{table}: {stats['rows']} rows, {stats['rows_per_sec']:.0f} rows/s")
+    duplicate_stats = None
+    if duplicates is not None:
+        duplicate_stats = duplicates.report()
+        print(f"Near-duplicates skipped: {duplicate_stats['duplicates']} of {duplicate_stats['pages']} pages, {duplicate_stats['bytes_saved']} bytes saved")
+    archive.close()
+    return {'pages': pages, 'failed': failed, 'tables': tables, 'near_duplicates': duplicate_stats}
+
+def refresh_profile(archive_dir, db_path, profile, batch_size=None, workers=1, queue_size=None, transaction_size=5000):
+    # Re-extract one profile's parts from every archived response, e.g. to
+    # rebuild the link graph without re-serializing pages or re-embedding
+    parts, tables = PROFILES[profile]['parts'], PROFILES[profile]['tables']
+    writer = BulkWriter(db_path, transaction_size=transaction_size)
+    archive = ResponseArchive(archive_dir)
+
+    records = islice(archive.iter_responses(), batch_size)
+    extractor = partial(extract_or_error, partial(lxml_extraction.scan_document, parts=parts))
+    pages = failed = 0
+    for document in iter_extracted(records, extractor=extractor, workers=workers, queue_size=queue_size):
+        if 'error' in document:
+            failed += 1
+            DOCUMENTS.inc(outcome='failed')
+            print(f"Extraction failed for {document['record_hash']}: {document['error']}")
+            continue
+        PARSE_SECONDS.observe(document['parse_seconds'], parser=profile)
+        if tables:
+            clear_page(writer, document['record_hash'], tables)
+        store_document(writer, document)
+        DOCUMENTS.inc(outcome='stored')
+        writer.checkpoint()
+        pages += 1
+
+    writer.close()
+    print(f"Profile {profile}: {pages} pages, {failed} failed")
+    tables = writer.report()
+    for table, stats in tables.items():
+        print(f"{table}: {stats['rows']} rows, {stats['rows_per_sec']:.0f} rows/s")
+    archive.close()
+    return {'pages': pages, 'failed': failed, 'tables': tables, 'near_duplicates': None}
 
 if __name__ == "__main__":
-    setup_databases()
-    process_html_files()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extract archived responses into the web scraping database.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='Database path or storage URL (sqlite:///..., duckdb:///...).')
+    parser.add_argument('--profile', choices=list(PROFILES), default='full', help='What to extract: full ingestion, or only links or forms from every archived response.')
+    parser.add_argument('--batch-size', type=int, help='Maximum number of responses to process.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of parser processes.')
+    parser.add_argument('--queue-size', type=int, help='Maximum parsed documents waiting for the writer.')
+    parser.add_argument('--parser', choices=sorted(EXTRACTORS), default='lxml', help='Extraction backend.')
+    parser.add_argument('--transaction-size', type=int, default=5000, help='Rows written per transaction.')
+    parser.add_argument('--near-duplicate-distance', type=int, default=3, help='Maximum SimHash bit distance for a page to count as a near-duplicate.')
+    parser.add_argument('--keep-near-duplicates', action='store_true', help='Store near-duplicate pages as well.')
+    parser.add_argument('--claim-size', type=int, default=100, help='Responses claimed from the ingestion ledger at a time.')
+    parser.add_argument('--worker-id', type=str, help='Name recorded on claims (default host-pid).')
+    parser.add_argument('--retry-failed', action='store_true', help='Queue responses that failed before for another attempt.')
+    parser.add_argument('--metrics-file', type=str, help='Write Prometheus metrics to this file during and after the run (e.g. for the node_exporter textfile collector).')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this local port while running.')
+    parser.add_argument('--profiler', choices=PROFILERS, help='Profile the run into output/profiles (parse workers are only included with --workers 1).')
+    args = parser.parse_args()
+
+    setup_databases(args.db_path)
+    with exporting(args.metrics_file, args.metrics_port), profile_stage(f'process_html_files-{args.profile}', args.profiler):
+        process_html_files(db_path=args.db_path, batch_size=args.batch_size, workers=args.workers, queue_size=args.queue_size, parser=args.parser, transaction_size=args.transaction_size,
+                           near_duplicate_distance=None if args.keep_near_duplicates else args.near_duplicate_distance,
+                           claim_size=args.claim_size, worker_id=args.worker_id, retry_failed=args.retry_failed, profile=args.profile)
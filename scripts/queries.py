@@ -0,0 +1,115 @@
+import time
+import sqlite3
+import hashlib
+import statistics
+from response_scraper.response_scraper.canonical import canonicalize_url
+
+# Common lookups against web_scraping.db. Each one is served by an index
+# added in scripts/migrations.py; none of them read soups.content.
+
+def get_assets_for_url(conn, url):
+    soup = conn.execute('SELECT id, url, headers, url_hash FROM soups WHERE url = ?', (url,)).fetchone()
+    images = conn.execute('SELECT src FROM images WHERE url = ?', (url,)).fetchall()
+    forms = conn.execute('SELECT id, action, method FROM forms WHERE url = ?', (url,)).fetchall()
+    links = conn.execute('SELECT id, names, linked_to FROM links WHERE url = ?', (url,)).fetchall()
+    tables = conn.execute('SELECT id, table_html FROM tables WHERE url = ?', (url,)).fetchall()
+    return {
+        'soup': {'id': soup[0], 'url': soup[1], 'headers': soup[2], 'url_hash': soup[3]} if soup else None,
+        'images': [row[0] for row in images],
+        'forms': [{'id': row[0], 'action': row[1], 'method': row[2], 'fields': get_form_fields(conn, row[0])} for row in forms],
+        'links': [{'id': row[0], 'names': row[1], 'linked_to': row[2]} for row in links],
+        'tables': [{'id': row[0], 'table_html': row[1]} for row in tables]
+    }
+
+def get_form_fields(conn, form_id):
+    rows = conn.execute('SELECT name, type, value FROM form_fields WHERE form_id = ?', (form_id,)).fetchall()
+    return [{'name': row[0], 'type': row[1], 'value': row[2]} for row in rows]
+
+def get_forms_with_field(conn, field_name):
+    rows = conn.execute('''
+    SELECT DISTINCT f.id, f.url, f.action, f.method
+    FROM form_fields ff JOIN forms f ON f.id = ff.form_id
+    WHERE ff.name = ?
+    ''', (field_name,)).fetchall()
+    return [{'id': row[0], 'url': row[1], 'action': row[2], 'method': row[3]} for row in rows]
+
+def get_pages_linking_to(conn, href):
+    # parse_and_store keeps the link graph in link_edges; pages ingested by
+    # process_html_files have one links row per link instead
+    pages = get_linked_from(conn, href)
+    rows = conn.execute('SELECT DISTINCT url FROM links WHERE linked_to = ?', (href,)).fetchall()
+    return pages + [row[0] for row in rows if row[0] not in pages]
+
+# The link graph written by parse_and_store: link_urls holds every URL under
+# its canonical spelling, keyed by hash_url, and link_edges one row per
+# (page, link, anchor text)
+
+def hash_url(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+def get_link_names(conn, url):
+    rows = conn.execute('''
+        SELECT anchor_text FROM link_edges WHERE to_url_id = ?
+        GROUP BY anchor_text ORDER BY MIN(rowid)
+    ''', (hash_url(canonicalize_url(url)),)).fetchall()
+    return [row[0] for row in rows]
+
+def get_linked_from(conn, url):
+    rows = conn.execute('''
+        SELECT u.url FROM link_edges e JOIN link_urls u ON u.id = e.from_url_id
+        WHERE e.to_url_id = ? GROUP BY e.from_url_id, u.url ORDER BY MIN(e.rowid)
+    ''', (hash_url(canonicalize_url(url)),)).fetchall()
+    return [row[0] for row in rows]
+
+def get_links_to(conn, url):
+    rows = conn.execute('''
+        SELECT u.url FROM link_edges e JOIN link_urls u ON u.id = e.to_url_id
+        WHERE e.from_url_id = ? GROUP BY e.to_url_id, u.url ORDER BY MIN(e.rowid)
+    ''', (hash_url(canonicalize_url(url)),)).fetchall()
+    return [row[0] for row in rows]
+
+def get_urls_for_hash(conn, url_hash):
+    rows = conn.execute('SELECT url FROM soups WHERE url_hash = ?', (url_hash,)).fetchall()
+    return [row[0] for row in rows]
+
+def measure(func, *args, repeat=20):
+    # Median and worst wall time of a query in milliseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(timings), 'max_ms': max(timings)}
+
+def explain(conn, sql, params=()):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure latency of the common web_scraping.db lookups.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='SQLite database path.')
+    parser.add_argument('--url', type=str, help='Page URL to look up; defaults to the first soup.')
+    parser.add_argument('--field', type=str, default='q', help='Form field name to look up.')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    url = args.url
+    if not url:
+        row = conn.execute('SELECT url FROM soups LIMIT 1').fetchone()
+        url = row[0] if row else ''
+
+    checks = [
+        ('assets for url', get_assets_for_url, (conn, url)),
+        ('forms with field', get_forms_with_field, (conn, args.field)),
+        ('pages linking to', get_pages_linking_to, (conn, url)),
+    ]
+    for name, func, func_args in checks:
+        result = measure(func, *func_args, repeat=args.repeat)
+        print(f"{name:>18}: median {result['median_ms']:.3f} ms, max {result['max_ms']:.3f} ms")
+
+    print("Plan for forms with field:")
+    for step in explain(conn, 'SELECT f.id FROM form_fields ff JOIN forms f ON f.id = ff.form_id WHERE ff.name = ?', (args.field,)):
+        print(f"  {step}")
+    conn.close()
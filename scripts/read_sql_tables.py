@@ -1,26 +1,129 @@
-import sqlite3
+import os
 import pandas as pd
+from scripts.storage import open_storage
+
+# Columns holding whole pages or vectors; only read when asked for by name
+HEAVY_COLUMNS = {'content', 'embedding'}
+
+EXPORT_FORMATS = ('parquet', 'arrow')
 
 def connect_to_db(db_path='web_scraping/database/web_scraping.db'):
-    return sqlite3.connect(db_path)
+    # db_path may be a storage URL (scripts/storage.py)
+    return open_storage(db_path).connect()
+
+def table_columns(conn, table_name):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+    if not columns:
+        raise ValueError(f"Unknown table: {table_name}")
+    return columns
+
+def build_query(conn, table_name, columns=None, url=None, url_hash=None):
+    available = table_columns(conn, table_name)
+    if columns is None:
+        columns = [column for column in available if column not in HEAVY_COLUMNS]
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ValueError(f"Unknown columns for {table_name}: {unknown}")
+
+    conditions = []
+    params = []
+    if url is not None:
+        conditions.append('url = ?')
+        params.append(url)
+    if url_hash is not None:
+        conditions.append('url_hash = ?')
+        params.append(url_hash)
+
+    query = f"SELECT {', '.join(columns)} FROM {table_name}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    return query, params
+
+def iter_table(conn, table_name, columns=None, url=None, url_hash=None, chunk_size=10000):
+    # Yields DataFrames of at most chunk_size rows. content and embedding are
+    # left out unless listed in columns, and url/url_hash filters run in SQL.
+    # Rows are fetched through a cursor so any DB-API connection works, not
+    # only the sqlite3 ones pandas.read_sql accepts.
+    query, params = build_query(conn, table_name, columns, url, url_hash)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    names = [description[0] for description in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield pd.DataFrame.from_records(rows, columns=names)
+
+def read_table(conn, table_name, columns=None, url=None, url_hash=None):
+    chunks = list(iter_table(conn, table_name, columns, url, url_hash))
+    if not chunks:
+        query, params = build_query(conn, table_name, columns, url, url_hash)
+        cursor = conn.cursor()
+        cursor.execute(query + " LIMIT 0", params)
+        return pd.DataFrame(columns=[description[0] for description in cursor.description])
+    return pd.concat(chunks, ignore_index=True)
+
+def export_table(conn, table_name, path, file_format='parquet', columns=None, url=None, url_hash=None, chunk_size=10000):
+    # Stream a table to Parquet or an Arrow IPC file one chunk at a time
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {file_format}")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Exporting tables requires pyarrow: pip install pyarrow")
+
+    export_dir = os.path.dirname(path)
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in iter_table(conn, table_name, columns, url, url_hash, chunk_size):
+            batch = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                # A column that is all NULL in the first chunk is typed as text
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in batch.schema])
+                if file_format == 'parquet':
+                    writer = pq.ParquetWriter(path, schema)
+                else:
+                    writer = pa.ipc.new_file(path, schema)
+            writer.write_table(batch.cast(schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
 
-def read_table(conn, table_name):
-    query = f"SELECT * FROM {table_name}"
-    df = pd.read_sql_query(query, conn)
-    return df
+if __name__ == "__main__":
+    import argparse
 
-# Connect to the database
-db_path = 'web_scraping/database/web_scraping.db'
-conn = connect_to_db(db_path)
+    parser = argparse.ArgumentParser(description='Read or export web scraping tables without loading them whole.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='Database path or storage URL (sqlite:///..., duckdb:///...).')
+    parser.add_argument('--tables', type=str, default='images,forms,form_fields,soups,links', help='Comma-separated tables to read.')
+    parser.add_argument('--columns', type=str, help='Comma-separated columns to select (may include content/embedding).')
+    parser.add_argument('--url', type=str, help='Only rows for this page URL.')
+    parser.add_argument('--url-hash', type=str, help='Only rows for this url_hash.')
+    parser.add_argument('--export-dir', type=str, help='Write each table to this directory instead of printing.')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='parquet', help='Export format.')
+    args = parser.parse_args()
 
-# Specify the tables you want to read
-tables = ['images', 'forms', 'form_fields', 'soups', 'links']
+    # Connect to the database
+    conn = connect_to_db(args.db_path)
+    columns = args.columns.split(',') if args.columns else None
 
-# Read and display the tables
-for table in tables:
-    df = read_table(conn, table)
-    print(f"Table: {table}")
-    display(df)
+    for table in args.tables.split(','):
+        if args.export_dir:
+            path = os.path.join(args.export_dir, f"{table}.{args.format}")
+            rows = export_table(conn, table, path, args.format, columns, args.url, args.url_hash)
+            print(f"Exported {rows} rows from {table} to {path}")
+        else:
+            # Only the first chunk is shown
+            print(f"Table: {table}")
+            for chunk in iter_table(conn, table, columns, args.url, args.url_hash, chunk_size=20):
+                print(chunk)
+                break
 
-# Close the connection
-conn.close()
+    # Close the connection
+    conn.close()
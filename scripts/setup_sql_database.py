@@ -1,38 +1,43 @@
-import sqlite3
 import os
+from scripts.migrations import migrate
+from scripts.storage import open_storage
 
 def setup_databases(db_path='web_scraping/database/web_scraping.db'):
+    # db_path may be a storage URL; the statements below are written for
+    # SQLite and storage.schema() adapts them to the backend
+    storage = open_storage(db_path)
+
     # Ensure the database directory exists
-    database_dir = os.path.dirname(db_path)
-    if not os.path.exists(database_dir):
+    database_dir = os.path.dirname(storage.path)
+    if database_dir and not os.path.exists(database_dir):
         os.makedirs(database_dir)
 
     # Connect to the database (creates it if it doesn't exist)
-    conn = sqlite3.connect(db_path)
+    conn = storage.connect()
     cursor = conn.cursor()
 
     # Create tables
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS images (
         id INTEGER PRIMARY KEY,
         url TEXT,
         src TEXT,
         url_hash TEXT
     )
-    ''')
+    '''))
 
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS forms (
         id INTEGER PRIMARY KEY,
         url TEXT,
         action TEXT,
         method TEXT,
-        embedding TEXT,
+        embedding BLOB,
         url_hash TEXT
     )
-    ''')
+    '''))
 
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS form_fields (
         id INTEGER PRIMARY KEY,
         form_id INTEGER,
@@ -41,42 +46,72 @@ def setup_databases(db_path='web_scraping/database/web_scraping.db'):
         value TEXT,
         FOREIGN KEY(form_id) REFERENCES forms(id)
     )
-    ''')
+    '''))
 
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS soups (
         id INTEGER PRIMARY KEY,
         url TEXT UNIQUE,
         headers TEXT,
         content TEXT,
-        embedding TEXT,
+        embedding BLOB,
         url_hash TEXT
     )
-    ''')
+    '''))
 
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS links (
         id TEXT PRIMARY KEY,
         url TEXT,
         names TEXT,
         linked_to TEXT,
         linked_from TEXT,
-        embedding TEXT,
+        embedding BLOB,
         url_hash TEXT
     )
-    ''')
+    '''))
+
+    # Link graph: one row per URL and one per (page, link, anchor text)
+    cursor.execute(storage.schema('''
+    CREATE TABLE IF NOT EXISTS link_urls (
+        id TEXT PRIMARY KEY,
+        url TEXT
+    )
+    '''))
+
+    cursor.execute(storage.schema('''
+    CREATE TABLE IF NOT EXISTS link_edges (
+        from_url_id TEXT NOT NULL,
+        to_url_id TEXT NOT NULL,
+        anchor_text TEXT NOT NULL DEFAULT '',
+        UNIQUE (from_url_id, to_url_id, anchor_text)
+    )
+    '''))
+
+    cursor.execute(storage.schema('''
+    CREATE INDEX IF NOT EXISTS idx_link_edges_to ON link_edges (to_url_id)
+    '''))
 
-    cursor.execute('''
+    cursor.execute(storage.schema('''
     CREATE TABLE IF NOT EXISTS tables (
         id INTEGER PRIMARY KEY,
         url TEXT,
         table_html TEXT,
         url_hash TEXT
     )
-    ''')
+    '''))
 
     conn.commit()
+
+    # Indexes and constraints are versioned migrations on top of the base tables
+    migrate(conn, storage)
     conn.close()
 
 if __name__ == "__main__":
-    setup_databases()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Create the web scraping tables and apply migrations.')
+    parser.add_argument('--db-path', type=str, default='web_scraping/database/web_scraping.db', help='Database path or storage URL (sqlite:///..., duckdb:///...).')
+    args = parser.parse_args()
+
+    setup_databases(args.db_path)
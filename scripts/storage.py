@@ -0,0 +1,155 @@
+import re
+import sqlite3
+from contextlib import contextmanager
+
+# Where the web scraping tables live. Scripts keep taking a db_path: a plain
+# path or sqlite:///path is a SQLite database, duckdb:///path (or a path
+# ending in .duckdb) an embedded DuckDB file. As with SQLAlchemy URLs, a
+# fourth slash makes the path absolute.
+#
+# BulkWriter, IngestLedger, LinkDatabase, read_sql_tables and the schema
+# setup run the same SQL on both; these classes cover what differs:
+# connecting, transactions, bulk loads, DDL and the schema version.
+
+class SQLiteStorage:
+    name = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self, timeout=60, autocommit=False):
+        # An autocommit connection only has the transactions opened by transaction()
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None if autocommit else '')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def transaction(self, conn, immediate=False):
+        # immediate takes the write lock before the first read, for
+        # read-then-write steps that several processes run on one file
+        if immediate:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def load(self, conn, table, columns, rows, conflict=''):
+        conn.executemany(f'''
+        INSERT {conflict}INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        ''', rows)
+
+    def rowcount(self, cursor):
+        return cursor.rowcount
+
+    def schema(self, statement):
+        return statement
+
+    def get_version(self, conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def set_version(self, conn, version):
+        conn.execute(f'PRAGMA user_version = {version}')
+
+class DuckDBStorage:
+    # Embedded columnar store. A flush loads each buffered table as one
+    # DataFrame through INSERT ... SELECT, DuckDB's bulk path, instead of
+    # binding rows one at a time. Only one process can open the file for
+    # writing, so parallel ingestion means parse workers (--workers) feeding
+    # a single writer.
+    name = 'duckdb'
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("The DuckDB backend requires duckdb: pip install duckdb")
+        self.duckdb = duckdb
+        self.Error = duckdb.Error
+        self.path = path
+        self.primary_keys = {}
+
+    def connect(self, timeout=60, autocommit=False):
+        # DuckDB has no busy timeout and only opens a transaction when asked to
+        return self.duckdb.connect(self.path)
+
+    @contextmanager
+    def transaction(self, conn, immediate=False):
+        conn.execute('BEGIN TRANSACTION')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def primary_key(self, conn, table):
+        if table not in self.primary_keys:
+            rows = conn.execute(f'PRAGMA table_info({table})').fetchall()
+            self.primary_keys[table] = [row[1] for row in rows if row[5]]
+        return self.primary_keys[table]
+
+    def load(self, conn, table, columns, rows, conflict=''):
+        import pandas as pd
+
+        # object columns keep None as NULL and ints as ints
+        frame = pd.DataFrame(rows, columns=list(columns), dtype=object)
+        key = self.primary_key(conn, table)
+        if conflict == 'OR REPLACE ' and key and set(key) <= set(columns):
+            # Within one statement DuckDB keeps the first row for a key; SQLite's executemany the last
+            frame = frame.drop_duplicates(subset=key, keep='last')
+        conn.register('bulk_rows', frame)
+        try:
+            conn.execute(f'''
+            INSERT {conflict}INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM bulk_rows
+            ''')
+        finally:
+            conn.unregister('bulk_rows')
+
+    def rowcount(self, cursor):
+        # Data-changing statements return their row count as a result
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def schema(self, statement):
+        # INTEGER PRIMARY KEY is SQLite's rowid alias; here ids come from a
+        # sequence. INTEGER is 64-bit in SQLite and 32-bit in DuckDB. Foreign
+        # keys are dropped, as SQLite never enforced them (foreign_keys is off).
+        statements = []
+        match = re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', statement)
+        if match and 'id INTEGER PRIMARY KEY' in statement:
+            sequence = f'{match.group(1)}_id_seq'
+            statements.append(f'CREATE SEQUENCE IF NOT EXISTS {sequence}')
+            statement = statement.replace('id INTEGER PRIMARY KEY', f"id BIGINT PRIMARY KEY DEFAULT nextval('{sequence}')")
+        statement = re.sub(r'\bINTEGER\b', 'BIGINT', statement)
+        statement = re.sub(r',\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)', '', statement)
+        return ';\n'.join(statements + [statement])
+
+    def get_version(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version BIGINT)')
+        return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+
+    def set_version(self, conn, version):
+        conn.execute('INSERT INTO schema_version VALUES (?)', (version,))
+
+STORAGES = {
+    'sqlite': SQLiteStorage,
+    'duckdb': DuckDBStorage
+}
+
+def open_storage(db_path):
+    # Nothing is opened here; call connect() on the result
+    scheme, separator, path = db_path.partition('://')
+    if not separator:
+        scheme, path = ('duckdb' if db_path.endswith('.duckdb') else 'sqlite'), db_path
+    elif path.startswith('/'):
+        path = path[1:]
+    if scheme not in STORAGES:
+        raise ValueError(f"Unknown storage backend: {scheme} (expected one of {sorted(STORAGES)})")
+    return STORAGES[scheme](path)
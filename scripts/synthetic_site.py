@@ -0,0 +1,218 @@
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Synthetic government-style pages for benchmarks, and a local HTTP server
+# that serves them as several domains. Page n of domain d is the same for a
+# given seed, so two benchmark runs see the same corpus. Densities are
+# roughly those of the crawled .gov sites: a navigation block and body links
+# on every page, a header search form, a contact form on some pages, a few
+# images and the occasional data table.
+
+WORDS = (
+    'application benefits citizenship eligibility form status travel visa passport '
+    'department security agency public health guidance program report office federal '
+    'state resident employment document request review processing service policy '
+    'immigration green card fee filing appointment case online account notice update'
+).split()
+
+NAV_LINKS = 40
+BODY_LINKS = 15
+CROSS_DOMAIN_LINKS = 3
+IMAGES = 6
+PARAGRAPHS = 12
+WORDS_PER_PARAGRAPH = 50
+CONTACT_FORM_SHARE = 0.2
+TABLE_SHARE = 0.25
+
+def page_path(page):
+    return '/' if page == 0 else f'/p{page}'
+
+def generate_page(hosts, domain, page, pages_per_domain, seed=0):
+    # hosts are the scheme://netloc of every domain; links to the page's own
+    # domain are relative, links to the others absolute
+    rng = random.Random(f'{seed}-{domain}-{page}')
+
+    def text(count):
+        return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+    def local_link():
+        path = page_path(rng.randrange(pages_per_domain))
+        # Spellings that canonicalize to the same page, as on real sites
+        variant = rng.random()
+        if variant < 0.05:
+            path += '?utm_source=nav'
+        elif variant < 0.1:
+            path += '#main'
+        return path
+
+    parts = [
+        '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">',
+        f'<title>{text(4).title()} | Site {domain}</title>',
+        '<style>body{font-family:sans-serif}.nav a{margin:0 4px}</style>',
+        '<script>window.analytics=window.analytics||[];analytics.push(["page"]);</script>',
+        '</head><body>',
+        '<form class="search" action="/search" method="get"><input type="text" name="query"><input type="submit" value="Search"></form>',
+        '<nav class="nav">',
+    ]
+    parts.extend(f'<a href="{local_link()}">{text(2)}</a>' for _ in range(NAV_LINKS))
+    parts.append('</nav><main>')
+    parts.append(f'<h1>{text(5).title()}</h1>')
+
+    for index in range(PARAGRAPHS):
+        links = ''
+        if index < BODY_LINKS:
+            links = f' <a href="{local_link()}">{text(3)}</a>'
+        parts.append(f'<p>{text(WORDS_PER_PARAGRAPH)}{links}</p>')
+    parts.extend(f'<p><a href="{local_link()}">{text(3)}</a></p>' for _ in range(max(0, BODY_LINKS - PARAGRAPHS)))
+
+    for _ in range(CROSS_DOMAIN_LINKS):
+        other = rng.randrange(len(hosts))
+        parts.append(f'<a href="{hosts[other]}{page_path(rng.randrange(pages_per_domain))}">{text(2)}</a>')
+    parts.append(f'<a href="/files/{text(1)}-{page}.pdf">{text(2)} (PDF)</a>')
+
+    parts.extend(f'<img src="/images/{text(1)}-{rng.randrange(100)}.png" alt="{text(3)}">' for _ in range(IMAGES))
+
+    if rng.random() < TABLE_SHARE:
+        rows = ''.join('<tr>' + ''.join(f'<td>{text(2)}</td>' for _ in range(4)) + '</tr>' for _ in range(5))
+        parts.append(f'<table><tr><th>Form</th><th>Title</th><th>Fee</th><th>Edition</th></tr>{rows}</table>')
+
+    if rng.random() < CONTACT_FORM_SHARE:
+        parts.append(
+            '<form action="/contact" method="post">'
+            '<input type="text" name="name"><input type="email" name="email">'
+            '<input type="hidden" name="csrf" value="x' + str(rng.randrange(10 ** 6)) + '">'
+            '<select name="topic"><option value="case">Case status</option><option value="fees">Fees</option></select>'
+            '<textarea name="message"></textarea><input type="submit" value="Send"></form>'
+        )
+
+    parts.append(f'</main><footer>{text(20)}</footer></body></html>')
+    return ''.join(parts)
+
+def iter_pages(hosts, pages_per_domain, seed=0):
+    # (url, html) for every page of every domain
+    for domain, host in enumerate(hosts):
+        for page in range(pages_per_domain):
+            yield f'{host}{page_path(page)}', generate_page(hosts, domain, page, pages_per_domain, seed)
+
+def write_corpus(archive, hosts, pages_per_domain, seed=0):
+    count = 0
+    for url, html in iter_pages(hosts, pages_per_domain, seed):
+        archive.add(url, html.encode('utf-8'), headers={'Content-Type': 'text/html; charset=utf-8'}, status=200)
+        count += 1
+    archive.commit()
+    return count
+
+class MockSite:
+    # Serves generate_page() on one port per domain, so each domain is its
+    # own host:port to the crawler. Every response waits latency seconds
+    # plus up to jitter, and a share of requests (rate_429) is answered with
+    # 429 and Retry-After instead of the page.
+
+    def __init__(self, domains=3, pages_per_domain=100, latency=0.05, jitter=0.02, rate_429=0.0, retry_after=1, seed=0, host='127.0.0.1'):
+        self.domains = domains
+        self.pages_per_domain = pages_per_domain
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.seed = seed
+        self.host = host
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.servers = []
+        self.hosts = []
+        self.stats = {'requests': 0, 'bytes': 0, 'statuses': {}}
+
+    def record(self, status, size):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+            self.stats['statuses'][status] = self.stats['statuses'].get(status, 0) + 1
+
+    def handler(self, domain):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with site.lock:
+                    delay = site.latency + site.rng.uniform(0, site.jitter)
+                    throttled = site.rng.random() < site.rate_429
+                time.sleep(delay)
+
+                path = self.path.split('?', 1)[0].split('#', 1)[0]
+                page = 0 if path == '/' else int(path[2:]) if path.startswith('/p') and path[2:].isdigit() else None
+                if throttled:
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(site.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    site.record(429, 0)
+                    return
+                if page is None or page >= site.pages_per_domain:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    site.record(404, 0)
+                    return
+
+                body = generate_page(site.hosts, domain, page, site.pages_per_domain, site.seed).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                site.record(200, len(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        # Ports are picked by the OS; hosts is filled in before any request is served
+        for domain in range(self.domains):
+            server = ThreadingHTTPServer((self.host, 0), self.handler(domain))
+            server.daemon_threads = True
+            self.servers.append(server)
+            self.hosts.append(f'http://{self.host}:{server.server_address[1]}')
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self.hosts
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a synthetic multi-domain site until interrupted.')
+    parser.add_argument('--domains', type=int, default=3, help='Number of domains (one port each).')
+    parser.add_argument('--pages', type=int, default=100, help='Pages per domain.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response.')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Up to this many extra seconds per response.')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of requests answered with 429.')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for pages, latency and 429s.')
+    args = parser.parse_args()
+
+    site = MockSite(args.domains, args.pages, args.latency, args.jitter, args.rate_429, args.retry_after, args.seed)
+    for url in site.start():
+        print(f"Serving {url}/")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        site.stop()
+        print(f"Served: {site.stats}")
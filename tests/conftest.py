@@ -0,0 +1,18 @@
+import pytest
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from scripts.setup_sql_database import setup_databases
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # Tables and migrations as setup_sql_database creates them
+    path = str(tmp_path / 'web_scraping.db')
+    setup_databases(path)
+    return path
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ResponseArchive(str(tmp_path / 'archive'))
+    yield archive
+    archive.close()
@@ -0,0 +1,26 @@
+from scripts.bulk_writer import BulkWriter
+
+
+def count(writer, table):
+    return writer.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_rollback_drops_the_failed_document(db_path):
+    writer = BulkWriter(db_path)
+    writer.add('soups', {'url': 'https://dhs.gov/a', 'content': 'a', 'url_hash': 'a'})
+    committed = []
+    writer.on_commit(lambda: committed.append('a'))
+
+    savepoint = writer.savepoint()
+    writer.delete('images', 'url_hash = ?', ('b',))
+    writer.add('soups', {'url': 'https://dhs.gov/b', 'content': 'b', 'url_hash': 'b'})
+    writer.add('images', {'url': 'https://dhs.gov/b', 'src': 'b.png', 'url_hash': 'b'})
+    writer.on_commit(lambda: committed.append('b'))
+    writer.rollback_to(savepoint)
+    writer.close()
+
+    writer = BulkWriter(db_path)
+    assert writer.execute('SELECT url_hash FROM soups').fetchall() == [('a',)]
+    assert count(writer, 'images') == 0
+    assert committed == ['a']
+    writer.close()
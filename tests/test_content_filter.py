@@ -0,0 +1,19 @@
+import pytest
+from response_scraper.response_scraper.middlewares import url_pattern
+
+
+@pytest.mark.parametrize('url, pattern', [
+    ('https://dhs.gov', '/'),
+    ('https://dhs.gov/', '/'),
+    ('https://dhs.gov/p12', '/p*'),
+    ('https://dhs.gov/about', '/about'),
+    ('https://dhs.gov/document/123', '/document/*'),
+    ('https://dhs.gov/files/2023/report-1.pdf?download=1', '/files/*/report-*.pdf'),
+])
+def test_url_pattern(url, pattern):
+    assert url_pattern(url) == pattern
+
+
+def test_url_pattern_keeps_distinct_pages_apart():
+    assert url_pattern('https://dhs.gov/document/about') != url_pattern('https://dhs.gov/document/contact')
+    assert url_pattern('https://dhs.gov/video/1') == url_pattern('https://dhs.gov/video/22')
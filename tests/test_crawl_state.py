@@ -0,0 +1,39 @@
+import json
+from response_scraper.response_scraper.crawl_state import CrawlStateStore
+from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+
+
+def write_legacy(directory, urls):
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / 'visited_urls.json').write_text(json.dumps(urls))
+
+
+def test_spider_imports_legacy_urls_from_its_work_dir(tmp_path, monkeypatch):
+    # A visited_urls.json in the cwd belongs to some other crawl
+    monkeypatch.chdir(tmp_path)
+    write_legacy(tmp_path / 'logs', ['https://dhs.gov/elsewhere'])
+    write_legacy(tmp_path / 'shard' / 'logs', ['https://dhs.gov/a', 'https://dhs.gov/b'])
+
+    spider = CustomSpider(work_dir=str(tmp_path / 'shard'))
+    try:
+        assert 'https://dhs.gov/a' in spider.crawl_state
+        assert 'https://dhs.gov/b' in spider.crawl_state
+        assert 'https://dhs.gov/elsewhere' not in spider.crawl_state
+    finally:
+        spider.crawl_state.close()
+        spider.archive.close()
+        spider.archive_writer.close()
+        spider.log_writer.close()
+
+
+def test_legacy_path_defaults_to_the_database_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_legacy(tmp_path / 'logs', ['https://dhs.gov/elsewhere'])
+    write_legacy(tmp_path / 'state', ['https://dhs.gov/a'])
+
+    store = CrawlStateStore(str(tmp_path / 'state' / 'crawl_state.db'))
+    try:
+        assert 'https://dhs.gov/a' in store
+        assert 'https://dhs.gov/elsewhere' not in store
+    finally:
+        store.close()
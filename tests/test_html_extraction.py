@@ -0,0 +1,62 @@
+import time
+from functools import partial
+from scripts.html_extraction import extract_document, extract_or_error, iter_extracted
+
+PAGE = '''<html><head><base href="/docs/"></head><body>
+<h1>Page {i}</h1><img src="logo.png"><a href="next{i}">Next</a>
+<form action="/search"><input name="q" type="text"></form>
+<table><tr><td>{i}</td></tr></table>
+</body></html>'''
+
+
+def make_records(count):
+    return [{'url_hash': f'hash{i}', 'url': f'https://dhs.gov/page{i}', 'body': PAGE.format(i=i).encode(), 'encoding': 'utf-8'}
+            for i in range(count)]
+
+
+def slow_first(record):
+    # Early records finish last, so results arrive out of order
+    time.sleep(0.2 if record['url_hash'] == 'hash0' else 0.01)
+    return extract_document(record)
+
+
+def without_timing(document):
+    return {key: value for key, value in document.items() if key != 'parse_seconds'}
+
+
+def test_parallel_matches_serial():
+    records = make_records(12)
+    serial = list(iter_extracted(records, extract_document))
+    parallel = list(iter_extracted(records, extract_document, workers=3, queue_size=4))
+    assert parallel == serial
+    assert serial[0]['links'][0]['linked_to'] == 'https://dhs.gov/docs/next0'
+
+
+def test_results_keep_record_order():
+    records = make_records(8)
+    documents = iter_extracted(records, slow_first, workers=4, queue_size=8)
+    assert [document['record_hash'] for document in documents] == [record['url_hash'] for record in records]
+
+
+def test_in_flight_is_bounded():
+    pulled = []
+
+    def records():
+        for record in make_records(20):
+            pulled.append(record['url_hash'])
+            yield record
+
+    for received, document in enumerate(iter_extracted(records(), extract_document, workers=2, queue_size=3), 1):
+        # The record waiting for a free place is pulled but not yet submitted
+        assert len(pulled) <= received + 3
+    assert received == 20
+
+
+def test_failed_document_does_not_stop_the_batch():
+    records = make_records(4)
+    records[1] = dict(records[1], body=None)
+    documents = list(iter_extracted(records, partial(extract_or_error, extract_document), workers=2))
+    assert [document['record_hash'] for document in documents] == ['hash0', 'hash1', 'hash2', 'hash3']
+    assert 'AttributeError' in documents[1]['error']
+    assert all('error' not in document for document in documents[:1] + documents[2:])
+    assert without_timing(documents[2]) == extract_document(records[2])
@@ -0,0 +1,79 @@
+from scripts.bulk_writer import BulkWriter
+from scripts.ingest_ledger import IngestLedger, clear_page
+
+
+def add_pages(archive, count):
+    hashes = [archive.add(f'https://dhs.gov/page{i}', f'<p>page {i}</p>') for i in range(count)]
+    archive.commit()
+    return hashes
+
+
+def test_claims_are_exclusive(db_path, archive):
+    hashes = add_pages(archive, 4)
+    first = IngestLedger(db_path, archive, worker_id='first')
+    second = IngestLedger(db_path, archive, worker_id='second')
+    assert first.sync() == 4
+    # A second sync queues nothing new
+    assert second.sync() == 4
+
+    claimed = first.claim(3)
+    assert second.claim(3) == [hashes[3]]
+    assert sorted(claimed + [hashes[3]]) == sorted(hashes)
+    assert second.claim(3) == []
+    first.close()
+    second.close()
+
+
+def test_commit_is_idempotent(db_path, archive):
+    url_hash, = add_pages(archive, 1)
+    ledger = IngestLedger(db_path, archive, worker_id='worker')
+    ledger.sync()
+    assert [record['url_hash'] for record in ledger.iter_claimed()] == [url_hash]
+
+    for attempt in range(2):
+        # A re-run clears what the previous attempt wrote before writing again
+        writer = BulkWriter(db_path)
+        clear_page(writer, url_hash)
+        writer.add('soups', {'url_hash': url_hash, 'url': 'https://dhs.gov/page0', 'content': 'page 0'})
+        ledger.commit(writer, url_hash)
+        writer.close()
+
+    assert ledger.counts() == {'committed': 1}
+    assert ledger.conn.execute('SELECT COUNT(*) FROM soups WHERE url_hash = ?', (url_hash,)).fetchone()[0] == 1
+    # Committed pages are marked processed in the archive, so sync skips them
+    assert ledger.sync() == 0
+    assert ledger.claim() == []
+    ledger.close()
+
+
+def test_release_returns_claims(db_path, archive):
+    add_pages(archive, 2)
+    ledger = IngestLedger(db_path, archive, worker_id='worker')
+    ledger.sync()
+    assert len(ledger.claim()) == 2
+    assert ledger.release() == 2
+    assert ledger.counts() == {'pending': 2}
+    ledger.close()
+
+
+def add_link_graph(writer, url_hash, page, targets):
+    for target in targets:
+        writer.add('links', {'id': target, 'url': target, 'url_hash': url_hash}, or_ignore=True)
+        writer.add('link_urls', {'id': target, 'url': target}, or_ignore=True)
+        writer.add('link_edges', {'from_url_id': page, 'to_url_id': target, 'anchor_text': '', 'url_hash': url_hash}, or_ignore=True)
+    writer.add('link_urls', {'id': page, 'url': page}, or_ignore=True)
+
+
+def test_clear_page_removes_its_link_graph(db_path):
+    writer = BulkWriter(db_path)
+    add_link_graph(writer, 'a', 'page-a', ['only-a', 'shared'])
+    add_link_graph(writer, 'b', 'page-b', ['shared', 'page-a'])
+    writer.flush()
+
+    clear_page(writer, 'a')
+    writer.flush()
+    assert writer.execute('SELECT url_hash FROM link_edges').fetchall() == [('b',), ('b',)]
+    # URLs other pages still link to stay
+    assert writer.execute('SELECT id FROM links ORDER BY id').fetchall() == [('page-a',), ('shared',)]
+    assert writer.execute('SELECT id FROM link_urls ORDER BY id').fetchall() == [('page-a',), ('page-b',), ('shared',)]
+    writer.close()
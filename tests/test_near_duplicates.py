@@ -0,0 +1,44 @@
+import pytest
+from scripts.bulk_writer import BulkWriter
+from scripts.near_duplicates import NearDuplicateFilter, page_fingerprint, with_fingerprint
+
+ARTICLE = ' '.join(f'word{i}' for i in range(200))
+
+
+@pytest.fixture
+def duplicates(db_path):
+    writer = BulkWriter(db_path)
+    yield NearDuplicateFilter(writer)
+    writer.close()
+
+
+@pytest.mark.parametrize('html', [
+    b'',
+    b'<html><body></body></html>',
+    b'<html><body><img src="a.png"><script>var text = "not visible";</script></body></html>',
+])
+def test_textless_pages_have_no_fingerprint(html):
+    assert page_fingerprint(html) is None
+
+
+def test_textless_pages_are_not_duplicates(duplicates):
+    assert duplicates.check('a', 'https://dhs.gov/a.png', page_fingerprint(b'<html></html>')) is None
+    assert duplicates.check('b', 'https://dhs.gov/b.png', page_fingerprint(b'<html><body>&nbsp;</body></html>')) is None
+    assert duplicates.report()['duplicates'] == 0
+    assert len(duplicates.index) == 0
+
+
+def test_near_copy_is_a_duplicate(duplicates):
+    original = page_fingerprint(f'<p>{ARTICLE}</p>'.encode())
+    copy = page_fingerprint(f'<p>{ARTICLE} updated</p>'.encode())
+    other = page_fingerprint(' '.join(f'other{i}' for i in range(200)).encode())
+    assert duplicates.check('a', 'https://dhs.gov/a', original) is None
+    assert duplicates.check('b', 'https://dhs.gov/b', copy, size=100) == 'https://dhs.gov/a'
+    assert duplicates.check('c', 'https://dhs.gov/c', other) is None
+    assert duplicates.report()['bytes_saved'] == 100
+
+
+def test_fingerprinted_in_extraction():
+    record = {'body': f'<p>{ARTICLE}</p>'.encode()}
+    document = with_fingerprint(lambda record: {'url': 'https://dhs.gov/a'}, record)
+    assert document['simhash'] == page_fingerprint(record['body'])
@@ -0,0 +1,78 @@
+import sys
+import sqlite3
+import pytest
+from twisted.internet import defer
+from scrapy.utils.test import get_crawler
+from response_scraper.response_scraper import settings
+from response_scraper.response_scraper.items import ResponseScraperItem
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from response_scraper.response_scraper.pipelines import ResponseScraperPipeline
+from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+
+ARTICLE = ' '.join(f'word{i}' for i in range(200))
+
+
+def test_fallbacks_match_project_settings():
+    # run_spider.py does not load settings.py, so both launch paths must agree
+    pipeline = ResponseScraperPipeline.from_crawler(get_crawler())
+    assert pipeline.db_path == settings.STREAM_PIPELINE_DB_PATH
+    assert pipeline.parser == settings.STREAM_PIPELINE_PARSER
+    assert pipeline.workers == settings.STREAM_PIPELINE_WORKERS
+    assert pipeline.transaction_size == settings.STREAM_PIPELINE_TRANSACTION_SIZE
+    assert pipeline.flush_interval == settings.STREAM_PIPELINE_FLUSH_INTERVAL
+    assert pipeline.near_duplicate_distance == settings.STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE
+
+
+def test_enabled_pipeline_without_scripts_fails(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'scripts', None)
+    with pytest.raises(ImportError, match='STREAM_PIPELINE_ENABLED'):
+        ResponseScraperPipeline.from_crawler(get_crawler())
+
+
+def crawl_pages(tmp_path, pages, **settings):
+    # Items through process_item, with extraction run in this process
+    crawler = get_crawler(settings_dict=dict(settings, STREAM_PIPELINE_DB_PATH=str(tmp_path / 'web_scraping.db')))
+    pipeline = ResponseScraperPipeline.from_crawler(crawler)
+    pipeline.extract = lambda record: defer.succeed(pipeline.extractor(record))
+    spider = CustomSpider(work_dir=str(tmp_path))
+    pipeline.open_spider(spider)
+    for url, body in pages:
+        url_hash = spider.archive.hash_url(url)
+        results = []
+        pipeline.process_item(ResponseScraperItem(url=url, url_hash=url_hash, status=200, headers={}, encoding='utf-8', body=body,
+                                                  depth=0, fetched_at=0, content_hash=url_hash), spider).addBoth(results.append)
+        assert isinstance(results[0], ResponseScraperItem)
+    pipeline.close_spider(spider)
+    spider.closed('finished')
+
+    conn = sqlite3.connect(str(tmp_path / 'web_scraping.db'))
+    soups = [row[0] for row in conn.execute('SELECT url FROM soups ORDER BY id')]
+    duplicates = dict(conn.execute('SELECT url, duplicate_of FROM page_fingerprints'))
+    ledger = dict(conn.execute('SELECT state, COUNT(*) FROM ingest_ledger GROUP BY state'))
+    conn.close()
+    return soups, duplicates, ledger, crawler.stats.get_stats()
+
+
+def test_near_duplicates_are_not_stored(tmp_path):
+    soups, duplicates, ledger, stats = crawl_pages(tmp_path, [
+        ('https://dhs.gov/a', f'<p>{ARTICLE}</p>'.encode()),
+        ('https://dhs.gov/a?print=1', f'<p>{ARTICLE} printed</p>'.encode()),
+        ('https://dhs.gov/logo', b'<img src="logo.png">'),
+        ('https://dhs.gov/banner', b'<img src="banner.png">'),
+    ])
+    # Textless pages are stored too, never matched to each other
+    assert soups == ['https://dhs.gov/a', 'https://dhs.gov/logo', 'https://dhs.gov/banner']
+    assert duplicates['https://dhs.gov/a?print=1'] == ResponseArchive.hash_url('https://dhs.gov/a')
+    assert duplicates['https://dhs.gov/banner'] is None
+    assert stats['stream_pipeline/near_duplicates'] == 1
+    assert stats['stream_pipeline/documents'] == 3
+    assert ledger == {'committed': 4}
+
+
+def test_near_duplicate_filter_can_be_disabled(tmp_path):
+    soups, duplicates, ledger, stats = crawl_pages(tmp_path, [
+        ('https://dhs.gov/a', f'<p>{ARTICLE}</p>'.encode()),
+        ('https://dhs.gov/b', f'<p>{ARTICLE}</p>'.encode()),
+    ], STREAM_PIPELINE_NEAR_DUPLICATE_DISTANCE='')
+    assert soups == ['https://dhs.gov/a', 'https://dhs.gov/b']
+    assert duplicates == {}
@@ -0,0 +1,23 @@
+import sqlite3
+from scripts.process_first_batch import process_html_files
+
+PAGE = '<h1>Page {i}</h1><a href="/next{i}">Next</a><form><input name="q"></form>'
+
+
+def test_first_batch_reads_the_archive(db_path, archive, capsys):
+    for i in range(6):
+        archive.add(f'https://dhs.gov/p{i}', PAGE.format(i=i))
+    archive.commit()
+
+    for run in range(2):
+        process_html_files(archive.archive_dir, db_path, batch_size=4)
+
+    conn = sqlite3.connect(db_path)
+    assert [row[0] for row in conn.execute('SELECT url FROM soups ORDER BY url')] == [f'https://dhs.gov/p{i}' for i in range(4)]
+    # Running it again replaces the rows instead of adding to them
+    assert conn.execute('SELECT COUNT(*) FROM forms').fetchone()[0] == 4
+    conn.close()
+    # One short line per page, not the page content
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Processing response: https://dhs.gov/p0 (0 images, 1 forms, 1 links, 0 tables)'
+    assert not any('<h1>' in line for line in lines)
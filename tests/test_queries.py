@@ -0,0 +1,37 @@
+import sqlite3
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from scripts.bulk_writer import BulkWriter
+from scripts.process_html_files import process_html_files
+from scripts.queries import get_pages_linking_to, get_links_to, get_link_names, hash_url
+
+PAGE = b'<html><body><a href="/target">Target</a><a href="https://dhs.gov/other">Other</a></body></html>'
+
+
+def test_backlink_of_ingested_page(tmp_path, db_path):
+    archive = ResponseArchive(str(tmp_path / 'archive'))
+    archive.add('https://dhs.gov/source', PAGE)
+    archive.close()
+    process_html_files(archive_dir=str(tmp_path / 'archive'), db_path=db_path)
+
+    conn = sqlite3.connect(db_path)
+    assert get_pages_linking_to(conn, 'https://dhs.gov/target') == ['https://dhs.gov/source']
+    assert get_pages_linking_to(conn, 'https://dhs.gov/missing') == []
+    conn.close()
+
+
+def test_backlink_from_link_graph(db_path):
+    # Rows as parse_and_store.store_data writes them
+    writer = BulkWriter(db_path)
+    for page, targets in [('https://dhs.gov/a', ['https://dhs.gov/target']), ('https://dhs.gov/b', ['https://dhs.gov/target', 'https://dhs.gov/a'])]:
+        writer.add('link_urls', {'id': hash_url(page), 'url': page}, or_ignore=True)
+        for target in targets:
+            writer.add('link_urls', {'id': hash_url(target), 'url': target}, or_ignore=True)
+            writer.add('link_edges', {'from_url_id': hash_url(page), 'to_url_id': hash_url(target), 'anchor_text': 'Target'}, or_ignore=True)
+    writer.close()
+
+    conn = sqlite3.connect(db_path)
+    # Looked up under the canonical spelling
+    assert get_pages_linking_to(conn, 'https://www.dhs.gov/target') == ['https://dhs.gov/a', 'https://dhs.gov/b']
+    assert get_links_to(conn, 'https://dhs.gov/b') == ['https://dhs.gov/target', 'https://dhs.gov/a']
+    assert get_link_names(conn, 'https://dhs.gov/target') == ['Target']
+    conn.close()
@@ -0,0 +1,43 @@
+import sqlite3
+import pytest
+from scripts.read_sql_tables import export_table
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = sqlite3.connect(db_path)
+    # linked_from is NULL throughout, and so typed as text in the export
+    conn.executemany('INSERT INTO links (id, url, names, linked_to, url_hash) VALUES (?, ?, ?, ?, ?)',
+                     [(f'link-{i}', f'https://dhs.gov/{i}', f'page {i}', 'https://dhs.gov/', f'hash-{i}') for i in range(5)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def read_export(path, file_format):
+    if file_format == 'parquet':
+        return pq.read_table(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_export_round_trip(conn, tmp_path, file_format):
+    # The export directory does not exist yet, and chunks of 2 rows make three batches
+    path = str(tmp_path / 'exports' / f'links.{file_format}')
+    assert export_table(conn, 'links', path, file_format, chunk_size=2) == 5
+
+    table = read_export(path, file_format)
+    assert table.column_names == ['id', 'url', 'names', 'linked_to', 'linked_from', 'url_hash']
+    assert table.schema.field('linked_from').type == pa.string()
+    assert table.column('url').to_pylist() == [f'https://dhs.gov/{i}' for i in range(5)]
+    assert table.column('linked_from').to_pylist() == [None] * 5
+
+
+def test_unsupported_format_fails_before_writing(conn, tmp_path):
+    with pytest.raises(ValueError, match='Unsupported format'):
+        export_table(conn, 'links', str(tmp_path / 'exports' / 'links.csv'), 'csv')
+    assert not (tmp_path / 'exports').exists()
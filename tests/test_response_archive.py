@@ -0,0 +1,50 @@
+import scrapy
+from response_scraper.response_scraper.canonical import canonicalize_url
+from response_scraper.response_scraper.response_archive import ResponseArchive
+from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+
+PAGE = b'<html><body><a href="/news">News</a><a href="https://example.org/">Elsewhere</a></body></html>'
+
+
+def test_round_trip(archive):
+    url_hash = archive.add('https://dhs.gov/', PAGE, headers={'Content-Type': 'text/html'}, encoding='utf-8')
+    archive.commit()
+
+    record = archive.get(url_hash)
+    assert record['url'] == 'https://dhs.gov/'
+    assert record['body'] == PAGE
+    assert record['encoding'] == 'utf-8'
+    assert archive.get_url('https://dhs.gov/')['body'] == PAGE
+    assert url_hash in archive
+
+
+def test_same_body_keeps_processed(archive):
+    url_hash = archive.add('https://dhs.gov/', PAGE)
+    archive.mark_processed(url_hash)
+    archive.add('https://dhs.gov/', PAGE)
+    archive.commit()
+    assert [record['url_hash'] for record in archive.iter_responses(pending_only=True)] == []
+
+    archive.add('https://dhs.gov/', PAGE + b'<p>changed</p>')
+    archive.commit()
+    assert [record['url_hash'] for record in archive.iter_responses(pending_only=True)] == [url_hash]
+
+
+def test_start_requests_replay_archived_page(tmp_path):
+    # The spider looks start URLs up by their canonical form
+    url = 'https://www.dhs.gov/'
+    archive = ResponseArchive(str(tmp_path / 'output' / 'archive'))
+    archive.add(canonicalize_url(url), PAGE)
+    archive.close()
+
+    spider = CustomSpider(start_urls=[url], tree_depth=1, work_dir=str(tmp_path))
+    try:
+        requests = list(spider.start_requests())
+    finally:
+        spider.closed('finished')
+
+    # Only the archived page's allowed link is requested, not the page itself
+    assert [request.url for request in requests] == ['https://www.dhs.gov/news']
+    assert isinstance(requests[0], scrapy.Request)
+    assert requests[0].meta['depth'] == 1
+    assert requests[0].errback == spider.errback_httpbin
@@ -0,0 +1,58 @@
+import os
+import sys
+import ast
+import inspect
+import subprocess
+import scrapy
+from scrapy.core.downloader import Downloader, Slot as DownloaderSlot
+from scrapy.core.engine import Slot as EngineSlot
+from scrapy.utils.reactor import CallLaterOnce
+from scrapy.utils.test import get_crawler
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_scrapy_internals_used_by_the_throttle():
+    # DomainThrottleQueue and PerDomainThrottleMiddleware rely on these; a
+    # Scrapy upgrade that drops one has to fail here, not slow crawls down
+    message = f'changed in Scrapy {scrapy.__version__}'
+    assert 'nextcall' in inspect.signature(EngineSlot.__init__).parameters, message
+    assert callable(getattr(CallLaterOnce, 'schedule', None)), message
+
+    downloader = Downloader(get_crawler())
+    try:
+        assert isinstance(downloader.slots, dict), message
+        assert isinstance(downloader.per_slot_settings, dict), message
+    finally:
+        downloader.close()
+    slot = DownloaderSlot(concurrency=1, delay=0, randomize_delay=False)
+    for attribute in ('active', 'concurrency', 'delay'):
+        assert hasattr(slot, attribute), message
+
+
+def crawl_paced_site(work_dir):
+    # Runs in its own process, since the reactor cannot be restarted
+    import time
+    from urllib.parse import urlsplit
+    from scrapy.crawler import CrawlerProcess
+    from scripts.synthetic_site import MockSite
+    from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+    with MockSite(domains=2, pages_per_domain=10, latency=0, jitter=0) as site:
+        process = CrawlerProcess({'LOG_LEVEL': 'WARNING', 'TELNETCONSOLE_ENABLED': False, 'STREAM_PIPELINE_ENABLED': False,
+                                  'METRICS_TEXTFILE': f'{work_dir}/crawl.prom', 'CONCURRENT_REQUESTS': 2,
+                                  'DOMAIN_THROTTLE_START_RATE': 5, 'DOMAIN_THROTTLE_MAX_RATE': 5, 'DOMAIN_THROTTLE_BURST': 1})
+        crawler = process.create_crawler(CustomSpider)
+        process.crawl(crawler, start_urls=[f'{host}/' for host in site.hosts], tree_depth=10,
+                      allowed_domains=[urlsplit(host).netloc for host in site.hosts], work_dir=work_dir)
+        start = time.perf_counter()
+        process.start()
+        return site.stats['statuses'].get(200, 0), time.perf_counter() - start
+
+
+def test_queue_paces_each_domain(tmp_path):
+    script = f'from tests.test_throttle_queue import crawl_paced_site; print(crawl_paced_site({str(tmp_path)!r}))'
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    pages, seconds = ast.literal_eval(result.stdout.strip().splitlines()[-1])
+    assert pages == 20
+    # 10 pages per domain at 5 per second, the two domains side by side
+    assert 1.6 <= seconds < 10
@@ -0,0 +1,106 @@
+import os
+import sys
+import ast
+import time
+import subprocess
+import pytest
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from response_scraper.response_scraper import settings
+from response_scraper.response_scraper.middlewares import ThrottleRetryMiddleware
+from response_scraper.response_scraper.spiders.custom_spider import CustomSpider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def spider(tmp_path):
+    spider = CustomSpider(work_dir=str(tmp_path))
+    yield spider
+    spider.closed('finished')
+
+
+@pytest.fixture
+def middleware():
+    return ThrottleRetryMiddleware.from_crawler(get_crawler(CustomSpider, {'THROTTLE_RETRY_MAX_ATTEMPTS': 2}))
+
+
+def followed_request(spider):
+    page = HtmlResponse(url='https://dhs.gov/', body=b'<a href="/news">News</a>', encoding='utf-8')
+    return spider.follow(page, 'https://dhs.gov/news', 1)
+
+
+def throttled(request, status=429, retry_after=b'5'):
+    return HtmlResponse(url=request.url, status=status, headers={'Retry-After': retry_after}, body=b'', request=request)
+
+
+def test_throttled_statuses_are_not_retried_immediately():
+    assert 429 not in settings.RETRY_HTTP_CODES
+    assert 503 not in settings.RETRY_HTTP_CODES
+
+
+def test_followed_link_is_requeued(spider, middleware):
+    request = followed_request(spider)
+    assert request.errback == spider.errback_httpbin
+
+    retry = middleware.process_response(request, throttled(request), spider)
+    # Returning a request sends it back to the scheduler, where
+    # DomainThrottleQueue holds it until retry_not_before
+    assert retry is not request
+    assert retry.url == 'https://dhs.gov/news'
+    assert retry.dont_filter
+    assert retry.meta['depth'] == 1
+    assert retry.meta['throttle_retry_times'] == 1
+    assert retry.meta['retry_not_before'] == pytest.approx(time.time() + 5, abs=1)
+    assert retry.callback == spider.parse
+    assert retry.errback == spider.errback_httpbin
+
+
+def test_503_without_retry_after_backs_off(spider, middleware):
+    request = followed_request(spider)
+    retry = middleware.process_response(request, throttled(request, 503, b''), spider)
+    assert time.time() <= retry.meta['retry_not_before'] <= time.time() + 2.0
+
+
+def test_gives_up_after_max_attempts(spider, middleware):
+    request = followed_request(spider)
+    for attempt in range(2):
+        request = middleware.process_response(request, throttled(request), spider)
+    response = throttled(request)
+    # Passed on to HttpErrorMiddleware and the errback, not to RetryMiddleware
+    assert middleware.process_response(request, response, spider) is response
+    assert request.meta['dont_retry']
+
+
+def test_other_responses_pass_through(spider, middleware):
+    request = followed_request(spider)
+    response = HtmlResponse(url=request.url, status=200, body=b'', request=request)
+    assert middleware.process_response(request, response, spider) is response
+    request.meta['dont_retry'] = True
+    response = throttled(request)
+    assert middleware.process_response(request, response, spider) is response
+
+
+def crawl_throttled_site(work_dir):
+    # Runs in its own process, since the reactor cannot be restarted. Like
+    # run_spider.py from the repository root, settings.py is not loaded.
+    from urllib.parse import urlsplit
+    from scrapy.crawler import CrawlerProcess
+    from scripts.synthetic_site import MockSite
+    with MockSite(domains=1, pages_per_domain=5, latency=0, jitter=0, rate_429=1.0, retry_after=0) as site:
+        process = CrawlerProcess({'LOG_LEVEL': 'WARNING', 'TELNETCONSOLE_ENABLED': False, 'STREAM_PIPELINE_ENABLED': False,
+                                  'METRICS_TEXTFILE': f'{work_dir}/crawl.prom', 'THROTTLE_RETRY_BASE_DELAY': 0.1,
+                                  'DOMAIN_THROTTLE_START_RATE': 50, 'DOMAIN_THROTTLE_MIN_RATE': 20, 'DOMAIN_THROTTLE_MAX_RATE': 50})
+        crawler = process.create_crawler(CustomSpider)
+        process.crawl(crawler, start_urls=[site.hosts[0] + '/'], allowed_domains=[urlsplit(site.hosts[0]).netloc], work_dir=work_dir)
+        process.start()
+        stats = crawler.stats.get_stats()
+        return site.stats['requests'], stats.get('throttle_retry/count', 0), stats.get('retry/count', 0)
+
+
+def test_throttled_request_is_retried_at_most_max_attempts(tmp_path):
+    script = f'from tests.test_throttle_retry import crawl_throttled_site; print(crawl_throttled_site({str(tmp_path)!r}))'
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    requests, throttle_retries, retries = ast.literal_eval(result.stdout.strip().splitlines()[-1])
+    # The first request and THROTTLE_RETRY_MAX_ATTEMPTS retries, none of them by RetryMiddleware
+    assert (requests, throttle_retries, retries) == (4, 3, 0)